@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Throughput of the sync query functions (models.py, one thread and session per client) against the async
+# ones (async_models.py, one task and session per client) with several clients at once. Each client sends
+# requests back to back until all of them are answered; every workload runs at every --clients level.
+# The "+ I/O" workloads wait --io-ms after the query, like a handler that calls out to a messaging API,
+# which is where the event loop should pay off. Uses the seeded databases of benchmark.py, results are
+# appended to a JSON file like the other benchmarks.
+#
+#   python async_benchmark.py 100k --clients 1,8,32 --requests 2000 --io-ms 20
+
+RESULTS_FILE = 'async_benchmark_results.json'
+
+
+def workloads(samples, io_seconds):  # list of (name, sync fn(i), async fn(i)); i is the number of the request
+    import models
+    import async_models
+    import daily_tasks
+
+    def sync_io(fn):
+        def call(i):
+            fn(i)
+            time.sleep(io_seconds)
+        return call
+
+    def async_io(fn):
+        async def call(i):
+            await fn(i)
+            await asyncio.sleep(io_seconds)
+        return call
+
+    email = lambda i: samples['emails'][i % len(samples['emails'])]
+    prefix = lambda i: samples['names'][i % len(samples['names'])][:3]
+    sync_lookup = lambda i: models.get_member_by_email(email(i))
+    async_lookup = lambda i: async_models.get_member_by_email(email(i))
+    return [
+        ('get_member_by_email', sync_lookup, async_lookup),
+        ('search_members', lambda i: models.search_members(prefix(i)), lambda i: async_models.search_members(prefix(i))),
+        ('married_members', lambda i: models.married_members(), lambda i: async_models.married_members()),
+        ('resolve_recipients', lambda i: daily_tasks.resolve_recipients(), lambda i: async_models.resolve_recipients()),
+        ('get_member_by_email + I/O', sync_io(sync_lookup), async_io(async_lookup)),
+    ]
+
+
+def _result(latencies, seconds):
+    from benchmark import _percentile
+    latencies.sort()
+    return {'requests': len(latencies), 'seconds': round(seconds, 3),
+            'requests_per_second': round(len(latencies) / seconds, 1),
+            'p50_ms': round(_percentile(latencies, 50) * 1000, 3), 'p95_ms': round(_percentile(latencies, 95) * 1000, 3)}
+
+
+def run_sync(fn, clients, requests):  # clients threads, each with its own session, taking requests from a shared counter
+    from database import session
+    from models import member_cache, event_cache
+    member_cache.clear()  # every run starts cold, the lookups go to the database
+    event_cache.clear()
+    counter, lock, latencies = iter(range(requests)), threading.Lock(), []
+
+    def client():
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                started = time.perf_counter()
+                fn(i)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+        finally:
+            session.remove()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for future in [pool.submit(client) for _ in range(clients)]:
+            future.result()
+    return _result(latencies, time.perf_counter() - started)
+
+
+async def run_async(fn, clients, requests):  # clients tasks, each with its own session, on one event loop
+    from async_models import task_scope
+    from models import member_cache, event_cache
+    member_cache.clear()
+    event_cache.clear()
+    counter, latencies = iter(range(requests)), []
+
+    async def client():
+        async with task_scope():
+            for i in counter:  # shared by the tasks, each request is taken once
+                started = time.perf_counter()
+                await fn(i)
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return _result(latencies, time.perf_counter() - started)
+
+
+def run(size, members, seed, database, clients_levels, requests, io_ms):
+    from benchmark import prepare_database
+    from database import session, dispose_async_engines
+    from models import Member
+    import sqlalchemy
+
+    prepare_database(database, members, seed)
+    rows = session.query(Member.email, Member.first_name).filter(Member.email.isnot(None)).\
+        order_by(Member.id).limit(max(requests, 1)).all()
+    samples = {'emails': [email for email, _ in rows], 'names': [name for _, name in rows]}
+    session.remove()
+
+    async def run_all_async(jobs):  # one event loop for every async run, the engine's connections belong to it
+        try:
+            return [await run_async(fn, clients, count) for fn, clients, count in jobs]
+        finally:
+            await dispose_async_engines()
+
+    results, plan = {}, []
+    for name, sync_fn, async_fn in workloads(samples, io_ms / 1000):
+        heavy = name in ('married_members', 'resolve_recipients')  # whole-table queries, fewer requests
+        count = max(requests // 20, 1) if heavy else requests
+        for clients in clients_levels:
+            plan.append((name, clients, sync_fn, async_fn, count))
+    sync_results = [run_sync(sync_fn, clients, count) for name, clients, sync_fn, async_fn, count in plan]
+    async_results = asyncio.run(run_all_async([(async_fn, clients, count) for name, clients, sync_fn, async_fn, count in plan]))
+
+    for (name, clients, _, _, _), sync_result, async_result in zip(plan, sync_results, async_results):
+        results.setdefault(name, {})[str(clients)] = {'sync': sync_result, 'async': async_result}
+        print(f"{name:<28}{clients:>4} clients   sync {sync_result['requests_per_second']:>9.1f}/s "
+              f"p95 {sync_result['p95_ms']:>9.2f} ms   async {async_result['requests_per_second']:>9.1f}/s "
+              f"p95 {async_result['p95_ms']:>9.2f} ms")
+
+    from startup_benchmark import git_commit
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'size': size,
+        'members': members,
+        'seed': seed,
+        'io_ms': io_ms,
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'benchmarks': results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the sync and async query functions under concurrent load.')
+    parser.add_argument('size', nargs='?', default='1k', help="1k, 100k, 1m or a number of members")
+    parser.add_argument('--seed', type=int, default=2024)  # seed_data.SEED, not imported yet
+    parser.add_argument('--clients', default='1,8,32', help='comma separated numbers of concurrent clients')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per run (a twentieth for the whole-table queries)')
+    parser.add_argument('--io-ms', type=float, default=20.0, help='simulated network wait of the + I/O workloads')
+    parser.add_argument('--database', default=None, help='SQLite file to use, kept between runs (default: the one benchmark.py uses)')
+    parser.add_argument('--output', default=RESULTS_FILE, help='JSON file the result is appended to')
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.gettempdir(), f"organize_benchmark_{args.size}_{args.seed}.db")
+    os.environ['ORG_DATABASE_URL'] = f"sqlite:///{os.path.abspath(database)}"  # before anything imports database.py
+    from seed_data import SIZES
+    members = SIZES.get(args.size.lower()) or int(args.size)
+    result = run(args.size, members, args.seed, database, [int(clients) for clients in args.clients.split(',')],
+                 args.requests, args.io_ms)
+
+    history = []
+    if os.path.exists(args.output):
+        with open(args.output) as file:
+            history = json.load(file)
+    history.append(result)
+    with open(args.output, 'w') as file:
+        json.dump(history, file, indent=2)
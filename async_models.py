@@ -0,0 +1,294 @@
+import asyncio
+import contextlib
+from sqlalchemy import select, func, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, async_scoped_session
+import database
+from database import get_async_engine
+from models import Member, Event, Demographics, DemographicSummary, Segment, SegmentMember
+from models import Marital_Status, EducationLevel, Yes_No, Involvement
+from models import member_cache, event_cache, _detached_copy, _fts_query, birthday_filter, recipients_from_groups, stored_forms
+from models import DemographicStats, EVENT_FIELDS, _filtered, add_summary_count
+from cache import _MISSING
+
+# The query functions of models.py for asyncio code, e.g. a kiosk server answering several clients at once or
+# a job that loads recipients while messages are going out. Same names, arguments and results as in models.py,
+# awaited instead of called; they run on the async engine of database.py (SQLite through aiosqlite), so the
+# event loop keeps going while a query waits for the database.
+#
+# Every task gets its own session (async_session is scoped to asyncio.current_task), like every thread does
+# in models.py. A task closes it with task_scope() when it is done with the database:
+#
+#   async def handle(email):
+#       async with task_scope():
+#           return await get_member_by_email(email)
+#
+# The lookups share the caches of models.py, so a sync edit empties them for both. async_benchmark.py
+# compares the throughput of both versions under concurrent load.
+
+AsyncSession = async_sessionmaker(expire_on_commit=False)  # results stay readable after the session is closed
+async_session = async_scoped_session(lambda: AsyncSession(bind=get_async_engine()), scopefunc=asyncio.current_task)
+
+
+@contextlib.asynccontextmanager
+async def task_scope():  # the current task's session, closed (and its connection returned to the pool) on the way out
+    try:
+        yield async_session()
+    finally:
+        await async_session.remove()
+
+
+async def _cached(cache, key, fetch, row_id_fn=lambda value: getattr(value, 'id', None), copy_fn=_detached_copy):
+    # the read-through of cache.cached_lookup for coroutines: fetch() is only awaited on a miss
+    generation = cache.generation  # before the read, see LookupCache.put
+    value = cache.get(key)
+    if value is _MISSING:
+        value = await fetch()
+        if value is not None:
+            value = copy_fn(value)
+        cache.put(key, value, row_id_fn(value) if value is not None else None, generation)
+    return value
+
+
+""" Queries """
+async def get_all_events():
+    try:
+        result = (await async_session.execute(select(Event))).scalars().all()
+        return result, len(result)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve events: {e}")
+
+async def get_event_by_name(ename):
+    async def fetch():
+        return (await async_session.execute(select(Event).filter_by(name=ename).limit(1))).scalar()
+    try:
+        found = await _cached(event_cache, ('name', ename), fetch)
+        if found:
+            return found
+        else:
+            raise RuntimeError(f"event with name '{ename}' not found")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve event with name '{ename}': {e}")
+
+async def get_event_by_date(date):
+    try:
+        found = (await async_session.execute(select(Event).filter_by(event_date=date).limit(1))).scalar()
+        if found:
+            return found
+        else:
+            raise RuntimeError(f"event with date '{date}' not found")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve event with date '{date}': {e}")
+
+async def get_all_members():
+    try:
+        result = (await async_session.execute(select(Member))).scalars().all()
+        return result, len(result)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve members: {e}")
+
+async def get_member_by_email(email):
+    async def fetch():
+        return (await async_session.execute(select(Member).filter_by(email=email).limit(1))).scalar()
+    try:
+        return await _cached(member_cache, ('email', email), fetch)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve member with email '{email}': {e}")
+
+async def get_member_by_names(fname, lname):
+    async def fetch():
+        return (await async_session.execute(select(Member).filter_by(first_name=fname, last_name=lname).limit(1))).scalar()
+    try:
+        return await _cached(member_cache, ('names', fname, lname), fetch)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve member with names '{fname, lname}': {e}")
+
+async def find_member_id(fname, lname, dob):
+    async def fetch():
+        return (await async_session.execute(select(Member.id).filter_by(first_name=fname, last_name=lname,
+                                                                        date_of_birth=dob).limit(1))).scalar()
+    try:
+        return await _cached(member_cache, ('identity', fname, lname, str(dob)), fetch,
+                             row_id_fn=lambda member_id: member_id, copy_fn=lambda member_id: member_id)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve member '{fname} {lname}': {e}")
+
+async def find_event_id(ename, edate):
+    async def fetch():
+        return (await async_session.execute(select(Event.id).filter_by(name=ename, event_date=edate).limit(1))).scalar()
+    try:
+        return await _cached(event_cache, ('identity', ename, str(edate)), fetch,
+                             row_id_fn=lambda event_id: event_id, copy_fn=lambda event_id: event_id)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve event '{ename}' on '{edate}': {e}")
+
+async def search_members(search_text, limit=50):  # best matches first, rows of (id, first_name, last_name, email, phone_number)
+    query = _fts_query(search_text)
+    if not query:
+        return []
+    try:
+        return (await async_session.execute(text(
+            "SELECT members.id, members.first_name, members.last_name, members.email, members.phone_number "
+            "FROM members_fts JOIN members ON members.id = members_fts.rowid "
+            "WHERE members_fts MATCH :query ORDER BY members_fts.rank LIMIT :limit"),
+            {'query': query, 'limit': limit})).all()
+    except Exception as e:
+        print(f"An error occurred while searching members: {e}")
+        raise RuntimeError(f"Failed to search members for '{search_text}': {e}")
+
+async def search_events(search_text, limit=50):  # best matches first, rows of (id, name, event_date, location, description)
+    query = _fts_query(search_text)
+    if not query:
+        return []
+    try:
+        return (await async_session.execute(text(
+            "SELECT events.id, events.name, events.event_date, events.location, events.description "
+            "FROM events_fts JOIN events ON events.id = events_fts.rowid "
+            "WHERE events_fts MATCH :query ORDER BY events_fts.rank LIMIT :limit"),
+            {'query': query, 'limit': limit})).all()
+    except Exception as e:
+        print(f"An error occurred while searching events: {e}")
+        raise RuntimeError(f"Failed to search events for '{search_text}': {e}")
+
+async def count_members(criteria=None):  # criteria as in models.count_members
+    try:
+        return (await async_session.execute(_filtered(select(func.count(Member.id)), criteria))).scalar()
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to count members: {e}")
+
+async def count_events(criteria=None):
+    try:
+        return (await async_session.execute(_filtered(select(func.count(Event.id)), criteria, EVENT_FIELDS))).scalar()
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to count events: {e}")
+
+async def get_upcoming_birthdays(days=0, today=None):  # members whose birthday falls between today and today + days
+    try:
+        result = (await async_session.execute(select(Member).where(birthday_filter(days, today)).
+                                              order_by(Member.birth_mmdd))).scalars().all()
+        return result, len(result)
+    except Exception as e:
+        print(f"An error occurred while querying birthdays: {e}")
+        raise RuntimeError(f"Failed to retrieve upcoming birthdays: {e}")
+
+
+""" Demographic queries """
+async def _demographic_rows(condition, *columns):  # see models._demographic_rows
+    return [tuple(row) for row in await async_session.execute(
+        select(*columns).select_from(Member).join(Demographics, Demographics.member_id == Member.id).where(condition))]
+
+async def married_members():
+    try:
+        result = await _demographic_rows(Demographics.marital_status == Marital_Status.Married,
+                                         Member.id, Member.first_name, Member.last_name, Member.join_date)
+        return result, len(result)
+    except Exception as e:
+        print(f"An error occurred while querying married members: {e}")
+        raise RuntimeError(f"Failed to retrieve married members: {e}")
+
+async def children_query():
+    try:
+        result = await _demographic_rows(Demographics.children >= 1,
+                                         Member.id, Member.first_name, Member.last_name, Demographics.children)
+        return result, len(result)
+    except Exception as e:
+        print(f"An error occurred while querying members with children: {e}")
+        raise RuntimeError(f"Failed to retrieve members with children: {e}")
+
+async def uneducated_members():
+    try:
+        result = await _demographic_rows(Demographics.education_level.in_(stored_forms(EducationLevel.No_Matric)),
+                                         Member.id, Member.first_name, Member.last_name, Member.phone_number)
+        return result, len(result)
+    except Exception as e:
+        print(f"An error occurred while querying uneducated members: {e}")
+        raise RuntimeError(f"Failed to retrieve uneducated members: {e}")
+
+async def educated_members():
+    try:
+        result = await _demographic_rows(Demographics.education_level.notin_(stored_forms(EducationLevel.No_Matric)),
+                                         Member.id, Member.first_name, Member.last_name, Member.phone_number)
+        return result, len(result)
+    except Exception as e:
+        print(f"An error occurred while querying educated members: {e}")
+        raise RuntimeError(f"Failed to retrieve educated members: {e}")
+
+async def disabled_members():
+    try:
+        result = await _demographic_rows(Demographics.disabilities == Yes_No.Yes,
+                                         Member.id, Member.first_name, Member.last_name, Member.phone_number)
+        return result, len(result)
+    except Exception as e:
+        print(f"An error occurred while querying disabled members: {e}")
+        raise RuntimeError(f"Failed to retrieve disabled members: {e}")
+
+async def office_bearers():
+    try:
+        columns = (Member.id, Member.first_name, Member.last_name, Member.phone_number, Demographics.involvement)
+        result = await _demographic_rows(Demographics.involvement == Involvement.Server, *columns)
+        result2 = await _demographic_rows(Demographics.involvement == Involvement.Officer, *columns)
+        return result, result2, len(result), len(result2)
+    except Exception as e:
+        print(f"An error occurred while querying serving members: {e}")
+        raise RuntimeError(f"Failed to retrieve serving members: {e}")
+
+async def demographic_summary():  # {dimension: {enum name or stored value: members}} read from demographic_summary
+    try:
+        summary = {}
+        for dimension, value, members in await async_session.execute(
+                select(DemographicSummary.dimension, DemographicSummary.value, DemographicSummary.members).
+                where(DemographicSummary.members != 0)):
+            add_summary_count(summary, dimension, value, members)
+        return summary
+    except Exception as e:
+        print(f"An error occurred while reading the demographic summary: {e}")
+        raise RuntimeError(f"Failed to read the demographic summary: {e}")
+
+async def demographic_stats():  # the counts of the stats screen, see models.demographic_stats
+    summary = await demographic_summary()
+    education = summary.get('education_level', {})
+    return DemographicStats(
+        members=summary.get('members', {}).get('', 0),
+        married=summary.get('marital_status', {}).get(Marital_Status.Married.name, 0),
+        with_children=sum(count for bucket, count in summary.get('children', {}).items() if bucket not in ('', '0')),
+        uneducated=education.get(EducationLevel.No_Matric.name, 0),
+        educated=sum(count for level, count in education.items() if level not in ('', EducationLevel.No_Matric.name)),
+        disabled=summary.get('disabilities', {}).get(Yes_No.Yes.name, 0),
+        servers=summary.get('involvement', {}).get(Involvement.Server.name, 0),
+        officers=summary.get('involvement', {}).get(Involvement.Officer.name, 0))
+
+
+""" Recipients """
+async def phone_number_groups(member_ids=None):  # see models.phone_number_groups
+    try:
+        query = select(Member.phone_e164, func.count()).where(Member.phone_number.isnot(None))
+        if member_ids is not None:
+            query = query.where(Member.id.in_(member_ids))
+        return (await async_session.execute(query.group_by(Member.phone_e164))).all()
+    except Exception as e:
+        print(f"An error occurred while grouping phone numbers: {e}")
+        raise RuntimeError(f"Failed to group phone numbers: {e}")
+
+def _refresh_segment(name):  # on a worker thread: the refresh writes, and the segment code uses the sync session
+    from segments import refresh_segments
+    try:
+        refresh_segments([name])
+    finally:
+        database.session.remove()
+
+async def segment_member_ids(name):  # select of the member ids in a segment, refreshed first
+    await asyncio.to_thread(_refresh_segment, name)
+    return select(SegmentMember.member_id).join(Segment, Segment.id == SegmentMember.segment_id).where(Segment.name == name)
+
+async def resolve_recipients(segment=None):  # (distinct E.164 numbers, stats), like daily_tasks.resolve_recipients
+    member_ids = await segment_member_ids(segment) if segment else None
+    return recipients_from_groups(await phone_number_groups(member_ids))
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tempfile
+import tracemalloc
+
+# Benchmark suite for the query functions in models.py and the import and reminder paths.
+# The database is filled by seed_data.py (1k/100k/1m members, same seed = same data) and kept between
+# runs, so only the first run at a size pays for generating it. Every benchmark reports p50/p95 latency
+# and the peak Python memory of one call; results are appended to a JSON file so runs can be compared
+# between commits, like startup_benchmark.py does for start-up time.
+#
+#   python benchmark.py 100k --iterations 20 --max-regression 25
+
+RESULTS_FILE = 'benchmark_results.json'
+HEAVY_ITERATIONS = 3  # for the calls that load every member as an object
+IMPORT_ROWS = 10000  # rows in each import file
+IMPORT_TAG = 'benchimport'  # emails of imported rows start with this, they are deleted again afterwards
+
+
+def _percentile(samples, percent):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[percent - 1]
+
+
+def measure(fn, iterations, setup=None, cleanup=None):
+    # returns (latencies in seconds, peak bytes allocated during one extra call traced by tracemalloc)
+    # setup and cleanup run before and after every call and are not timed
+    def call():
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        if cleanup:
+            cleanup()
+        return elapsed
+
+    call()  # warm up: statement cache, SQLite page cache
+    samples = [call() for _ in range(iterations)]
+    tracemalloc.start()  # traced separately, tracing slows every allocation down
+    try:
+        tracemalloc.reset_peak()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return samples, peak
+
+
+def prepare_database(database, members, seed):  # seeds the benchmark database unless it already holds this size
+    from migrations import init_db
+    from models import count_members
+    from database import session
+    import seed_data
+
+    init_db()
+    existing = count_members()
+    session.remove()
+    if existing != members:
+        if existing:
+            raise RuntimeError(f"{database} holds {existing} members, expected {members}: delete it or pick another --database")
+        started = time.perf_counter()
+        seed_data.generate(members, seed, progress=lambda done: print(f"  {done} members written", end='\r'))
+        print(f"\nSeeded {members} members in {time.perf_counter() - started:.1f}s")
+
+
+def benchmarks(iterations, members):  # list of (name, fn, iterations, setup, cleanup)
+    import datetime
+    from sqlalchemy import delete, select
+    import models
+    import daily_tasks
+    import seed_data
+    import segments
+    from bulk_import import import_members
+    from database import session, get_engine
+
+    # real values from the data, so the lookups find something
+    sample = session.query(models.Member).filter(models.Member.email.isnot(None)).order_by(models.Member.id).\
+        offset(members // 2).first()
+    sample_event = session.query(models.Event).order_by(models.Event.id).offset(models.count_events() // 2).first()
+    email, first_name, last_name = sample.email, sample.first_name, sample.last_name
+    event_name, event_date = sample_event.name, sample_event.event_date
+    reminder_day = event_date - datetime.timedelta(days=daily_tasks.REMINDER_DAYS_AHEAD)
+    session.remove()
+
+    def clear_outbox():
+        with get_engine().begin() as conn:
+            conn.execute(delete(models.OutboxMessage))
+            conn.execute(delete(models.ReminderDelivery))
+
+    def remove_imported():  # puts the database back to the seeded state
+        imported = select(models.Member.id).where(models.Member.email.like(f"{IMPORT_TAG}%"))
+        with get_engine().begin() as conn:
+            conn.execute(delete(models.Demographics).where(models.Demographics.member_id.in_(imported)))
+            conn.execute(delete(models.Member).where(models.Member.email.like(f"{IMPORT_TAG}%")))
+        models.member_cache.clear()
+
+    import_dir = tempfile.mkdtemp()
+    import_files = []
+    def next_import_file():
+        path = os.path.join(import_dir, f"members_{len(import_files)}.txt")
+        seed_data.write_import_file(path, IMPORT_ROWS, tag=f"{IMPORT_TAG}{len(import_files)}")
+        import_files.append(path)
+
+    def deep_page_key(fetch_page, sort, pages):  # the key of the last page fetch_page reaches, at most pages deep
+        after = None
+        for _ in range(pages):
+            _, next_after = fetch_page(after=after, limit=100, sort=sort)
+            if next_after is None:
+                break
+            after = next_after
+        session.remove()
+        return after
+
+    member_page_500 = deep_page_key(models.get_members_page, 'last_name', 500)
+    phone_page_500 = deep_page_key(models.get_members_page, 'phone_number', 500)
+    active = segments.where('membership_status', 'eq', 'Active')
+
+    heavy = min(iterations, HEAVY_ITERATIONS)
+    return [
+        ('get_all_members', models.get_all_members, heavy, None, None),
+        ('get_all_events', models.get_all_events, iterations, None, None),
+        ('get_member_by_email', lambda: models.get_member_by_email.__wrapped__(email), iterations, None, None),
+        ('get_member_by_email (cached)', lambda: models.get_member_by_email(email), iterations, None, None),
+        ('get_member_by_names', lambda: models.get_member_by_names.__wrapped__(first_name, last_name), iterations, None, None),
+        ('get_member_by_names (cached)', lambda: models.get_member_by_names(first_name, last_name), iterations, None, None),
+        ('get_event_by_name', lambda: models.get_event_by_name.__wrapped__(event_name), iterations, None, None),
+        ('get_event_by_date', lambda: models.get_event_by_date(event_date), iterations, None, None),
+        ('married_members', models.married_members, heavy, None, None),
+        ('children_query', models.children_query, heavy, None, None),
+        ('uneducated_members', models.uneducated_members, heavy, None, None),
+        ('educated_members', models.educated_members, heavy, None, None),
+        ('disabled_members', models.disabled_members, iterations, None, None),
+        ('office_bearers', models.office_bearers, iterations, None, None),
+        ('demographic_stats', models.demographic_stats, iterations, None, None),
+        ('count_members', models.count_members, iterations, None, None),
+        ('count_events', models.count_events, iterations, None, None),
+        ('search_members', lambda: models.search_members(f"{first_name} {last_name[:3]}"), iterations, None, None),
+        ('search_events', lambda: models.search_events(event_name.split()[0]), iterations, None, None),
+        ('get_members_page (last_name)', lambda: models.get_members_page(sort='last_name', limit=200), iterations, None, None),
+        ('get_members_page (last_name, page 500)', lambda: models.get_members_page(member_page_500, 100, 'last_name'), iterations, None, None),
+        ('get_members_page (phone_number, page 500)', lambda: models.get_members_page(phone_page_500, 100, 'phone_number'), iterations, None, None),
+        ('get_members_page (Active)', lambda: models.get_members_page(sort='last_name', criteria=active), iterations, None, None),
+        ('count_members (Active)', lambda: models.count_members(active), iterations, None, None),
+        ('get_volunteering_page (date)', lambda: models.get_volunteering_page(sort='date_volunteered'), iterations, None, None),
+        ('get_events_page', lambda: models.get_events_page(limit=200), iterations, None, None),
+        ('get_events_between (30 days)', lambda: models.get_events_between(event_date, event_date + datetime.timedelta(days=30), limit=None), iterations, None, None),
+        ('get_upcoming_birthdays (7 days)', lambda: models.get_upcoming_birthdays(7, seed_data.TODAY), iterations, None, None),
+        ('outbox_counts', models.outbox_counts, iterations, None, None),
+        ('send_reminders', lambda: daily_tasks.send_reminders(reminder_day), heavy, clear_outbox, clear_outbox),
+        ('send_birthday_messages', daily_tasks.send_birthday_messages, iterations, clear_outbox, clear_outbox),
+        (f'import_members ({IMPORT_ROWS} rows)', lambda: import_members(import_files[-1]), heavy, next_import_file, remove_imported),
+    ]
+
+
+def run(size, members, seed, iterations, database):
+    prepare_database(database, members, seed)
+    from database import session
+    from query_metrics import metrics
+    import sqlalchemy
+
+    results = {}
+    for name, fn, count, setup, cleanup in benchmarks(iterations, members):
+        def tidy():  # every call starts with an empty session, as a fresh screen or job would
+            if cleanup:
+                cleanup()
+            session.remove()
+        metrics.reset()
+        samples, peak = measure(fn, count, setup, tidy)
+        statements = sum(stats['statements'] for caller, stats in metrics.snapshot()['callers'].items()
+                         if not caller.startswith(f"{__name__}."))  # leaves out setup and cleanup
+        results[name] = {
+            'iterations': count,
+            'p50_ms': round(_percentile(samples, 50) * 1000, 3),
+            'p95_ms': round(_percentile(samples, 95) * 1000, 3),
+            'min_ms': round(min(samples) * 1000, 3),
+            'peak_kib': round(peak / 1024, 1),
+            'statements_per_call': round(statements / (count + 2), 1),  # + warm-up and traced call
+        }
+        print(f"{name:<36} p50 {results[name]['p50_ms']:>10.2f} ms   p95 {results[name]['p95_ms']:>10.2f} ms"
+              f"   peak {results[name]['peak_kib']:>10.1f} KiB")
+
+    from startup_benchmark import git_commit
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'size': size,
+        'members': members,
+        'seed': seed,
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'benchmarks': results,
+    }
+
+
+def compare(result, previous, max_regression=None):  # prints the p50 changes, returns the names that regressed too far
+    regressed = []
+    for name, current in result['benchmarks'].items():
+        before = previous['benchmarks'].get(name)
+        if not before or not before['p50_ms']:
+            continue
+        change = (current['p50_ms'] / before['p50_ms'] - 1) * 100
+        print(f"{name:<36} {change:+7.1f}%")
+        if max_regression is not None and change > max_regression:
+            regressed.append(name)
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time the model queries, the import and the reminder jobs.')
+    parser.add_argument('size', nargs='?', default='1k', help="1k, 100k, 1m or a number of members")
+    parser.add_argument('--seed', type=int, default=2024)  # seed_data.SEED, not imported yet
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--database', default=None, help='SQLite file to use, kept between runs (default: one per size in the temp dir)')
+    parser.add_argument('--output', default=RESULTS_FILE, help='JSON file the result is appended to')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='fail if any p50 is this many percent slower than the previous result at the same size')
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.gettempdir(), f"organize_benchmark_{args.size}_{args.seed}.db")
+    os.environ['ORG_DATABASE_URL'] = f"sqlite:///{os.path.abspath(database)}"  # before anything imports database.py
+    from seed_data import SIZES
+    members = SIZES.get(args.size.lower()) or int(args.size)
+    result = run(args.size, members, args.seed, args.iterations, database)
+
+    history = []
+    if os.path.exists(args.output):
+        with open(args.output) as file:
+            history = json.load(file)
+    previous = next((entry for entry in reversed(history) if entry['members'] == members), None)
+    history.append(result)
+    with open(args.output, 'w') as file:
+        json.dump(history, file, indent=2)
+
+    if previous:
+        print(f"\np50 compared to {previous.get('commit') or previous['timestamp']}:")
+        regressed = compare(result, previous, args.max_regression)
+        if regressed:
+            print(f"Slower than allowed: {', '.join(regressed)}")
+            sys.exit(1)
@@ -0,0 +1,163 @@
+import itertools
+from sqlalchemy import func, select
+from database import get_engine
+from models import Member, Demographics, member_cache, normalize_phone
+from models import Marital_Status, EducationLevel, Involvement, Yes_No
+from migrations import BULK_INSERT_STEPS
+
+# Streaming bulk import of the pipe-delimited member file (the Google Form export).
+# Rows are read lazily and written in chunks: one transaction per chunk, one executemany
+# per table, so a 40k-row file no longer costs one flush+commit per member.
+# The per-row insert triggers (search index, demographic summary, change log) are dropped for a chunk and
+# replaced by one set-based statement each (migrations.BULK_INSERT_STEPS), inside the chunk's transaction.
+
+CHUNK_SIZE = 5000  # rows per transaction
+DELIMITER = '|'  # choose the appropriate limmiter ',' or '|'
+
+# column order of the txt file, the header line is skipped
+COLUMNS = ('first_name', 'last_name', 'email', 'phone_number', 'marital_status', 'children',
+           'family_at_home', 'occupation', 'education_level', 'involvement', 'disabilities')
+
+
+_enum_texts = {}  # enum class -> {display value or name: member}, four lookups per imported row
+
+def _enum_member(enum_cls, text):  # accepts either the display value ('Never Married') or the name ('Never_Married')
+    text = text.strip()
+    if text == '':
+        return None
+    if enum_cls not in _enum_texts:
+        _enum_texts[enum_cls] = {key: item for item in enum_cls for key in (item.value, item.name)}
+    if text not in _enum_texts[enum_cls]:
+        raise ValueError(f"invalid {enum_cls.__name__} '{text}'")
+    return _enum_texts[enum_cls][text]
+
+
+def _parse_line(line):  # returns (member row, demographics row), raises ValueError with the reason
+    parts = line.rstrip('\r\n').split(DELIMITER)
+    if len(parts) != len(COLUMNS):
+        raise ValueError(f"expected {len(COLUMNS)} columns, got {len(parts)}")
+    values = dict(zip(COLUMNS, (part.strip() for part in parts)))
+    if not values['first_name'] or not values['last_name']:
+        raise ValueError("first and last name are required")
+    try:
+        children = int(values['children'])
+        family_at_home = int(values['family_at_home'])
+    except ValueError:
+        raise ValueError("children and family_at_home must be whole numbers")
+
+    member = {
+        'first_name': values['first_name'],
+        'last_name': values['last_name'],
+        'email': values['email'] or None,
+        'phone_number': values['phone_number'] or None,
+        'phone_e164': normalize_phone(values['phone_number']),  # Core inserts skip set_phone_e164
+    }
+    demographics = {
+        'marital_status': _enum_member(Marital_Status, values['marital_status']),
+        'children': children,
+        'family_at_home': family_at_home,
+        'occupation': values['occupation'] or None,  # leave blank if not employed
+        'education_level': _enum_member(EducationLevel, values['education_level']),
+        'involvement': _enum_member(Involvement, values['involvement']),
+        'disabilities': _enum_member(Yes_No, values['disabilities']),
+    }
+    return member, demographics
+
+
+def read_members(file_path):  # generator: yields (line_no, line, parsed or None, error or None) one line at a time
+    with open(file_path, 'r', encoding='utf-8') as file:
+        next(file, None)  # Skip the header
+        for line_no, line in enumerate(file, start=2):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, line, _parse_line(line), None
+            except ValueError as e:
+                yield line_no, line, None, str(e)
+
+
+def _insert_chunk(chunk, rejects):  # chunk: list of (line_no, line, (member, demographics)); returns rows inserted
+    emails = [parsed[0]['email'] for _, _, parsed in chunk if parsed[0]['email']]
+    with get_engine().connect() as conn:
+        # one transaction for the whole chunk, holding the write lock from the start: nobody else can insert the
+        # same emails or take the ids handed out below, and nobody writes while the triggers are swapped out
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        existing = set()
+        for start in range(0, len(emails), 500):  # stay under SQLite's bound parameter limit
+            existing.update(conn.execute(
+                select(Member.email).where(Member.email.in_(emails[start:start + 500]))).scalars())
+
+        # ids are handed out up front so demographics can be linked without a flush per member
+        members_after = conn.execute(select(func.max(Member.id))).scalar() or 0
+        next_id = members_after + 1
+        member_rows, demographic_rows = [], []
+        for line_no, line, (member, demographics) in chunk:
+            if member['email'] and member['email'] in existing:  # avoid adding duplicates
+                rejects.append((line_no, line.rstrip('\r\n'), f"email '{member['email']}' already exists"))
+                continue
+            if member['email']:
+                existing.add(member['email'])
+            member_rows.append(dict(member, id=next_id))
+            demographic_rows.append(dict(demographics, member_id=next_id))
+            next_id += 1
+
+        if member_rows:
+            demographics_after = conn.execute(select(func.max(Demographics.id))).scalar() or 0
+            triggers = _drop_insert_triggers(conn)
+            conn.execute(Member.__table__.insert(), member_rows)
+            conn.execute(Demographics.__table__.insert(), demographic_rows)
+            for name, sql in triggers:
+                conn.exec_driver_sql(BULK_INSERT_STEPS[name],
+                                     {'members_after': members_after, 'demographics_after': demographics_after})
+                conn.exec_driver_sql(sql)
+        conn.commit()  # closing without it rolls the chunk back, triggers included (SQLite DDL is transactional)
+    if member_rows:
+        member_cache.clear()  # Core inserts skip the flush listener, "not found" answers may be stale now
+    return len(member_rows)
+
+
+def _drop_insert_triggers(conn):  # drops the triggers BULK_INSERT_STEPS stands in for, returns [(name, CREATE sql)]
+    names = ', '.join(f"'{name}'" for name in BULK_INSERT_STEPS)
+    triggers = conn.exec_driver_sql(f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({names})").all()
+    for name, _ in triggers:
+        conn.exec_driver_sql(f"DROP TRIGGER {name}")
+    return triggers
+
+
+def import_members(file_path, chunk_size=CHUNK_SIZE, progress=None):
+    # progress(imported, rejected) is called after every committed chunk
+    # returns (number of members imported, list of rejects as (line number, line, reason))
+    imported = 0
+    rejects = []
+    parsed_rows = _collect_rejects(read_members(file_path), rejects)
+    while True:
+        chunk = list(itertools.islice(parsed_rows, chunk_size))
+        if not chunk:
+            break
+        try:
+            imported += _insert_chunk(chunk, rejects)
+        except Exception as e:
+            # the chunk was rolled back, earlier chunks stay committed
+            raise RuntimeError(f"Import stopped after {imported} members (line {chunk[0][0]} onwards): {e}")
+        if progress:
+            progress(imported, len(rejects))
+    return imported, rejects
+
+
+def _collect_rejects(rows, rejects):  # passes parsed lines through, records the rest as rejects
+    for line_no, line, parsed, error in rows:
+        if error:
+            rejects.append((line_no, line.rstrip('\r\n'), error))
+        else:
+            yield line_no, line, parsed
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    started = time.perf_counter()
+    count, rejected = import_members(sys.argv[1], progress=lambda done, bad: print(f"{done} imported, {bad} rejected"))
+    elapsed = time.perf_counter() - started
+    for line_no, line, reason in rejected:
+        print(f"line {line_no}: {reason}: {line}")
+    print(f"Imported {count} members in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} rows/s), {len(rejected)} rejected")
@@ -0,0 +1,139 @@
+from sqlalchemy import select, update, delete, func
+from sqlalchemy import Enum as EnumType
+from database import session  # shared engine, one session per thread
+from models import Member, Demographics, Event, MemberVolunteering, SegmentMember, ReminderDelivery, member_cache, event_cache
+from models import EVENT_FIELDS  # the event fields the listings filter on
+from segments import compile_definition, _matching_ids, _coerce
+
+# Set-based changes to many members or events at once, e.g. marking every member who joined before 2015
+# and hasn't been seen since as Inactive, or purging last year's events:
+#
+#   criteria = all_of(where('membership_status', 'eq', 'Active'), where('attendance', 'eq', 'Rarely'))
+#   count_matching('members', criteria)                              dry run: how many rows would change
+#   preview_matching('members', criteria)                            the first rows, to check they are the right ones
+#   bulk_update('members', criteria, {'membership_status': 'Inactive'}, expected=count)
+#   bulk_delete('events', where('event_date', 'lt', '2024-01-01'))
+#
+# Criteria are segment definitions (see segments.py): members can be picked by any segment field or by a saved
+# segment, events by EVENT_FIELDS. Each change is one transaction of set-based statements (one UPDATE, or one
+# DELETE per table and 500 members); the SQL triggers keep the search index, the demographic counts and the
+# segment change log in step, the lookup caches are emptied afterwards.
+
+# what a bulk update may set; names, birth dates and phone numbers are left to the edit screens because
+# the birthday and phone number columns derived from them are kept in step by the ORM
+SETTABLE = {
+    'members': {'membership_status': Member.membership_status, 'gender': Member.gender,
+                'join_date': Member.join_date, 'address': Member.address},
+    'events': {'name': Event.name, 'event_date': Event.event_date, 'start_time': Event.start_time,
+               'end_time': Event.end_time, 'location': Event.location, 'description': Event.description},
+}
+
+PREVIEW_COLUMNS = {
+    'members': (Member.id, Member.first_name, Member.last_name, Member.phone_number, Member.join_date, Member.membership_status),
+    'events': (Event.id, Event.name, Event.event_date, Event.start_time, Event.location),
+}
+
+
+def _target(target, criteria):  # (model, WHERE clause on the model's own table)
+    if target not in SETTABLE:
+        raise RuntimeError(f"Unknown bulk target '{target}', use members or events")
+    if not criteria or criteria in ({'all': []}, {'any': []}):
+        raise RuntimeError("Bulk operations need criteria, they never apply to every row by accident")
+    if target == 'members':  # demographics fields need the join, the statement itself runs on members only
+        return Member, Member.id.in_(_matching_ids(compile_definition(criteria)))
+    return Event, compile_definition(criteria, fields=EVENT_FIELDS)
+
+
+def _set_value(column, value):  # enums by name, display value or item; text converted like criteria values
+    enum_class = getattr(column.type, 'enum_class', None) if isinstance(column.type, EnumType) else None
+    if enum_class is None or value is None:
+        return _coerce(column, value)
+    for item in enum_class:
+        if value in (item, item.name, item.value):
+            return item
+    raise RuntimeError(f"'{value}' is not a valid {enum_class.__name__}, use one of {', '.join(item.name for item in enum_class)}")
+
+
+def count_matching(target, criteria):  # the dry run: rows an update or delete with these criteria would touch
+    try:
+        model, condition = _target(target, criteria)
+        return session.query(func.count(model.id)).filter(condition).scalar()
+    except Exception as e:
+        print(f"An error occurred while counting {target}: {e}")
+        raise RuntimeError(f"Failed to count matching {target}: {e}")
+    finally:
+        session.rollback()  # ends the read transaction
+
+
+def preview_matching(target, criteria, limit=20):  # (first rows by id, total count)
+    try:
+        model, condition = _target(target, criteria)
+        result = session.query(*PREVIEW_COLUMNS[target]).filter(condition).order_by(model.id).limit(limit).all()
+        count = session.query(func.count(model.id)).filter(condition).scalar()
+        return result, count
+    except Exception as e:
+        print(f"An error occurred while previewing {target}: {e}")
+        raise RuntimeError(f"Failed to preview matching {target}: {e}")
+    finally:
+        session.rollback()
+
+
+def _check_expected(count, expected, target):
+    if expected is not None and count != expected:
+        raise RuntimeError(f"{count} {target} match now, not the {expected} that were previewed; nothing was changed")
+
+
+def bulk_update(target, criteria, values, expected=None, dry_run=False):
+    # sets values ({field: value}) on every matching row, returns the number of rows; with expected, the change
+    # is rolled back unless exactly that many rows matched (e.g. the count the user confirmed)
+    try:
+        model, condition = _target(target, criteria)
+        unknown = set(values) - set(SETTABLE[target])
+        if not values or unknown:
+            raise RuntimeError(f"Can't set {', '.join(sorted(unknown)) or 'nothing'}, use {', '.join(SETTABLE[target])}")
+        changes = {field: _set_value(SETTABLE[target][field], value) for field, value in values.items()}
+        if dry_run:
+            return count_matching(target, criteria)
+        result = session.execute(update(model).where(condition).values(changes),
+                                 execution_options={'synchronize_session': False})
+        _check_expected(result.rowcount, expected, target)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"An error occurred while updating {target}: {e}")
+        raise RuntimeError(f"Failed to update {target}: {e}")
+    (member_cache if target == 'members' else event_cache).clear()
+    return result.rowcount
+
+
+def bulk_delete(target, criteria, expected=None, dry_run=False):
+    # deletes every matching row (for members their demographics, volunteering and segment rows too, for
+    # events their reminder_deliveries rows), returns the number of rows; expected works as for bulk_update
+    try:
+        model, condition = _target(target, criteria)
+        if dry_run:
+            return count_matching(target, criteria)
+        if target == 'members':
+            # the ids are collected first: deleting demographics could change which members match
+            matching = [member_id for member_id, in session.execute(select(Member.id).where(condition))]
+            _check_expected(len(matching), expected, target)
+            deleted, unsynced = 0, {'synchronize_session': False}
+            for start in range(0, len(matching), 500):  # stays under SQLite's limit on bound parameters
+                ids = matching[start:start + 500]
+                session.execute(delete(SegmentMember).where(SegmentMember.member_id.in_(ids)), execution_options=unsynced)
+                session.execute(delete(Demographics).where(Demographics.member_id.in_(ids)), execution_options=unsynced)
+                session.execute(delete(MemberVolunteering).where(MemberVolunteering.member_id.in_(ids)), execution_options=unsynced)
+                deleted += session.execute(delete(Member).where(Member.id.in_(ids)), execution_options=unsynced).rowcount
+        else:
+            unsynced = {'synchronize_session': False}
+            session.execute(delete(ReminderDelivery).where(ReminderDelivery.event_id.in_(select(Event.id).where(condition))),
+                            execution_options=unsynced)
+            deleted = session.execute(delete(model).where(condition), execution_options=unsynced).rowcount
+            _check_expected(deleted, expected, target)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"An error occurred while deleting {target}: {e}")
+        raise RuntimeError(f"Failed to delete {target}: {e}")
+    (member_cache if target == 'members' else event_cache).clear()
+    return deleted
@@ -0,0 +1,107 @@
+import time
+import threading
+import functools
+from collections import OrderedDict
+
+# A small bounded LRU cache with a time-to-live, used in front of the lookup functions in models.py.
+# Entries can be tagged with the id of the row they came from, so a change to that row drops every
+# key it was cached under (e.g. a member found by email and by name). Every invalidation also moves the
+# cache to a new generation: a lookup that read the database before it doesn't store what it read, because
+# that may be the row as it was before the change that caused the invalidation.
+
+_MISSING = object()
+
+
+class LookupCache:
+    def __init__(self, name, maxsize=1024, ttl=300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl  # seconds, bounds staleness from writes made by other processes
+        self.entries = OrderedDict()  # key -> (expires at, value, row id)
+        self.keys_by_row = {}  # row id -> set of keys
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.generation = 0  # bumped by every invalidate and clear
+        self.stale_puts = 0  # results not stored because the cache was invalidated while they were read
+
+    def get(self, key, default=_MISSING):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, row_id=None, generation=None):
+        # generation: self.generation from before the value was read; nothing is stored if it changed since
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                self.stale_puts += 1
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, value, row_id)
+            if row_id is not None:
+                self.keys_by_row.setdefault(row_id, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self._drop(next(iter(self.entries)))  # least recently used
+
+    def invalidate(self, keys=(), row_ids=()):
+        with self.lock:
+            self.generation += 1
+            keys = set(keys)
+            for row_id in row_ids:
+                keys.update(self.keys_by_row.get(row_id, ()))
+            for key in keys:
+                if key in self.entries:
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.keys_by_row.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                    'invalidations': self.invalidations, 'stale_puts': self.stale_puts,
+                    'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0}
+
+    def _drop(self, key):  # caller holds the lock
+        _, _, row_id = self.entries.pop(key)
+        if row_id is not None:
+            keys = self.keys_by_row.get(row_id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_row[row_id]
+
+
+def cached_lookup(cache, key_fn, row_id_fn=lambda value: getattr(value, 'id', None), copy_fn=lambda value: value):
+    # read-through: fn(*args) only runs on a miss. "Not found" (None) is cached too; exceptions are not.
+    # copy_fn turns the result into something safe to hand to several threads (see models._detached_copy)
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            key = key_fn(*args)
+            generation = cache.generation  # before the read, see LookupCache.put
+            value = cache.get(key)
+            if value is _MISSING:
+                value = fn(*args)
+                if value is not None:
+                    value = copy_fn(value)
+                cache.put(key, value, row_id_fn(value) if value is not None else None, generation)
+            return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
@@ -1,69 +1,409 @@
+import os
+import sys
+import uuid
+import atexit
 import datetime
-import schedule
+import logging
+import threading
 import time
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Member, Event
-from twilio.rest import Client
-
-# Database setup
-DATABASE_URL = "sqlite:///church.db"
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session = Session()
+import queue
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import update, bindparam
+from database import session, use_database  # shared engine, one session per thread
+from models import OutboxMessage, OutboxStatus, enqueue_messages, queued_keys, phone_number_groups
+from models import enqueue_reminders, reminded_numbers
+from models import get_upcoming_birthdays, get_events_between, recipients_from_groups
+from migrations import init_db
+from segments import segment_member_ids
+from orgs import load_registry
+from scheduler import Scheduler, ScheduledJob
+from transports import TwilioTransport, FakeTransport, SendError
 
 # Twilio setup
 TWILIO_ACCOUNT_SID = 'account_sid'
 TWILIO_AUTH_TOKEN = 'auth_token'
 TWILIO_WHATSAPP_NUMBER = 'whatsapp:+twilio_whatsapp_number'
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-
-def send_whatsapp_message(to_number, message):
-    for message in message:
-        for phone_number in to_number:
-            try:
-                client.messages.create(
-                    body=message,
-                    from_=TWILIO_WHATSAPP_NUMBER,
-                    to=f'whatsapp:{phone_number}'
-                )
-            except Exception as e:
-                raise(f"Failed to send message to {to_number}: {e}")
-
-def send_reminders():
-    today = datetime.date.today()
-    upcoming_events = session.query(Event).filter(
-        Event.event_date == today + datetime.timedelta(days=5)
-    ).all()
-
-    for event in upcoming_events:
-        reminder_message = f"Reminder: The event '{event.name}' is scheduled for {event.event_date} at {event.start_time}."
-        # Here you might send this message to all members
-        return reminder_message
-    phone_numbs = session.query(Member.phone_number).all()  # returns a tuple of all the phone numbers
-    phone_numbers = [number[0] for number in phone_numbs]  # convert the result (tuple) to a list of phone numbers
-    send_whatsapp_message(phone_numbers, reminder_message)
-
-
-def send_birthday_messages():
-    today = datetime.date.today()
-    members_with_birthday_today = session.query(Member).filter(
-        Member.date_of_birth.has(
-            datetime.date(year=today.year, month=Member.date_of_birth.month, day=Member.date_of_birth.day)
-        )
-    ).all()
+TWILIO_API_BASE_URL = os.environ.get('TWILIO_API_BASE_URL')  # e.g. http://127.0.0.1:8080 to send to twilio_stub.py
+MESSAGE_TRANSPORT = os.environ.get('ORG_MESSAGE_TRANSPORT', 'twilio')  # 'fake' sends nowhere, see transports.py
+
+# Dispatch setup
+MESSAGES_PER_SECOND = float(os.environ.get('MESSAGES_PER_SECOND', 10))  # Twilio account send limit
+DISPATCH_WORKERS = int(os.environ.get('DISPATCH_WORKERS', 8))  # requests in flight at the same time
+THROTTLE_RETRIES = 3  # a send the provider throttled (429) is tried again this many times before it counts as failed
+THROTTLE_BACKOFF_SECONDS = 1.0  # first wait after a 429 unless the provider says otherwise, doubled on every further 429
+
+# Reminder setup
+REMINDER_DAYS_AHEAD = 5  # remind members this many days before an event
+REMINDER_WINDOW_DAYS = 1  # and cover this many days of events in one message (1 = only that day)
+
+# Outbox setup
+OUTBOX_BATCH_SIZE = 500  # messages claimed per round
+OUTBOX_MAX_ATTEMPTS = 5  # after this many failures a message is marked Dead
+OUTBOX_BACKOFF_SECONDS = 30  # first retry delay, doubled on every further failure
+OUTBOX_LEASE_SECONDS = 600  # a claimed batch is handed to another worker if not finished by then
+OUTBOX_POLL_SECONDS = 30
+
+# Schedule (see scheduler.py)
+DAILY_JOBS_AT = datetime.time(8, 0)  # reminders and birthday wishes are queued at this time every day
+DRAIN_EVERY_SECONDS = 60
+
+# Organization setup (see orgs.py)
+ORG_WORKERS = int(os.environ.get('ORG_WORKERS', 4))  # organizations whose jobs run at the same time, one process each
+ORG_JOB_TIMEOUT = int(os.environ.get('ORG_JOB_TIMEOUT', 1800))  # seconds an organization's jobs may take before its process is stopped
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport():  # the transport every send goes through, created on first use
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            if MESSAGE_TRANSPORT == 'fake':
+                _transport = FakeTransport()
+            elif MESSAGE_TRANSPORT == 'twilio':
+                _transport = TwilioTransport(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER, TWILIO_API_BASE_URL)
+            else:
+                raise RuntimeError(f"Unknown message transport '{MESSAGE_TRANSPORT}', use twilio or fake")
+        return _transport
+
+def set_transport(transport):  # e.g. a FakeTransport for a test or load_test.py
+    global _transport
+    with _transport_lock:
+        _transport = transport
+
+# sends since the process started; 'throttled' counts the 429s, each of them retried in place
+dispatch_counters = {'sent': 0, 'failed': 0, 'throttled': 0}
+_dispatch_lock = threading.Lock()
+
+def _count_dispatch(name, amount=1):
+    with _dispatch_lock:
+        dispatch_counters[name] += amount
+
+class RateLimiter:  # token bucket shared by all worker threads
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:  # reserve the next send slot, then sleep outside the lock
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def _send_one(phone_number, message, limiter):  # returns the message sid, raises on failure
+    transport = get_transport()
+    for attempt in range(THROTTLE_RETRIES + 1):
+        limiter.wait()
+        try:
+            sid = transport.send(phone_number, message)
+            _count_dispatch('sent')
+            return sid
+        except SendError as e:
+            if not e.throttled or attempt == THROTTLE_RETRIES:
+                _count_dispatch('failed')
+                raise
+            _count_dispatch('throttled')
+            time.sleep(e.retry_after or THROTTLE_BACKOFF_SECONDS * 2 ** attempt)  # only this send waits, the others carry on
+
+# the send threads, one pool per number of workers, kept for the life of the process: the transport's
+# per-thread clients (and their HTTP connections) outlive a batch and are reused by the next one
+_dispatch_pools = {}
+_dispatch_pools_lock = threading.Lock()
+
+def _dispatch_pool(workers):
+    with _dispatch_pools_lock:
+        pool = _dispatch_pools.get(workers)
+        if pool is None:
+            pool = _dispatch_pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dispatch')
+        return pool
+
+@atexit.register
+def _shutdown_dispatch_pools():
+    with _dispatch_pools_lock:
+        pools = list(_dispatch_pools.values())
+        _dispatch_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True)
+
+def dispatch_messages(jobs, messages_per_second=None, workers=None):
+    # jobs: iterable of (key, phone number, message), the key is handed back so callers can match results
+    # returns (sent, failed): sent is a list of (key, sid), failed a list of (key, error)
+    limiter = RateLimiter(messages_per_second or MESSAGES_PER_SECOND)
+    sent, failed = [], []
+    pool = _dispatch_pool(workers or DISPATCH_WORKERS)
+    futures = {pool.submit(_send_one, phone_number, body, limiter): (key, phone_number)
+               for key, phone_number, body in jobs}
+    for future in as_completed(futures):
+        key, phone_number = futures[future]
+        try:
+            sent.append((key, future.result()))
+        except Exception as e:  # one bad number must not stop the broadcast
+            logging.error(f"Failed to send message to {phone_number}: {e}")
+            failed.append((key, str(e)))
+    return sent, failed
+
+def send_whatsapp_message(to_number, message, messages_per_second=None, workers=None):
+    # to_number and message may each be a single string or a list of strings, every message goes to every number
+    # returns (sent, failed): sent is a list of (phone number, message, sid), failed a list of (phone number, message, error)
+    numbers = [to_number] if isinstance(to_number, str) else list(to_number)
+    messages = [message] if isinstance(message, str) else list(message)
+    jobs = [((phone_number, body), phone_number, body) for body in messages for phone_number in numbers]
+    sent, failed = dispatch_messages(jobs, messages_per_second, workers)
+    return [key + (sid,) for key, sid in sent], [key + (error,) for key, error in failed]
+
+def drain_outbox(batch_size=OUTBOX_BATCH_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS):
+    # sends every due outbox message, batch by batch; returns (sent, retried, dead) counts
+    totals = [0, 0, 0]
+    while True:
+        now = datetime.datetime.now()
+        token = uuid.uuid4().hex
+        # claim a batch in one statement so two drain workers never pick the same rows;
+        # rows left in Sending by a worker that died are picked up again once their lease runs out
+        due = session.query(OutboxMessage.id).filter(
+            OutboxMessage.status.in_([OutboxStatus.Pending, OutboxStatus.Sending]),
+            OutboxMessage.next_attempt_at <= now
+        ).order_by(OutboxMessage.next_attempt_at, OutboxMessage.id).limit(batch_size)
+        session.execute(
+            update(OutboxMessage).where(OutboxMessage.id.in_(due.scalar_subquery())).values(
+                status=OutboxStatus.Sending, claim_token=token,
+                next_attempt_at=now + datetime.timedelta(seconds=OUTBOX_LEASE_SECONDS)),
+            execution_options={'synchronize_session': False})
+        session.commit()
+        batch = session.query(OutboxMessage.id, OutboxMessage.to_number, OutboxMessage.body, OutboxMessage.attempts).\
+            filter(OutboxMessage.claim_token == token, OutboxMessage.status == OutboxStatus.Sending).all()
+        if not batch:
+            return tuple(totals)
+
+        attempts = {row.id: row.attempts + 1 for row in batch}
+        sent, failed = dispatch_messages([(row.id, row.to_number, row.body) for row in batch])
+
+        finished = datetime.datetime.now()
+        # only rows still claimed by this worker are written: if the lease ran out and another worker claimed
+        # a row again, that worker's outcome counts and this one is dropped
+        ours = (OutboxMessage.id == bindparam('row_id')) & (OutboxMessage.claim_token == token)
+        lost = 0
+        if sent:
+            written = session.execute(update(OutboxMessage.__table__).where(ours).values(
+                status=OutboxStatus.Sent, provider_sid=bindparam('sid'), attempts=bindparam('tries'),
+                sent_at=finished, last_error=None, claim_token=None),
+                [{'row_id': row_id, 'sid': sid, 'tries': attempts[row_id]} for row_id, sid in sent]).rowcount
+            totals[0] += written
+            lost += len(sent) - written
+        retries = {OutboxStatus.Pending: [], OutboxStatus.Dead: []}
+        for row_id, error in failed:
+            tries = attempts[row_id]
+            backoff = OUTBOX_BACKOFF_SECONDS * 2 ** (tries - 1)  # 30s, 60s, 120s, ...
+            retries[OutboxStatus.Dead if tries >= max_attempts else OutboxStatus.Pending].append(
+                {'row_id': row_id, 'error': error, 'tries': tries, 'retry_at': finished + datetime.timedelta(seconds=backoff)})
+        for state, rows in retries.items():
+            if rows:
+                written = session.execute(update(OutboxMessage.__table__).where(ours).values(
+                    status=state, last_error=bindparam('error'), attempts=bindparam('tries'),
+                    next_attempt_at=bindparam('retry_at'), claim_token=None), rows).rowcount
+                totals[2 if state == OutboxStatus.Dead else 1] += written
+                lost += len(rows) - written
+        session.commit()
+        if lost:
+            logging.warning(f"{lost} outbox messages were claimed by another worker after this one's lease ran out")
 
+def reminder_window(today=None):  # (first day, last day) of the events the reminder job covers
+    today = today or datetime.date.today()
+    start = today + datetime.timedelta(days=REMINDER_DAYS_AHEAD)
+    return start, start + datetime.timedelta(days=REMINDER_WINDOW_DAYS - 1)
+
+def reminder_message(events):
+    if len(events) == 1:
+        _, name, event_date, start_time = events[0][:4]
+        return f"Reminder: The event '{name}' is scheduled for {event_date} at {start_time}."
+    lines = [f"- '{name}' on {event_date} at {start_time}" for _, name, event_date, start_time, *_ in events]
+    return "Reminder: These events are coming up:\n" + "\n".join(lines)
+
+def build_reminder_plan(events, phone_numbers, reminded=None):
+    # one message per recipient covering the events it hasn't been reminded about yet (reminded: {event id: numbers},
+    # see models.reminded_numbers), returned as outbox rows (idempotency key, number, body, event ids covered).
+    # Reminders are keyed per (event, number): a rerun queues nothing, and an event added after a run only
+    # brings a reminder about that event
+    if not events or not phone_numbers:
+        return []
+    reminded = reminded or {}
+    bodies, plan = {}, []
+    for phone_number in phone_numbers:
+        pending = [event for event in events if phone_number not in reminded.get(event[0], ())]
+        if not pending:
+            continue
+        event_ids = tuple(event[0] for event in pending)
+        if event_ids not in bodies:
+            bodies[event_ids] = reminder_message(pending)
+        plan.append((f"reminder:{event_ids[0]}:{phone_number}", phone_number, bodies[event_ids], event_ids))
+    return plan
+
+# sends saved by recipient resolution since the process started: numbers shared by several members are sent to
+# once ('duplicates'), numbers normalize_phone rejects are not sent to at all ('invalid')
+recipient_counters = {'resolved': 0, 'duplicates': 0, 'invalid': 0}
+_counters_lock = threading.Lock()
+
+def resolve_recipients(segment=None):
+    # (distinct E.164 numbers, {'members', 'duplicates', 'invalid'}) for every member with a phone number, or only
+    # those of a saved segment (see segments.py); collapsed and filtered in SQL on the indexed phone_e164 column
+    return recipients_from_groups(phone_number_groups(segment_member_ids(segment) if segment else None))
+
+def count_recipients(numbers, stats):  # adds what a job resolved to recipient_counters
+    with _counters_lock:
+        recipient_counters['resolved'] += len(numbers)
+        recipient_counters['duplicates'] += stats['duplicates']
+        recipient_counters['invalid'] += stats['invalid']
+    if stats['duplicates'] or stats['invalid']:
+        logging.info(f"{stats['members']} members -> {len(numbers)} numbers: {stats['duplicates']} shared numbers collapsed, "
+                     f"{stats['invalid']} invalid numbers skipped")
+
+def recipient_numbers(segment=None):  # the numbers a job sends to, counted in recipient_counters
+    numbers, stats = resolve_recipients(segment)
+    count_recipients(numbers, stats)
+    return numbers
+
+def reminder_plan(today=None, segment=None):  # (events in the reminder window, outbox rows for them, recipient stats)
+    start, end = reminder_window(today)
+    upcoming_events, _ = get_events_between(start, end, limit=None)  # every event in the window, one indexed query
+    if not upcoming_events:
+        return upcoming_events, [], {'members': 0, 'duplicates': 0, 'invalid': 0}
+    numbers, stats = resolve_recipients(segment)
+    reminded = reminded_numbers([event[0] for event in upcoming_events])
+    return upcoming_events, build_reminder_plan(upcoming_events, numbers, reminded), stats
+
+def send_reminders(today=None, segment=None):  # queues the reminders, drain_outbox sends them
+    _, plan, stats = reminder_plan(today, segment)
+    count_recipients(plan, stats)  # one row per number
+    return enqueue_reminders(plan)
+
+def send_broadcast(segment, message, key):  # queues message for everyone in the segment, key makes a rerun a no-op
+    return enqueue_messages((f"broadcast:{key}:{phone_number}", phone_number, message)
+                            for phone_number in recipient_numbers(segment))
+
+
+def birthday_plan(today=None):  # outbox rows for today's birthday wishes
+    today = today or datetime.date.today()
+    members_with_birthday_today, _ = get_upcoming_birthdays(0, today)  # index lookup on the month/day of birth
+
+    messages = []
     for member in members_with_birthday_today:
-        birthday_message = f"Happy Birthday {member.first_name} {member.last_name}!"
-        send_whatsapp_message(member.phone_number, birthday_message)
+        if member.phone_e164:  # numbers normalize_phone rejected would only fail at Twilio
+            birthday_message = f"Happy Birthday {member.first_name} {member.last_name}!"
+            messages.append((f"birthday:{today}:{member.id}", member.phone_e164, birthday_message))
+    return messages
 
-# Scheduling tasks
-def schedule_tasks():
-    schedule.every().day.at("08:00").do(send_reminders)
-    schedule.every().day.at("08:00").do(send_birthday_messages)
+def send_birthday_messages(today=None):  # queues the birthday wishes, drain_outbox sends them
+    return enqueue_messages(birthday_plan(today))
+
+def preview_job(job, **kwargs):
+    # what the reminders or birthdays job would queue in the current database, without queueing anything:
+    # {'events': events covered, 'messages': rows planned, 'new': rows not in the outbox yet}
+    # and for reminders how many members share a number ('duplicates') or have an unusable one ('invalid')
+    stats = {}
+    if job == 'reminders':
+        events, plan, stats = reminder_plan(**kwargs)
+    elif job == 'birthdays':
+        events, plan = [], birthday_plan(**kwargs)
+    else:
+        raise RuntimeError(f"Only the reminders and birthdays jobs can be previewed, not '{job}'")
+    already_queued = queued_keys(key for key, *_ in plan)
+    return {'events': len(events), 'messages': len(plan), 'new': len(plan) - len(already_queued),
+            'duplicates': stats.get('duplicates', 0), 'invalid': stats.get('invalid', 0)}
+
+JOBS = {'reminders': send_reminders, 'birthdays': send_birthday_messages, 'drain': drain_outbox}
+
+def run_org_jobs(database_url, jobs, today=None):
+    # runs jobs one after the other against one database, returns {job: (ok, result or error)};
+    # today: the date the daily jobs run for (default today), e.g. a day the scheduler is catching up on
+    use_database(database_url)
+    results = {}
+    for job in jobs:
+        try:
+            results[job] = (True, JOBS[job]() if today is None else JOBS[job](today))
+        except Exception as e:  # one broken job doesn't stop the next
+            logging.error(f'Job {job} failed for {database_url}: {e}', exc_info=True)
+            results[job] = (False, f'{type(e).__name__}: {e}')
+        finally:
+            session.remove()
+    return results
+
+def _org_process(key, database_url, jobs, today, results):  # entry point of an organization's worker process
+    results.put((key, run_org_jobs(database_url, jobs, today)))
+
+def run_jobs_for_orgs(jobs, organizations=None, workers=None, timeout=None, today=None):
+    # runs the jobs for every organization, each organization in its own process (ORG_WORKERS at a time), so a slow,
+    # hanging or crashing organization can't hold up or take down the others. A process still running after
+    # timeout seconds is stopped. Returns {(organization key, job): (ok, result or error)}
+    organizations = list(organizations or load_registry())
+    workers, timeout = workers or ORG_WORKERS, timeout or ORG_JOB_TIMEOUT
+    context = multiprocessing.get_context('spawn')  # a fresh interpreter, no SQLite connections inherited from this one
+    results_queue = context.Queue()
+    waiting, running, results = list(organizations), {}, {}
+
+    def finish(organization, outcome):
+        for job in jobs:
+            ok, result = outcome.get(job, (False, 'not run'))
+            results[(organization.key, job)] = (ok, result)
+            if not ok:
+                logging.error(f'{organization.name}: {job} failed: {result}')
+
+    while waiting or running:
+        while waiting and len(running) < workers:
+            organization = waiting.pop(0)
+            process = context.Process(target=_org_process, name=f'org-{organization.key}',
+                                      args=(organization.key, organization.database_url, list(jobs), today, results_queue))
+            process.start()
+            running[organization.key] = (organization, process, time.monotonic() + timeout)
+        try:
+            key, outcome = results_queue.get(timeout=0.5)
+            organization, process, _ = running.pop(key)
+            process.join()
+            finish(organization, outcome)
+        except queue.Empty:
+            pass
+        for key, (organization, process, deadline) in list(running.items()):
+            if not process.is_alive() and results_queue.empty():  # died without reporting back
+                running.pop(key)
+                finish(organization, {job: (False, f'process exited with code {process.exitcode}') for job in jobs})
+            elif time.monotonic() > deadline:
+                process.terminate()
+                process.join()
+                running.pop(key)
+                finish(organization, {job: (False, f'timed out after {timeout}s') for job in jobs})
+    return results
+
+def run_all_orgs(*jobs, today=None):  # for the scheduler: logs a summary instead of returning it
+    for (key, job), (ok, result) in sorted(run_jobs_for_orgs(jobs, today=today).items()):
+        logging.info(f'{key}: {job} {"done" if ok else "failed"}: {result}')
+
+# Scheduling tasks: each job runs for every organization at once, the three jobs independently of each other
+SCHEDULE = [
+    ScheduledJob('reminders', lambda day: run_all_orgs('reminders', today=day), at=DAILY_JOBS_AT),
+    ScheduledJob('birthdays', lambda day: run_all_orgs('birthdays', today=day), at=DAILY_JOBS_AT),
+    ScheduledJob('drain', lambda: run_all_orgs('drain'), every=DRAIN_EVERY_SECONDS),
+]
+
+def get_scheduler():
+    return Scheduler(SCHEDULE)
 
 if __name__ == "__main__":
-    schedule_tasks()
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Wait a minute before checking again
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if sys.argv[1:2] == ['status']:
+        for name, last_run, ok, next_due in get_scheduler().status():
+            last = f"{last_run:%Y-%m-%d %H:%M:%S} ({'ok' if ok else 'failed'})" if last_run else 'never'
+            print(f"{name:<10} last run {last:<32} next run {next_due:%Y-%m-%d %H:%M:%S}")
+        sys.exit(0)
+    for organization in load_registry():
+        use_database(organization.database_url)
+        init_db()  # create missing tables and bring an older database up to the current schema
+    if sys.argv[1:2] == ['run'] and len(sys.argv) == 3:  # one job now, e.g. from cron or after fixing a failure
+        get_scheduler().trigger(sys.argv[2])
+    elif sys.argv[1:] == ['drain']:  # run only the drain worker, e.g. alongside a scheduler on another machine
+        while True:
+            run_all_orgs('drain')
+            time.sleep(OUTBOX_POLL_SECONDS)
+    else:
+        get_scheduler().run_forever()
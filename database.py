@@ -0,0 +1,115 @@
+import os
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker, scoped_session
+import query_metrics
+
+# The one place the database engines and sessions are created.
+# models.py, screen.py and daily_tasks.py all share these, so the GUI and the scheduler
+# talk to the database through the same tuned connections.
+
+# Define the database URL (SQLite in this case), ORG_DATABASE_URL overrides it
+DATABASE_URL = os.environ.get('ORG_DATABASE_URL', 'sqlite:///church.db')
+SQL_ECHO = os.environ.get('ORG_SQL_ECHO') == '1'  # log every statement, for debugging only
+QUERY_METRICS = os.environ.get('ORG_QUERY_METRICS', '1') == '1'  # per-statement timings and the slow-query log, see query_metrics.py
+
+# applied to every new SQLite connection
+SQLITE_PRAGMAS = [
+    ('journal_mode', 'WAL'),  # readers don't block the writer, so the GUI and the scheduler can work at the same time
+    ('synchronous', 'NORMAL'),  # safe with WAL and far fewer fsyncs per commit
+    ('busy_timeout', 10000),  # wait up to 10s for another writer instead of failing with "database is locked"
+    ('cache_size', -65536),  # 64 MB page cache (negative means KiB)
+    ('mmap_size', 268435456),  # read through 256 MB of memory-mapped I/O
+    ('temp_store', 'MEMORY'),  # sorts and temp indexes stay in memory
+]
+
+# the GUI worker pool (4 threads), the UI thread and the dispatcher each hold a connection at most
+POOL_SIZE = 8
+MAX_OVERFLOW = 8
+POOL_TIMEOUT = 30
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def create_db_engine(url=DATABASE_URL, echo=SQL_ECHO, metrics=QUERY_METRICS):
+    url = make_url(url)
+    kwargs = {}
+    if url.get_backend_name() == 'sqlite':
+        # connections are handed between threads by the pool, SQLite's own busy wait matches busy_timeout
+        kwargs['connect_args'] = {'check_same_thread': False, 'timeout': 10}
+        if url.database and url.database != ':memory:':  # in-memory databases use a single connection pool
+            kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+    engine = create_engine(url, echo=echo, **kwargs)
+    if url.get_backend_name() == 'sqlite':
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+    if metrics:
+        query_metrics.instrument(engine)
+    return engine
+
+
+# one engine (and connection pool) per database, so switching between organizations (see orgs.py)
+# reuses the connections that are already open
+_engines = {}
+_engine_lock = threading.Lock()
+_current_url = DATABASE_URL
+
+def get_engine(url=None):  # the engine for url (default: the database in use), created on first use, not on import
+    url = str(url or _current_url)
+    with _engine_lock:
+        if url not in _engines:
+            _engines[url] = create_db_engine(url)
+        return _engines[url]
+
+def current_database_url():
+    return _current_url
+
+def use_database(url):  # points the shared session at another database, e.g. another organization's
+    global _current_url
+    _current_url = str(url)
+    session.remove()  # this thread's next session binds to the new database; worker threads remove theirs after every task
+
+
+# Create a session
+Session = sessionmaker()
+session = scoped_session(lambda: Session(bind=get_engine()))  # one session per thread, see workers.py
+
+
+""" Async engines (see async_models.py), the same database through aiosqlite; only loaded when something uses them """
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite'}
+
+def create_async_db_engine(url=DATABASE_URL, echo=SQL_ECHO, metrics=QUERY_METRICS):
+    from sqlalchemy.ext.asyncio import create_async_engine
+    url = make_url(url)
+    if url.get_backend_name() not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver for {url.get_backend_name()} databases")
+    url = url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+    kwargs = {'connect_args': {'timeout': 10}}
+    if url.database and url.database != ':memory:':
+        kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+    engine = create_async_engine(url, echo=echo, **kwargs)
+    event.listen(engine.sync_engine, 'connect', _set_sqlite_pragmas)  # the same pragmas as the sync connections
+    if metrics:
+        query_metrics.instrument(engine.sync_engine)
+    return engine
+
+_async_engines = {}
+
+def get_async_engine(url=None):  # like get_engine; an async engine must only be used from one event loop
+    url = str(url or _current_url)
+    with _engine_lock:
+        if url not in _async_engines:
+            _async_engines[url] = create_async_db_engine(url)
+        return _async_engines[url]
+
+async def dispose_async_engines():  # closes the pooled aiosqlite connections, at the end of the event loop that opened them
+    with _engine_lock:
+        engines = list(_async_engines.values())
+        _async_engines.clear()
+    for engine in engines:
+        await engine.dispose()
@@ -0,0 +1,201 @@
+import os
+import csv
+import json
+import enum
+import datetime
+from sqlalchemy import Integer, Date, DateTime
+from database import session  # shared engine, one session per thread
+from models import Member, Demographics, Event, VolunteerOpportunity, MemberVolunteering, EducationLevel, stored_forms, birthday_filter
+
+# Streaming export of the query results to CSV, JSON Lines or Parquet for the committee's reports.
+# Rows are read BATCH_SIZE at a time (yield_per) and written straight to the file, so memory stays
+# the same whether the table holds a hundred members or a million. Parquet needs pyarrow, which is
+# only imported when a Parquet file is written.
+#
+#   python export.py members members.csv
+#   python export.py upcoming_birthdays birthdays.parquet --days 30
+
+BATCH_SIZE = 1000  # rows fetched and written per round
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.parquet': 'parquet'}
+
+
+""" What can be exported: each function returns a query of plain columns, same filters as models.py """
+def _members_export():  # full dump, one row per member with the demographics alongside
+    return session.query(Member.id, Member.first_name, Member.last_name, Member.date_of_birth, Member.gender,
+                         Member.phone_number, Member.email, Member.address, Member.join_date, Member.membership_status,
+                         Demographics.marital_status, Demographics.children, Demographics.family_at_home,
+                         Demographics.occupation, Demographics.education_level, Demographics.attendance,
+                         Demographics.involvement, Demographics.disabilities).\
+        outerjoin(Demographics, Demographics.member_id == Member.id).order_by(Member.id)
+
+def _events_export():
+    return session.query(Event.id, Event.name, Event.event_date, Event.start_time, Event.end_time, Event.location,
+                         Event.description).order_by(Event.event_date, Event.id)
+
+def _demographics_export(condition, *columns):  # member columns for the members matching one demographics condition
+    return session.query(Member.id, Member.first_name, Member.last_name, *columns).\
+        join(Demographics, Demographics.member_id == Member.id).filter(condition).order_by(Member.id)
+
+def _upcoming_birthdays_export(days=30, today=None):
+    return session.query(Member.id, Member.first_name, Member.last_name, Member.date_of_birth, Member.phone_number,
+                         Member.email).filter(birthday_filter(days, today)).order_by(Member.birth_mmdd, Member.id)
+
+def _events_between_export(start, end):
+    return _events_export().filter(Event.event_date.between(start, end))
+
+def _volunteering_export():
+    return session.query(Member.id, Member.first_name, Member.last_name, Member.phone_number,
+                         VolunteerOpportunity.name.label('opportunity'), MemberVolunteering.date_volunteered).\
+        join(MemberVolunteering, MemberVolunteering.member_id == Member.id).\
+        join(VolunteerOpportunity, VolunteerOpportunity.id == MemberVolunteering.opportunity_id).\
+        order_by(Member.id, VolunteerOpportunity.name)
+
+EXPORTS = {
+    'members': _members_export,
+    'events': _events_export,
+    'married_members': lambda: _demographics_export(Demographics.marital_status == 'Married', Member.join_date),
+    'members_with_children': lambda: _demographics_export(Demographics.children >= 1, Demographics.children),
+    'uneducated_members': lambda: _demographics_export(Demographics.education_level.in_(stored_forms(EducationLevel.No_Matric)), Member.phone_number),
+    'educated_members': lambda: _demographics_export(Demographics.education_level.notin_(stored_forms(EducationLevel.No_Matric)), Member.phone_number),
+    'disabled_members': lambda: _demographics_export(Demographics.disabilities == 'Yes', Member.phone_number),
+    'office_bearers': lambda: _demographics_export(Demographics.involvement.in_(['Server', 'Officer']),
+                                                   Member.phone_number, Demographics.involvement),
+    'upcoming_birthdays': _upcoming_birthdays_export,
+    'events_between': _events_between_export,
+    'volunteering': _volunteering_export,
+}
+
+
+""" Writers: open(file, columns), write(rows), close() """
+def _plain(value):  # enums as their display value, dates as ISO text
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+class CsvWriter:
+    def __init__(self, file_path, columns):
+        self.file = open(file_path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+
+    def write(self, rows):
+        self.writer.writerows([['' if value is None else _plain(value) for value in row] for row in rows])
+
+    def close(self):
+        self.file.close()
+
+class JsonLinesWriter:
+    def __init__(self, file_path, columns):
+        self.file = open(file_path, 'w', encoding='utf-8')
+        self.names = [name for name, _ in columns]
+
+    def write(self, rows):
+        self.file.writelines(json.dumps(dict(zip(self.names, map(_plain, row)))) + '\n' for row in rows)
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter:  # one row group per batch, column types taken from the model
+    def __init__(self, file_path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow), CSV and JSONL work without it")
+        self.pyarrow = pyarrow
+        fields = []
+        for name, column_type in columns:
+            if isinstance(column_type, Integer):
+                fields.append(pyarrow.field(name, pyarrow.int64()))
+            elif isinstance(column_type, DateTime):
+                fields.append(pyarrow.field(name, pyarrow.timestamp('us')))
+            elif isinstance(column_type, Date):
+                fields.append(pyarrow.field(name, pyarrow.date32()))
+            else:
+                fields.append(pyarrow.field(name, pyarrow.string()))
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(file_path, self.schema)
+
+    def write(self, rows):
+        values = []
+        for index, field in enumerate(self.schema):
+            if self.pyarrow.types.is_string(field.type):
+                values.append([None if row[index] is None else str(_plain(row[index])) for row in rows])
+            else:  # numbers and dates go in as they are
+                values.append([row[index] for row in rows])
+        self.writer.write_table(self.pyarrow.Table.from_arrays(values, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {'csv': CsvWriter, 'jsonl': JsonLinesWriter, 'parquet': ParquetWriter}
+
+
+def export_format(file_path):  # 'csv', 'jsonl' or 'parquet' from the file extension
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in FORMATS:
+        raise RuntimeError(f"Unknown export format '{extension}', use one of {', '.join(FORMATS)}")
+    return FORMATS[extension]
+
+
+def export_query(name, file_path, file_format=None, progress=None, batch_size=BATCH_SIZE, **params):
+    # streams the rows of EXPORTS[name](**params) into file_path, returns the number of rows written
+    # progress(rows written) is called after every batch and may raise to stop (e.g. workers.TaskCancelled);
+    # the file is written under a temporary name and only appears once the export is complete
+    if name not in EXPORTS:
+        raise RuntimeError(f"Unknown export '{name}', use one of {', '.join(EXPORTS)}")
+    file_format = file_format or export_format(file_path)
+    query = EXPORTS[name](**params)
+    columns = [(description['name'], description['type']) for description in query.column_descriptions]
+    partial_path = file_path + '.part'
+    written = 0
+    writer = WRITERS[file_format](partial_path, columns)
+    try:
+        try:
+            batch = []
+            for row in query.yield_per(batch_size):  # fetched from the cursor batch_size rows at a time
+                batch.append(row)
+                if len(batch) == batch_size:
+                    writer.write(batch)
+                    written += len(batch)
+                    batch = []
+                    if progress:
+                        progress(written)
+            if batch:
+                writer.write(batch)
+                written += len(batch)
+        finally:
+            writer.close()
+            session.rollback()  # ends the read transaction, nothing was changed
+        os.replace(partial_path, file_path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    if progress:
+        progress(written)
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Export query results to CSV, JSON Lines or Parquet.')
+    parser.add_argument('name', choices=sorted(EXPORTS))
+    parser.add_argument('file', help='output file, the format follows the extension (.csv, .jsonl, .parquet)')
+    parser.add_argument('--days', type=int, help='for upcoming_birthdays')
+    parser.add_argument('--start', help='for events_between, YYYY-MM-DD')
+    parser.add_argument('--end', help='for events_between, YYYY-MM-DD')
+    args = parser.parse_args()
+
+    params = {}
+    if args.days is not None:
+        params['days'] = args.days
+    if args.start and args.end:
+        params.update(start=datetime.date.fromisoformat(args.start), end=datetime.date.fromisoformat(args.end))
+    started = time.perf_counter()
+    count = export_query(args.name, args.file, **params)
+    print(f"Exported {count} rows to {args.file} in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+
+# Load test of the messaging path: queues the reminders or birthday wishes for 10k-100k members of a
+# seeded database (seed_data.py) and drains the outbox through a fake transport or the local Twilio
+# stub (twilio_stub.py), then reports throughput, send latency percentiles and how many sends were
+# throttled, retried or given up. Results are appended to a JSON file, like benchmark.py does.
+#
+#   python load_test.py 10k --transport fake
+#   python load_test.py 100k --job birthdays --transport stub --latency-ms 80 --throttle-rate 0.02 --workers 32
+
+RESULTS_FILE = 'load_test_results.json'
+
+
+class TimedTransport:  # wraps a transport and keeps the duration of every send, failed ones included
+    def __init__(self, transport):
+        self.transport = transport
+        self.lock = threading.Lock()
+        self.latencies = []
+
+    def send(self, to_number, body):
+        started = time.perf_counter()
+        try:
+            return self.transport.send(to_number, body)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.latencies.append(elapsed)
+
+
+def prepare_job(job, today):  # makes every member a recipient of the job on `today`
+    import datetime
+    from sqlalchemy import delete, update
+    from database import get_engine
+    from daily_tasks import reminder_window
+    from models import Event, Member, OutboxMessage, ReminderDelivery, birthday_key
+
+    with get_engine().begin() as conn:
+        conn.execute(delete(OutboxMessage))  # every run starts from an empty outbox
+        conn.execute(delete(ReminderDelivery))
+        if job == 'reminders':
+            start, _ = reminder_window(today)
+            conn.execute(delete(Event).where(Event.name == 'Load Test'))
+            conn.execute(Event.__table__.insert().values(name='Load Test', event_date=start, start_time='10:00',
+                                                         end_time='12:00', location='Main Hall', description='load test'))
+        else:  # everyone has their birthday today
+            conn.execute(update(Member).values(date_of_birth=datetime.date(1980, today.month, today.day).isoformat(),
+                                               birth_mmdd=birthday_key(today)))
+
+
+def run(args, members):
+    import datetime
+    from benchmark import prepare_database, _percentile
+    from database import session
+    from sqlalchemy import func
+    import daily_tasks
+    from models import OutboxMessage, OutboxStatus, outbox_counts
+    from transports import FakeTransport, TwilioTransport
+    from twilio_stub import start_stub
+
+    prepare_database(args.database, members, args.seed)
+    today = datetime.date.today()
+    prepare_job(args.job, today)
+
+    server = None
+    if args.transport == 'stub':
+        server, base_url = start_stub(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                                      throttle_rate=args.throttle_rate, seed=args.seed)
+        transport = TwilioTransport('ACloadtest', 'loadtest', 'whatsapp:+15005550006', base_url)
+    else:
+        transport = FakeTransport(latency=args.latency_ms / 1000, error_rate=args.error_rate,
+                                  throttle_rate=args.throttle_rate, seed=args.seed)
+    timed = TimedTransport(transport)
+    daily_tasks.set_transport(timed)
+    daily_tasks.MESSAGES_PER_SECOND = args.rate  # 0: as fast as the workers go
+    daily_tasks.DISPATCH_WORKERS = args.workers
+    counters_before = dict(daily_tasks.dispatch_counters)
+
+    try:
+        started = time.perf_counter()
+        if args.job == 'reminders':
+            queued = daily_tasks.send_reminders(today)
+        else:
+            queued = daily_tasks.send_birthday_messages(today)
+        queued_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        sent, retried, dead = daily_tasks.drain_outbox()
+        drain_seconds = time.perf_counter() - started
+    finally:
+        if server:
+            server.shutdown()
+    attempts = dict(session.query(OutboxMessage.attempts, func.count()).filter(OutboxMessage.status == OutboxStatus.Sent).
+                    group_by(OutboxMessage.attempts).all())
+    outbox = outbox_counts()
+    session.remove()
+
+    latencies = sorted(timed.latencies)
+    counters = {name: daily_tasks.dispatch_counters[name] - counters_before[name] for name in counters_before}
+    from startup_benchmark import git_commit
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'job': args.job,
+        'members': members,
+        'transport': args.transport,
+        'settings': {'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms, 'error_rate': args.error_rate,
+                     'throttle_rate': args.throttle_rate, 'workers': args.workers, 'rate': args.rate},
+        'queued': queued,
+        'queue_seconds': round(queued_seconds, 3),
+        'drain_seconds': round(drain_seconds, 3),
+        'sent': sent,
+        'messages_per_second': round(sent / drain_seconds, 1) if drain_seconds else None,
+        'send_p50_ms': round(_percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'send_p95_ms': round(_percentile(latencies, 95) * 1000, 3) if latencies else None,
+        'send_p99_ms': round(_percentile(latencies, 99) * 1000, 3) if latencies else None,
+        'send_max_ms': round(latencies[-1] * 1000, 3) if latencies else None,
+        'requests': len(latencies),
+        'throttled': counters['throttled'],  # each one retried in place
+        'retried': retried,  # failed and put back in the outbox with a backoff (some may have been sent since)
+        'dead': dead,
+        'sent_by_attempt': {str(attempt): count for attempt, count in sorted(attempts.items())},
+        'outbox': outbox,  # where every queued message ended up
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Drive the reminder or birthday job through a fake messaging provider.')
+    parser.add_argument('size', nargs='?', default='10k', help="10k, 100k or a number of members")
+    parser.add_argument('--job', choices=['reminders', 'birthdays'], default='reminders')
+    parser.add_argument('--transport', choices=['fake', 'stub'], default='fake',
+                        help='fake: in-process; stub: the Twilio client against twilio_stub.py over HTTP')
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='stub only')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=32, help='sends in flight at the same time')
+    parser.add_argument('--rate', type=float, default=0, help='messages per second, 0 for no limit')
+    parser.add_argument('--seed', type=int, default=2024)  # seed_data.SEED, not imported yet
+    parser.add_argument('--database', default=None, help='SQLite file to use, kept between runs (default: one per size in the temp dir)')
+    parser.add_argument('--output', default=RESULTS_FILE, help='JSON file the result is appended to')
+    args = parser.parse_args()
+
+    sizes = {'10k': 10000, '100k': 100000}
+    members = sizes.get(args.size.lower()) or int(args.size)
+    # its own database: the birthday run moves every birthday to today
+    args.database = args.database or os.path.join(tempfile.gettempdir(), f"organize_load_test_{members}_{args.seed}.db")
+    os.environ['ORG_DATABASE_URL'] = f"sqlite:///{os.path.abspath(args.database)}"  # before anything imports database.py
+    logging.basicConfig(filename='load_test.log', level=logging.ERROR,  # one line per failed send, kept off the console
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    result = run(args, members)
+
+    print(f"{result['job']} for {members} members through the {result['transport']} transport")
+    print(f"  queued {result['queued']} messages in {result['queue_seconds']:.2f}s")
+    print(f"  sent {result['sent']} in {result['drain_seconds']:.2f}s, {result['messages_per_second']} messages/s")
+    if result['requests']:
+        print(f"  send latency p50 {result['send_p50_ms']:.1f} ms, p95 {result['send_p95_ms']:.1f} ms, "
+              f"p99 {result['send_p99_ms']:.1f} ms, max {result['send_max_ms']:.1f} ms over {result['requests']} requests")
+    print(f"  {result['throttled']} throttled and retried at once, {result['retried']} failed and retried after a backoff, "
+          f"{result['dead']} given up")
+    print(f"  outbox: {', '.join(f'{count} {status}' for status, count in result['outbox'].items())}")
+
+    history = []
+    if os.path.exists(args.output):
+        with open(args.output) as file:
+            history = json.load(file)
+    history.append(result)
+    with open(args.output, 'w') as file:
+        json.dump(history, file, indent=2)
+    if sum(result['outbox'].values()) != result['queued'] or result['outbox'].get('Sending'):
+        sys.exit(1)  # a message went missing or was left claimed
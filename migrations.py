@@ -0,0 +1,360 @@
+import sys
+from sqlalchemy import event, bindparam
+import models
+from models import Base
+from database import get_engine
+
+# Versioned schema changes for existing church.db files.
+# The version applied so far is kept in SQLite's PRAGMA user_version, so every migration runs once per database.
+# New databases get their tables from Base.metadata.create_all and then run every migration as well, which is
+# why every step must be safe to run against a table that already has the change (IF NOT EXISTS, column checks, ...).
+# A step is either an SQL string or a function taking the connection.
+
+
+MEMBERS_FTS_COLUMNS = ['first_name', 'last_name', 'email', 'address', 'phone_number']
+
+
+def _fts_steps(fts_table, table, columns):
+    # an external-content FTS5 index over table (it stores no copy of the text), kept in sync by triggers
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({column_list},
+            content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {table} BEGIN
+            INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values});
+        END""",
+        f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')",  # index the rows that are already there
+    ]
+
+
+# the counts kept in demographic_summary: (dimension, SQL for the value of one demographics row)
+# NULLs are counted under '', children are bucketed 0, 1, 2, 3+; 'members' holds the total
+SUMMARY_DIMENSIONS = [
+    ('marital_status', "coalesce({row}.marital_status, '')"),
+    ('education_level', "coalesce({row}.education_level, '')"),
+    ('attendance', "coalesce({row}.attendance, '')"),
+    ('involvement', "coalesce({row}.involvement, '')"),
+    ('disabilities', "coalesce({row}.disabilities, '')"),
+    ('children', "CASE WHEN {row}.children >= 3 THEN '3+' ELSE coalesce(CAST({row}.children AS TEXT), '') END"),
+    ('members', "''"),
+]
+
+
+def _summary_changes(row, delta):  # statements adding delta to every count the row is part of
+    return '\n'.join(
+        f"""INSERT INTO demographic_summary (dimension, value, members) VALUES ('{dimension}', {value.format(row=row)}, {delta})
+            ON CONFLICT (dimension, value) DO UPDATE SET members = members + {delta};"""
+        for dimension, value in SUMMARY_DIMENSIONS)
+
+
+def _summary_select(where=''):  # the counts computed from scratch, as (dimension, value, members) rows
+    return ' UNION ALL '.join(
+        f"SELECT '{dimension}', {value.format(row='demographics')}, count(*) FROM demographics {where} GROUP BY 2"
+        for dimension, value in SUMMARY_DIMENSIONS)
+
+
+def _summary_steps():
+    # demographic_summary kept in step with demographics by triggers, so Core bulk inserts are counted too;
+    # that is one trigger run per inserted row, about a quarter of import_members' time (20k rows into a 10k-member
+    # database: ~4.9k rows/s with the trigger, ~6.3k without), so the import swaps it for BULK_INSERT_STEPS
+    columns = ', '.join(dimension for dimension, _ in SUMMARY_DIMENSIONS if dimension != 'members')
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS demographic_summary_ai AFTER INSERT ON demographics BEGIN
+            {_summary_changes('new', 1)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS demographic_summary_ad AFTER DELETE ON demographics BEGIN
+            {_summary_changes('old', -1)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS demographic_summary_au AFTER UPDATE OF {columns} ON demographics BEGIN
+            {_summary_changes('old', -1)}
+            {_summary_changes('new', 1)}
+        END""",
+        rebuild_summary,  # count the rows that are already there
+    ]
+
+
+def rebuild_summary(conn):  # recounts demographic_summary from scratch, e.g. after the triggers were bypassed
+    conn.exec_driver_sql("DELETE FROM demographic_summary")
+    conn.exec_driver_sql(f"INSERT INTO demographic_summary (dimension, value, members) {_summary_select()}")
+
+
+def check_summary(bind=None):  # compares demographic_summary with a full recount, returns the differences
+    with (bind or get_engine()).connect() as conn:
+        kept = {(dimension, value): members for dimension, value, members
+                in conn.exec_driver_sql("SELECT dimension, value, members FROM demographic_summary WHERE members != 0")}
+        actual = {(dimension, value): members for dimension, value, members in conn.exec_driver_sql(_summary_select())}
+    return [(dimension, value, kept.get((dimension, value), 0), actual.get((dimension, value), 0))
+            for dimension, value in sorted(set(kept) | set(actual))
+            if kept.get((dimension, value), 0) != actual.get((dimension, value), 0)]
+
+
+def _fill_phone_e164(conn):  # normalize_phone is Python, so existing numbers are normalized here, not in SQL
+    rows = conn.exec_driver_sql("SELECT id, phone_number FROM members WHERE phone_number IS NOT NULL").fetchall()
+    updates = [{'member_id': member_id, 'phone_e164': models.normalize_phone(number)} for member_id, number in rows]
+    if updates:
+        conn.execute(models.Member.__table__.update().where(models.Member.id == bindparam('member_id')).
+                     values(phone_e164=bindparam('phone_e164')), updates)
+
+
+def _normalize_outbox_numbers(conn):
+    # reminders and broadcasts queued before were keyed (and sent) by the number as typed; they move to the
+    # normalized number the jobs use now, so a rerun finds them. Two rows for the same phone are the same
+    # message: a pending one is dropped in favour of one that already went out, otherwise the older one stays
+    rows = conn.exec_driver_sql("SELECT id, idempotency_key, to_number, status FROM outbox").fetchall()
+    holders = {key: (message_id, status) for message_id, key, _, status in rows}
+    for message_id, key, to_number, status in sorted(rows, key=lambda row: (row[3] == 'Pending', row[0])):
+        number = models.normalize_phone(to_number)
+        if (not key.startswith(('reminder:', 'broadcast:')) or number is None or number == to_number
+                or not key.endswith(f":{to_number}")):
+            continue
+        new_key = key[:-len(to_number)] + number
+        holder = holders.get(new_key)
+        if holder is not None and (status == 'Pending' or holder[1] != 'Pending'):
+            if status == 'Pending':
+                conn.exec_driver_sql("DELETE FROM outbox WHERE id = ?", (message_id,))
+                del holders[key]
+            continue  # both went out, the message keeps its old key
+        if holder is not None:
+            conn.exec_driver_sql("DELETE FROM outbox WHERE id = ?", (holder[0],))
+        conn.exec_driver_sql("UPDATE outbox SET idempotency_key = ?, to_number = ? WHERE id = ?",
+                             (new_key, number, message_id))
+        del holders[key]
+        holders[new_key] = (message_id, status)
+
+
+def _fill_reminder_deliveries(conn):
+    # reminders queued before the ledger were keyed reminder:{first event date}:{hash of the event ids}:{number};
+    # the events they covered are the ones from that date on whose name and date appear in the body
+    rows = conn.exec_driver_sql("SELECT idempotency_key, to_number, body FROM outbox "
+                                "WHERE idempotency_key LIKE 'reminder:%:%:%' AND status != 'Dead'").fetchall()
+    events = conn.exec_driver_sql("SELECT id, name, event_date FROM events").fetchall()
+    deliveries = set()
+    for key, to_number, body in rows:
+        first_date = key.split(':')[1]
+        for event_id, name, event_date in events:
+            if str(event_date) >= first_date and f"'{name}'" in body and f"{event_date} at" in body:
+                deliveries.add((event_id, to_number))
+    if deliveries:
+        conn.execute(models.ReminderDelivery.__table__.insert().prefix_with('OR IGNORE'),
+                     [{'event_id': event_id, 'phone_number': number} for event_id, number in deliveries])
+
+
+# spellings the member form offered that are neither an enum's name nor its display value
+OLD_FORM_SPELLINGS = {'Bachelors Degree': models.EducationLevel.Bachelors, 'Bi-Weekly': models.AttendanceLevel.Bi_weekly}
+
+
+def _store_enum_names(conn):
+    # enum columns hold the member's name ('Never_Married'), but the member form saved the display text
+    # ('Never Married'), which the ORM can't load; rewritten with UPDATE so the summary and change log triggers follow
+    for table in (models.Member.__table__, models.Demographics.__table__):
+        for column in table.columns:
+            enum_class = getattr(column.type, 'enum_class', None)
+            if enum_class is None:
+                continue
+            spellings = {item.value: item for item in enum_class if item.value != item.name}
+            spellings.update({text: item for text, item in OLD_FORM_SPELLINGS.items() if isinstance(item, enum_class)})
+            for text, item in spellings.items():
+                conn.exec_driver_sql(f"UPDATE {table.name} SET {column.name} = ? WHERE {column.name} = ?", (item.name, text))
+
+
+# what each per-row AFTER INSERT trigger on members and demographics does, as one statement for all the rows
+# with an id above :members_after / :demographics_after; bulk_import.py drops the triggers for a chunk and runs
+# these instead (20k rows into a 10k-member database: ~4.9k rows/s with the per-row triggers, ~13k with these)
+BULK_INSERT_STEPS = {
+    'members_fts_ai': f"""INSERT INTO members_fts(rowid, {', '.join(MEMBERS_FTS_COLUMNS)})
+        SELECT id, {', '.join(MEMBERS_FTS_COLUMNS)} FROM members WHERE id > :members_after""",
+    'demographic_summary_ai': f"""INSERT INTO demographic_summary (dimension, value, members)
+        SELECT * FROM ({_summary_select('WHERE id > :demographics_after')}) WHERE true
+        ON CONFLICT (dimension, value) DO UPDATE SET members = members + excluded.members""",
+    'members_changes_insert': """INSERT INTO member_changes (member_id)
+        SELECT id FROM members WHERE id > :members_after AND EXISTS (SELECT 1 FROM segments)""",
+    'demographics_changes_insert': """INSERT INTO member_changes (member_id)
+        SELECT member_id FROM demographics WHERE id > :demographics_after AND EXISTS (SELECT 1 FROM segments)""",
+}
+
+
+def _change_log_steps():
+    # every write to members or demographics notes the member in member_changes, so segment recipients can be
+    # refreshed for just those members; nothing is logged while no segment exists
+    steps = []
+    for table, key in (('members', 'id'), ('demographics', 'member_id')):
+        for action, rows in (('INSERT', ['new']), ('DELETE', ['old']), ('UPDATE', ['old', 'new'])):
+            inserts = ' '.join(f"INSERT INTO member_changes (member_id) VALUES ({row}.{key});" for row in rows)
+            steps.append(f"""CREATE TRIGGER IF NOT EXISTS {table}_changes_{action.lower()} AFTER {action} ON {table}
+                WHEN EXISTS (SELECT 1 FROM segments) BEGIN {inserts} END""")
+    return steps
+
+
+MIGRATIONS = [
+    (1, 'indexes for the hot lookup columns', [
+        "CREATE INDEX IF NOT EXISTS ix_demographics_member_id ON demographics (member_id)",
+        "CREATE INDEX IF NOT EXISTS ix_demographics_marital_status ON demographics (marital_status, member_id)",
+        "CREATE INDEX IF NOT EXISTS ix_demographics_education_level ON demographics (education_level, member_id)",
+        "CREATE INDEX IF NOT EXISTS ix_demographics_involvement ON demographics (involvement, member_id)",
+        "CREATE INDEX IF NOT EXISTS ix_demographics_disabilities ON demographics (disabilities, member_id)",
+        "CREATE INDEX IF NOT EXISTS ix_demographics_children ON demographics (children, member_id)",
+        "CREATE INDEX IF NOT EXISTS ix_members_names ON members (first_name, last_name)",
+        "CREATE INDEX IF NOT EXISTS ix_events_name_date ON events (name, event_date)",
+        "CREATE INDEX IF NOT EXISTS ix_events_event_date ON events (event_date)",
+        "ANALYZE",  # gives the planner row counts so it picks these indexes
+    ]),
+    (2, 'indexed birthday calendar', [
+        lambda conn: _add_column(conn, 'members', 'birth_mmdd', 'INTEGER'),
+        # only ISO dates (YYYY-MM-DD...) are understood, anything else stays NULL like birthday_key does
+        """UPDATE members SET birth_mmdd = CAST(substr(date_of_birth, 6, 2) AS INTEGER) * 100
+                                         + CAST(substr(date_of_birth, 9, 2) AS INTEGER)
+           WHERE date_of_birth GLOB '[0-9][0-9][0-9][0-9]-[01][0-9]-[0-3][0-9]*'""",
+        "CREATE INDEX IF NOT EXISTS ix_members_birth_mmdd ON members (birth_mmdd)",
+    ]),
+    (3, 'full-text search over members and events',
+        _fts_steps('members_fts', 'members', MEMBERS_FTS_COLUMNS)
+        + _fts_steps('events_fts', 'events', ['name', 'location', 'description'])),
+    (4, 'demographic counts kept up to date by triggers', _summary_steps()),
+    (5, 'change log for refreshing audience segments', _change_log_steps()),
+    (6, 'normalized phone numbers', [
+        lambda conn: _add_column(conn, 'members', 'phone_e164', 'VARCHAR(16)'),
+        _fill_phone_e164,
+        _normalize_outbox_numbers,
+        "CREATE INDEX IF NOT EXISTS ix_members_phone_e164 ON members (phone_e164)",
+    ]),
+    (7, 'indexed sort keys for the paged listings', [
+        "CREATE INDEX IF NOT EXISTS ix_members_last_first ON members (last_name, first_name)",
+        "CREATE INDEX IF NOT EXISTS ix_members_phone_sort ON members (coalesce(phone_number, ''))",
+        "CREATE INDEX IF NOT EXISTS ix_members_join_date_sort ON members (coalesce(join_date, ''))",
+        "CREATE INDEX IF NOT EXISTS ix_events_location ON events (location)",
+        "CREATE INDEX IF NOT EXISTS ix_volunteer_opportunities_name ON volunteer_opportunities (name)",
+        "CREATE INDEX IF NOT EXISTS ix_volunteer_opportunities_date_posted ON volunteer_opportunities (date_posted)",
+        "CREATE INDEX IF NOT EXISTS ix_member_volunteering_opportunity ON member_volunteering (opportunity_id, member_id)",
+        "CREATE INDEX IF NOT EXISTS ix_member_volunteering_date ON member_volunteering (date_volunteered, member_id, opportunity_id)",
+    ]),
+    (8, 'reminders recorded per event and number', [
+        """CREATE TABLE IF NOT EXISTS reminder_deliveries (event_id INTEGER NOT NULL, phone_number VARCHAR(30) NOT NULL,
+                                                         PRIMARY KEY (event_id, phone_number)) WITHOUT ROWID""",
+        _fill_reminder_deliveries,
+    ]),
+    (9, 'enum columns store the name, not the display text', [_store_enum_names]),
+]
+
+# query functions checked by check_query_plans, with the arguments to call them with
+CHECKED_QUERIES = [
+    ('get_event_by_name', ('plan check',)),
+    ('get_event_by_date', ('2000-01-01',)),
+    ('get_member_by_email', ('plan@check',)),
+    ('get_member_by_names', ('plan', 'check')),
+    ('married_members', ()),
+    ('children_query', ()),
+    ('uneducated_members', ()),
+    ('educated_members', ()),
+    ('disabled_members', ()),
+    ('office_bearers', ()),
+    ('get_upcoming_birthdays', (7,)),
+    ('get_events_between', ('2000-01-01', '2000-01-31')),
+    ('get_members_page', (None, 100, 'phone_number')),
+    ('get_events_page', (None, 100, 'location')),
+    ('get_opportunities_page', (None, 100, 'date_posted')),
+    ('get_volunteering_page', (None, 100, 'date_volunteered')),
+]
+
+# full scans that are expected, with the reason
+EXPECTED_SCANS = {
+    'educated_members': "'NOT IN' can't be answered from an index",
+}
+
+
+def _add_column(conn, table, column, definition):  # ALTER TABLE ... ADD COLUMN unless create_all already added it
+    columns = [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def schema_version(conn):
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def init_db(bind=None):  # the explicit setup step: creates missing tables, then migrates, returns the schema version
+    bind = bind or get_engine()
+    Base.metadata.create_all(bind)
+    version = migrate(bind)
+    print("Database is ready.")
+    return version
+
+
+def migrate(bind=None):  # applies every migration newer than the database, returns the new version
+    with (bind or get_engine()).begin() as conn:
+        version = schema_version(conn)
+        for number, description, steps in MIGRATIONS:
+            if number <= version:
+                continue
+            print(f"Applying migration {number}: {description}")
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.exec_driver_sql(step)
+            conn.exec_driver_sql(f"PRAGMA user_version = {number}")
+            version = number
+    return version
+
+
+def _full_scans(conn, statement, parameters):  # tables the statement reads without an index
+    plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    return [row[-1] for row in plan if row[-1].startswith('SCAN') and 'USING' not in row[-1]]
+
+
+def check_query_plans():  # runs each query function and explains every statement it sends, returns the problems found
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    problems = []
+    engine = get_engine()
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        for name, args in CHECKED_QUERIES:
+            statements.clear()
+            try:
+                getattr(models, name)(*args)
+            except RuntimeError:
+                pass  # "not found" is fine, the statement was still sent
+            with engine.connect() as conn:
+                for statement, parameters in list(statements):
+                    for scan in _full_scans(conn, statement, parameters):
+                        if name in EXPECTED_SCANS:
+                            print(f"{name}: {scan} (expected: {EXPECTED_SCANS[name]})")
+                        else:
+                            problems.append((name, scan))
+                            print(f"{name}: {scan}")
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+        models.session.rollback()
+    return problems
+
+
+if __name__ == "__main__":
+    print(f"Database is at schema version {init_db()}")
+    if sys.argv[1:] == ['check']:
+        problems = check_query_plans()
+        print(f"{len(problems)} queries use a full table scan" if problems else "All checked queries use an index")
+        sys.exit(1 if problems else 0)
+    if sys.argv[1:] == ['check-summary']:
+        differences = check_summary()
+        for dimension, value, kept, actual in differences:
+            print(f"{dimension} '{value}': summary says {kept}, demographics has {actual}")
+        print(f"{len(differences)} counts are out of step, run 'python migrations.py rebuild-summary'"
+              if differences else "The demographic summary matches the demographics table")
+        sys.exit(1 if differences else 0)
+    if sys.argv[1:] == ['rebuild-summary']:
+        with get_engine().begin() as conn:
+            rebuild_summary(conn)
+        print("Demographic summary rebuilt")
@@ -1,13 +1,18 @@
-from sqlalchemy import create_engine, Column, Integer, String, Date, Enum, ForeignKey, Text
+from sqlalchemy import event, func, or_, tuple_, text, literal_column, inspect, Column, Integer, String, Date, DateTime, Enum, ForeignKey, Text, Index
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.sql import visitors
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker, aliased
+from sqlalchemy.orm import relationship, make_transient_to_detached
+import os
+import re
 import enum
+import calendar
+import datetime
+from collections import namedtuple
 
-# Define the database URL (SQLite in this case)
-DATABASE_URL = "sqlite:///church.db"
-
-# Create an engine and connect to the database
-engine = create_engine(DATABASE_URL, echo=True)
+# The engine and session are shared with screen.py and daily_tasks.py, see database.py
+from database import get_engine, Session, session
+from cache import LookupCache, cached_lookup
 
 # Define a base class for models
 Base = declarative_base()
@@ -53,6 +58,12 @@ class Yes_No(enum.Enum):
     Yes = "Yes"
     No = "No"
 
+class OutboxStatus(enum.Enum):
+    Pending = "Pending"  # waiting to be sent (or to be retried)
+    Sending = "Sending"  # claimed by a drain worker, reclaimed if the worker dies before finishing
+    Sent = "Sent"
+    Dead = "Dead"  # gave up after too many attempts
+
 ##################################################################
 
 """ Set the tables"""
@@ -66,6 +77,12 @@ class Event(Base):
     location = Column(String(100), nullable=False)
     description = Column(Text)
 
+    __table_args__ = (
+        Index('ix_events_name_date', 'name', 'event_date'),
+        Index('ix_events_event_date', 'event_date'),
+        Index('ix_events_location', 'location'),
+    )
+
 class Member(Base):  # revise what can/cannot be nullable
     __tablename__ = 'members'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -78,11 +95,60 @@ class Member(Base):  # revise what can/cannot be nullable
     address = Column(String(255))
     join_date = Column(String(20))
     membership_status = Column(Enum(MembershipStatus))
+    birth_mmdd = Column(Integer)  # month * 100 + day of date_of_birth, kept in sync by set_birth_mmdd
+    phone_e164 = Column(String(16))  # phone_number as +<country><number>, NULL if it isn't a usable number, see set_phone_e164
 
     # Relationships
     demographics = relationship("Demographics", back_populates="member")
     volunteer_opportunities = relationship("MemberVolunteering", back_populates="member")
 
+    __table_args__ = (
+        Index('ix_members_names', 'first_name', 'last_name'),
+        Index('ix_members_birth_mmdd', 'birth_mmdd'),
+        Index('ix_members_phone_e164', 'phone_e164'),
+        Index('ix_members_last_first', 'last_name', 'first_name'),
+    )
+
+# sort keys of the member listing on nullable columns, see MEMBER_SORT_COLUMNS
+Index('ix_members_phone_sort', func.coalesce(Member.phone_number, literal_column("''")))
+Index('ix_members_join_date_sort', func.coalesce(Member.join_date, literal_column("''")))
+
+def birthday_key(date_of_birth):  # '1980-01-31' or date(1980, 1, 31) -> 131, None if there is no usable date
+    if not date_of_birth:
+        return None
+    try:
+        if isinstance(date_of_birth, str):
+            date_of_birth = datetime.date.fromisoformat(date_of_birth.strip()[:10])
+        return date_of_birth.month * 100 + date_of_birth.day
+    except (ValueError, AttributeError):
+        return None
+
+@event.listens_for(Member, 'before_insert')
+@event.listens_for(Member, 'before_update')
+def set_birth_mmdd(mapper, connection, member):  # keep the birthday index current on every add/edit
+    member.birth_mmdd = birthday_key(member.date_of_birth)
+
+PHONE_COUNTRY_CODE = os.environ.get('ORG_PHONE_COUNTRY_CODE', '27')  # for numbers written the national way, e.g. 078 120 5705
+
+def normalize_phone(number):  # '+27 78 120 5705', '078-120-5705', '0027781205705' -> '+27781205705', None if it can't be a number
+    if not number:
+        return None
+    text = re.sub(r'[\s\-().]', '', str(number))
+    if text.startswith('00'):
+        text = '+' + text[2:]
+    elif text.startswith('0'):
+        text = '+' + PHONE_COUNTRY_CODE + text[1:]
+    elif not text.startswith('+') and text.startswith(PHONE_COUNTRY_CODE):
+        text = '+' + text
+    if not re.fullmatch(r'\+[1-9][0-9]{7,14}', text):  # E.164: at most 15 digits, no leading zero
+        return None
+    return text
+
+@event.listens_for(Member, 'before_insert')
+@event.listens_for(Member, 'before_update')
+def set_phone_e164(mapper, connection, member):  # keep the normalized number current on every add/edit
+    member.phone_e164 = normalize_phone(member.phone_number)
+
 class Demographics(Base):
     __tablename__ = 'demographics'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -100,6 +166,16 @@ class Demographics(Base):
     # Relationships
     member = relationship("Member", back_populates="demographics")
 
+    # the stats queries filter on one column and join on member_id, so each index carries member_id as well
+    __table_args__ = (
+        Index('ix_demographics_member_id', 'member_id'),
+        Index('ix_demographics_marital_status', 'marital_status', 'member_id'),
+        Index('ix_demographics_education_level', 'education_level', 'member_id'),
+        Index('ix_demographics_involvement', 'involvement', 'member_id'),
+        Index('ix_demographics_disabilities', 'disabilities', 'member_id'),
+        Index('ix_demographics_children', 'children', 'member_id'),
+    )
+
 class VolunteerOpportunity(Base):
     __tablename__ = 'volunteer_opportunities'
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -111,6 +187,11 @@ class VolunteerOpportunity(Base):
     # Relationships
     members = relationship("MemberVolunteering", back_populates="volunteer_opportunity")
 
+    __table_args__ = (
+        Index('ix_volunteer_opportunities_name', 'name'),
+        Index('ix_volunteer_opportunities_date_posted', 'date_posted'),
+    )
+
 class MemberVolunteering(Base):
     __tablename__ = 'member_volunteering'
     member_id = Column(Integer, ForeignKey('members.id'), primary_key=True)
@@ -121,8 +202,107 @@ class MemberVolunteering(Base):
     member = relationship("Member", back_populates="volunteer_opportunities")
     volunteer_opportunity = relationship("VolunteerOpportunity", back_populates="members")
 
-# Create all tables
-Base.metadata.create_all(engine)
+    __table_args__ = (
+        Index('ix_member_volunteering_opportunity', 'opportunity_id', 'member_id'),
+        Index('ix_member_volunteering_date', 'date_volunteered', 'member_id', 'opportunity_id'),
+    )
+
+class DemographicSummary(Base):  # member counts per demographics value, maintained by the triggers of migration 4
+    __tablename__ = 'demographic_summary'
+    dimension = Column(String(30), primary_key=True)  # a demographics column, 'children' (bucketed) or 'members'
+    value = Column(String(50), primary_key=True)  # the stored value, '' for not filled in
+    members = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class Segment(Base):  # a saved audience, see segments.py for the definition format
+    __tablename__ = 'segments'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), unique=True, nullable=False)
+    definition = Column(Text, nullable=False)  # JSON
+    refreshed_change = Column(Integer)  # last member_changes.id applied to segment_members, NULL = rebuild needed
+    updated_at = Column(DateTime, nullable=False)
+
+class SegmentMember(Base):  # the cached recipients of each segment
+    __tablename__ = 'segment_members'
+    segment_id = Column(Integer, ForeignKey('segments.id'), primary_key=True)
+    member_id = Column(Integer, primary_key=True)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+class MemberChange(Base):  # members whose row or demographics changed, written by the triggers of migration 5
+    __tablename__ = 'member_changes'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    member_id = Column(Integer, nullable=False)
+
+class OutboxMessage(Base):  # messages waiting to go out, written by the daily jobs and sent by the drain worker
+    __tablename__ = 'outbox'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    idempotency_key = Column(String(200), unique=True, nullable=False)  # same key is only ever enqueued once
+    to_number = Column(String(30), nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(Enum(OutboxStatus), nullable=False, default=OutboxStatus.Pending)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)  # when Sending: the end of the worker's lease
+    claim_token = Column(String(32))
+    last_error = Column(Text)
+    provider_sid = Column(String(64))
+    created_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime)
+
+    __table_args__ = (Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),)
+
+class ReminderDelivery(Base):  # the events each number has been reminded about, written with the outbox row that covers them
+    __tablename__ = 'reminder_deliveries'
+    event_id = Column(Integer, primary_key=True)
+    phone_number = Column(String(30), primary_key=True)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+@event.listens_for(Event, 'after_delete')
+def drop_reminder_deliveries(mapper, connection, deleted_event):  # bulk_operations.bulk_delete does the same in SQL
+    connection.execute(ReminderDelivery.__table__.delete().where(ReminderDelivery.event_id == deleted_event.id))
+
+
+""" Lookup caches (see cache.py), emptied precisely on flush """
+member_cache = LookupCache('members', maxsize=4096, ttl=300)
+event_cache = LookupCache('events', maxsize=1024, ttl=300)
+
+def _detached_copy(instance):  # a copy that belongs to no session, so one cached object can be read from any thread
+    mapper = inspect(instance).mapper
+    copy = mapper.class_(**{attr.key: getattr(instance, attr.key) for attr in mapper.column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_lookup_caches(flushing_session, flush_context):
+    # changed or deleted rows drop every key they were cached under (by row id), and the keys of their
+    # new values are dropped too in case "not found" was cached for them. Another thread can still cache
+    # the committed row between the flush and the commit, so the same keys are dropped again after the commit
+    flushed = []
+    for instance in list(flushing_session.new) + list(flushing_session.dirty) + list(flushing_session.deleted):
+        if isinstance(instance, Member):
+            flushed.append((member_cache, [('email', instance.email), ('names', instance.first_name, instance.last_name),
+                            ('identity', instance.first_name, instance.last_name, str(instance.date_of_birth))],
+                            [instance.id] if instance.id is not None else []))
+        elif isinstance(instance, Event):
+            flushed.append((event_cache, [('name', instance.name), ('identity', instance.name, str(instance.event_date))],
+                            [instance.id] if instance.id is not None else []))
+    for cache, keys, row_ids in flushed:
+        cache.invalidate(keys=keys, row_ids=row_ids)
+    flushing_session.info.setdefault('cache_invalidations', []).extend(flushed)
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed_lookups(committed_session):
+    for cache, keys, row_ids in committed_session.info.pop('cache_invalidations', []):
+        cache.invalidate(keys=keys, row_ids=row_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_lookup_invalidations(rolled_back_session):  # nothing was committed, the flush already dropped the keys
+    rolled_back_session.info.pop('cache_invalidations', None)
+
+def cache_stats():  # hit/miss counters of the lookup caches
+    return {'members': member_cache.stats(), 'events': event_cache.stats()}
 
 
 """ Queries """
@@ -135,6 +315,7 @@ def get_all_events():  # no parms because its '.all()'
         print(f"An error occurred: {e}")                                
         raise RuntimeError(f"Failed to retrieve events: {e}")  # exception to be handled by the caller
 
+@cached_lookup(event_cache, lambda ename: ('name', ename), copy_fn=_detached_copy)
 def get_event_by_name(ename):
     try:
         found = session.query(Event).filter_by(name=ename).first()
@@ -166,6 +347,7 @@ def get_all_members():  # no parms because its '.all()'
         print(f"An error occurred: {e}")                                
         raise RuntimeError(f"Failed to retrieve members: {e}")  # exception to be handled by the caller
 
+@cached_lookup(member_cache, lambda email: ('email', email), copy_fn=_detached_copy)
 def get_member_by_email(email):
     try:
         result = session.query(Member).filter_by(email=email).first()
@@ -174,6 +356,7 @@ def get_member_by_email(email):
         print(f"An error occurred: {e}")                                
         raise RuntimeError(f"Failed to retrieve member with email '{email}': {e}")  # exception to be handled by the caller
 
+@cached_lookup(member_cache, lambda fname, lname: ('names', fname, lname), copy_fn=_detached_copy)
 def get_member_by_names(fname, lname ):
     try:
         result = session.query(Member).filter_by(first_name=fname, last_name=lname).first()
@@ -182,13 +365,236 @@ def get_member_by_names(fname, lname ):
         print(f"An error occurred: {e}")                                
         raise RuntimeError(f"Failed to retrieve member with names '{fname, lname}': {e}")  # exception to be handled by the caller
 
+# id lookups for the edit/remove screens, which then load the row with session.get (identity map first)
+@cached_lookup(member_cache, lambda fname, lname, dob: ('identity', fname, lname, str(dob)), row_id_fn=lambda member_id: member_id)
+def find_member_id(fname, lname, dob):
+    try:
+        return session.query(Member.id).filter_by(first_name=fname, last_name=lname, date_of_birth=dob).scalar()
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve member '{fname} {lname}': {e}")
+
+@cached_lookup(event_cache, lambda ename, edate: ('identity', ename, str(edate)), row_id_fn=lambda event_id: event_id)
+def find_event_id(ename, edate):
+    try:
+        return session.query(Event.id).filter_by(name=ename, event_date=edate).limit(1).scalar()
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve event '{ename}' on '{edate}': {e}")
+
+""" Full-text search (FTS5 indexes created by migration 3) """
+def _fts_query(search_text):  # 'Thandi zu' -> '"Thandi"* "zu"*': every word must match, as a prefix
+    words = re.findall(r'\w+', search_text)
+    return ' '.join(f'"{word}"*' for word in words)
+
+def search_members(search_text, limit=50):  # best matches first, rows of (id, first_name, last_name, email, phone_number)
+    query = _fts_query(search_text)
+    if not query:
+        return []
+    try:
+        return session.execute(text(
+            "SELECT members.id, members.first_name, members.last_name, members.email, members.phone_number "
+            "FROM members_fts JOIN members ON members.id = members_fts.rowid "
+            "WHERE members_fts MATCH :query ORDER BY members_fts.rank LIMIT :limit"),
+            {'query': query, 'limit': limit}).all()
+    except Exception as e:
+        print(f"An error occurred while searching members: {e}")
+        raise RuntimeError(f"Failed to search members for '{search_text}': {e}")
+
+def search_events(search_text, limit=50):  # best matches first, rows of (id, name, event_date, location, description)
+    query = _fts_query(search_text)
+    if not query:
+        return []
+    try:
+        return session.execute(text(
+            "SELECT events.id, events.name, events.event_date, events.location, events.description "
+            "FROM events_fts JOIN events ON events.id = events_fts.rowid "
+            "WHERE events_fts MATCH :query ORDER BY events_fts.rank LIMIT :limit"),
+            {'query': query, 'limit': limit}).all()
+    except Exception as e:
+        print(f"An error occurred while searching events: {e}")
+        raise RuntimeError(f"Failed to search events for '{search_text}': {e}")
+
+""" Paged listings (keyset paging: each page continues after the last row of the previous one) """
+# sort key -> the columns rows are ordered by; every key has an index (see migration 7) that returns the rows in
+# that order followed by the tie-breaker, so a page costs the same wherever it starts. Nullable columns are
+# sorted as '' (a literal, so the query matches the expression index) and the page key is never NULL.
+def _blank_if_null(column):
+    return func.coalesce(column, literal_column("''"))
+
+MEMBER_SORT_COLUMNS = {
+    'id': (),
+    'first_name': (Member.first_name, Member.last_name),
+    'last_name': (Member.last_name, Member.first_name),
+    'phone_number': (_blank_if_null(Member.phone_number),),
+    'join_date': (_blank_if_null(Member.join_date),),
+}
+
+EVENT_SORT_COLUMNS = {
+    'id': (),
+    'name': (Event.name, Event.event_date),
+    'event_date': (Event.event_date,),
+    'location': (Event.location,),
+}
+
+OPPORTUNITY_SORT_COLUMNS = {
+    'id': (),
+    'name': (VolunteerOpportunity.name,),
+    'date_posted': (VolunteerOpportunity.date_posted,),
+}
+
+VOLUNTEERING_SORT_COLUMNS = {  # the tie-breaker is the primary key (member_id, opportunity_id)
+    'member': (),
+    'opportunity': (MemberVolunteering.opportunity_id,),
+    'date_volunteered': (MemberVolunteering.date_volunteered,),
+}
+
+# fields the listings can be filtered on, in the definition format of segments.py (members use segments.FIELDS)
+EVENT_FIELDS = {
+    'name': Event.name,
+    'event_date': Event.event_date,
+    'start_time': Event.start_time,
+    'end_time': Event.end_time,
+    'location': Event.location,
+}
+
+OPPORTUNITY_FIELDS = {
+    'name': VolunteerOpportunity.name,
+    'date_posted': VolunteerOpportunity.date_posted,
+    'location': VolunteerOpportunity.location,
+}
+
+VOLUNTEERING_FIELDS = {
+    'member_id': MemberVolunteering.member_id,
+    'opportunity_id': MemberVolunteering.opportunity_id,
+    'date_volunteered': MemberVolunteering.date_volunteered,
+}
+
+def _keyset_page(query, sort_columns, key_columns, after, limit, descending):
+    # returns (rows, after) where after is the key to pass in for the next page, or None on the last page
+    # the rows are ordered by sort_columns, then key_columns (which together identify a row); limit=None
+    # returns everything that is left in one go
+    page_key = tuple(sort_columns) + tuple(column for column in key_columns
+                                           if not any(column is sort_column for sort_column in sort_columns))
+    if after is not None:
+        # the bound on the first column is implied by the row comparison, but SQLite only seeks into an
+        # expression index (the coalesce sort keys) with it
+        first = page_key[0] <= after[0] if descending else page_key[0] >= after[0]
+        query = query.filter(first, tuple_(*page_key) < tuple_(*after) if descending else tuple_(*page_key) > tuple_(*after))
+    query = query.order_by(*[column.desc() for column in page_key] if descending else page_key)
+    rows = query.add_columns(*[column.label(f'page_key_{i}') for i, column in enumerate(page_key)]).limit(limit).all()
+    width = len(page_key)
+    if limit is None or len(rows) < limit:
+        return [row[:-width] for row in rows], None
+    return [row[:-width] for row in rows], tuple(rows[-1][-width:])
+
+def _filtered(query, criteria, fields=None):
+    # criteria: a definition as in segments.py, on fields (None: the member fields of segments.FIELDS);
+    # member criteria on demographics become an id subquery, the others filter the table directly
+    if not criteria:
+        return query
+    from segments import compile_definition, _matching_ids  # segments imports this module
+    if fields is not None:
+        return query.filter(compile_definition(criteria, fields=fields))
+    condition = compile_definition(criteria)
+    if Demographics.__table__ in {getattr(element, 'table', None) for element in visitors.iterate(condition)}:
+        return query.filter(Member.id.in_(_matching_ids(condition)))
+    return query.filter(condition)
+
+def get_members_page(after=None, limit=100, sort='id', descending=False, criteria=None):
+    # rows of (id, first_name, last_name, phone_number, join_date)
+    try:
+        query = session.query(Member.id, Member.first_name, Member.last_name, Member.phone_number, Member.join_date)
+        return _keyset_page(_filtered(query, criteria), MEMBER_SORT_COLUMNS[sort], (Member.id,), after, limit, descending)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve members: {e}")
+
+def get_events_page(after=None, limit=100, sort='event_date', descending=False, criteria=None):
+    # rows of (id, name, event_date, start_time, location, description)
+    try:
+        query = session.query(Event.id, Event.name, Event.event_date, Event.start_time, Event.location, Event.description)
+        return _keyset_page(_filtered(query, criteria, EVENT_FIELDS), EVENT_SORT_COLUMNS[sort], (Event.id,),
+                            after, limit, descending)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve events: {e}")
+
+def get_opportunities_page(after=None, limit=100, sort='name', descending=False, criteria=None):
+    # rows of (id, name, date_posted, location, description)
+    try:
+        query = session.query(VolunteerOpportunity.id, VolunteerOpportunity.name, VolunteerOpportunity.date_posted,
+                              VolunteerOpportunity.location, VolunteerOpportunity.description)
+        return _keyset_page(_filtered(query, criteria, OPPORTUNITY_FIELDS), OPPORTUNITY_SORT_COLUMNS[sort],
+                            (VolunteerOpportunity.id,), after, limit, descending)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve volunteer opportunities: {e}")
+
+def get_volunteering_page(after=None, limit=100, sort='member', descending=False, criteria=None):
+    # rows of (member_id, first_name, last_name, opportunity_id, opportunity name, date_volunteered)
+    try:
+        query = session.query(MemberVolunteering.member_id, Member.first_name, Member.last_name,
+                              MemberVolunteering.opportunity_id, VolunteerOpportunity.name,
+                              MemberVolunteering.date_volunteered).select_from(MemberVolunteering).\
+            join(Member, Member.id == MemberVolunteering.member_id).\
+            join(VolunteerOpportunity, VolunteerOpportunity.id == MemberVolunteering.opportunity_id)
+        return _keyset_page(_filtered(query, criteria, VOLUNTEERING_FIELDS), VOLUNTEERING_SORT_COLUMNS[sort],
+                            (MemberVolunteering.member_id, MemberVolunteering.opportunity_id), after, limit, descending)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve volunteering: {e}")
+
+def get_events_between(start, end, after=None, limit=100):  # events from start to end (inclusive) in date order
+    # rows of (id, name, event_date, start_time, end_time, location, description), paged like get_events_page
+    try:
+        query = session.query(Event.id, Event.name, Event.event_date, Event.start_time, Event.end_time,
+                              Event.location, Event.description).filter(Event.event_date.between(start, end))
+        return _keyset_page(query, (Event.event_date,), (Event.id,), after, limit, False)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to retrieve events between '{start}' and '{end}': {e}")
+
+# the counts for the listings: a COUNT(*) with the same criteria, no sorting and no rows loaded
+def count_members(criteria=None):
+    try:
+        return _filtered(session.query(func.count(Member.id)), criteria).scalar()
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to count members: {e}")
+
+def count_events(criteria=None):
+    try:
+        return _filtered(session.query(func.count(Event.id)), criteria, EVENT_FIELDS).scalar()
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to count events: {e}")
+
+def count_opportunities(criteria=None):
+    try:
+        return _filtered(session.query(func.count(VolunteerOpportunity.id)), criteria, OPPORTUNITY_FIELDS).scalar()
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to count volunteer opportunities: {e}")
+
+def count_volunteering(criteria=None):
+    try:
+        return _filtered(session.query(func.count()).select_from(MemberVolunteering), criteria, VOLUNTEERING_FIELDS).scalar()
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        raise RuntimeError(f"Failed to count volunteering: {e}")
+
+def stored_forms(item):  # an enum member as it can be in the table: its name, or the display text older rows were saved with
+    return list(dict.fromkeys([item.name, item.value]))
+
+def _demographic_rows(condition, *columns):  # [(columns...)] of the members whose demographics match condition
+    query = session.query(*columns).select_from(Member).join(Demographics, Demographics.member_id == Member.id)
+    return [tuple(row) for row in query.filter(condition)]
+
 def married_members():
     try:
-        married_members_query = session.query(Demographics, Member).\
-            join(Member, Demographics.member_id == Member.id).\
-            filter(Demographics.marital_status == 'Married').all()
-        result = [(member.id, member.first_name, member.last_name, member.join_date)  # a list of tuples (id, name, surname)
-                for demo, member in married_members_query]    
+        result = _demographic_rows(Demographics.marital_status == 'Married',
+                                   Member.id, Member.first_name, Member.last_name, Member.join_date)  # a list of tuples (id, name, surname)
         count = len(result)
         return result, count
     except Exception as e:
@@ -197,11 +603,8 @@ def married_members():
 
 def children_query():
     try:
-        c_query = session.query(Demographics, Member).\
-            join(Member, Demographics.member_id == Member.id).\
-            filter(Demographics.children >= 1).all()  # greater or equal to 1
-        result = [(member.id, member.first_name, member.last_name, demo.children)  # Create a list of tuples (id, name, surname)
-                for demo, member in c_query]  # demo refers to results from Demographics table, unused in this case  
+        result = _demographic_rows(Demographics.children >= 1,  # greater or equal to 1
+                                   Member.id, Member.first_name, Member.last_name, Demographics.children)
         count = len(result)
         return result, count
     except Exception as e:
@@ -210,11 +613,8 @@ def children_query():
 
 def uneducated_members():
     try: 
-        uneducated_membs = session.query(Demographics, Member).\
-            join(Member, Demographics.member_id == Member.id).\
-            filter(Demographics.education_level == 'Before Matric').all()
-        result = [(member.id, member.first_name, member.last_name, member.phone_number)  # Create a list of tuples (id, name, surname)
-                for demo, member in uneducated_membs]    
+        result = _demographic_rows(Demographics.education_level.in_(stored_forms(EducationLevel.No_Matric)),
+                                   Member.id, Member.first_name, Member.last_name, Member.phone_number)
         count = len(result)
         return result, count
     except Exception as e:
@@ -223,11 +623,8 @@ def uneducated_members():
 
 def educated_members():
     try: 
-        educated_membs = session.query(Demographics, Member).\
-            join(Member, Demographics.member_id == Member.id).\
-            filter(Demographics.education_level != 'Before Matric').all()
-        result = [(member.id, member.first_name, member.last_name, member.phone_number)  # Create a list of tuples (id, name, surname)
-                for demo, member in educated_membs]    
+        result = _demographic_rows(Demographics.education_level.notin_(stored_forms(EducationLevel.No_Matric)),
+                                   Member.id, Member.first_name, Member.last_name, Member.phone_number)
         count = len(result)
         return result, count
     except Exception as e:
@@ -236,11 +633,8 @@ def educated_members():
     
 def disabled_members():
     try:
-        members_with_disabilities = session.query(Demographics, Member).\
-            join(Member, Demographics.member_id == Member.id).\
-            filter(Demographics.disabilities == 'Yes').all()
-        result = [(member.id, member.first_name, member.last_name, member.phone_number)  # Create a list of tuples (id, name, surname and phone number)
-                for demo, member in members_with_disabilities]    
+        result = _demographic_rows(Demographics.disabilities == 'Yes',  # id, name, surname and phone number
+                                   Member.id, Member.first_name, Member.last_name, Member.phone_number)
         count = len(result)
         return result, count
     except Exception as e:
@@ -249,16 +643,9 @@ def disabled_members():
 
 def office_bearers():
     try:
-        servers = session.query(Demographics, Member).\
-            join(Member, Demographics.member_id == Member.id).\
-            filter(Demographics.involvement == 'Server').all()
-        result = [(member.id, member.first_name, member.last_name, member.phone_number, demo.involvement)  # Create a list of tuples (id, name, surname, phone number and office)
-                for demo, member in servers] 
-        officers = session.query(Demographics, Member).\
-            join(Member, Demographics.member_id == Member.id).\
-            filter(Demographics.involvement == 'Officer').all()
-        result2 = [(member.id, member.first_name, member.last_name, member.phone_number, demo.involvement)  # Create a list of tuples (id, name, surname, phone number and office)
-                for demo, member in officers] 
+        columns = (Member.id, Member.first_name, Member.last_name, Member.phone_number, Demographics.involvement)  # and office
+        result = _demographic_rows(Demographics.involvement == 'Server', *columns)
+        result2 = _demographic_rows(Demographics.involvement == 'Officer', *columns)
         count = len(result)
         count2 = len(result2)
         return result, result2, count, count2
@@ -267,10 +654,152 @@ def office_bearers():
         raise RuntimeError(f"Failed to retrieve serving members: {e}")
 
 
+def _insert_outbox_rows(messages):  # one bulk insert, keys that were already enqueued (e.g. a rerun of the same job) are skipped
+    now = datetime.datetime.now()
+    rows = [{'idempotency_key': key, 'to_number': to_number, 'body': body, 'status': OutboxStatus.Pending,
+             'attempts': 0, 'next_attempt_at': now, 'created_at': now}
+            for key, to_number, body in messages]
+    if not rows:
+        return 0
+    stmt = sqlite_insert(OutboxMessage.__table__).on_conflict_do_nothing(index_elements=['idempotency_key'])
+    return session.execute(stmt, rows).rowcount
+
+def enqueue_messages(messages):  # messages: iterable of (idempotency_key, to_number, body)
+    try:
+        queued = _insert_outbox_rows(messages)
+        session.commit()
+        return queued
+    except Exception as e:
+        session.rollback()
+        print(f"An error occurred while queueing messages: {e}")
+        raise RuntimeError(f"Failed to queue messages: {e}")
+
+def enqueue_reminders(reminders):
+    # reminders: iterable of (idempotency_key, to_number, body, event ids the message covers); the outbox rows and
+    # the reminder_deliveries rows for every covered event go in one transaction
+    reminders = list(reminders)
+    try:
+        queued = _insert_outbox_rows((key, to_number, body) for key, to_number, body, _ in reminders)
+        deliveries = [{'event_id': event_id, 'phone_number': to_number}
+                      for _, to_number, _, event_ids in reminders for event_id in event_ids]
+        if deliveries:
+            session.execute(sqlite_insert(ReminderDelivery.__table__).on_conflict_do_nothing(), deliveries)
+        session.commit()
+        return queued
+    except Exception as e:
+        session.rollback()
+        print(f"An error occurred while queueing reminders: {e}")
+        raise RuntimeError(f"Failed to queue reminders: {e}")
+
+def reminded_numbers(event_ids):  # {event id: numbers already reminded about it}
+    reminded = {event_id: set() for event_id in event_ids}
+    try:
+        for event_id, phone_number in session.query(ReminderDelivery.event_id, ReminderDelivery.phone_number).\
+                filter(ReminderDelivery.event_id.in_(list(reminded))):
+            reminded[event_id].add(phone_number)
+        return reminded
+    except Exception as e:
+        print(f"An error occurred while looking up reminders: {e}")
+        raise RuntimeError(f"Failed to look up reminders: {e}")
+
+def queued_keys(keys):  # the idempotency keys that are already in the outbox, e.g. to preview a job
+    keys, found = list(keys), set()
+    try:
+        for start in range(0, len(keys), 500):  # stays under SQLite's limit on bound parameters
+            found.update(key for key, in session.query(OutboxMessage.idempotency_key).
+                         filter(OutboxMessage.idempotency_key.in_(keys[start:start + 500])))
+        return found
+    except Exception as e:
+        print(f"An error occurred while looking up outbox messages: {e}")
+        raise RuntimeError(f"Failed to look up outbox messages: {e}")
+
+def phone_number_groups(member_ids=None):
+    # [(normalized number or None, members with it)] for the members with a phone number, optionally only member_ids
+    # (a select of ids); None collects the numbers normalize_phone rejected
+    try:
+        query = session.query(Member.phone_e164, func.count()).filter(Member.phone_number.isnot(None))
+        if member_ids is not None:
+            query = query.filter(Member.id.in_(member_ids))
+        return query.group_by(Member.phone_e164).all()
+    except Exception as e:
+        print(f"An error occurred while grouping phone numbers: {e}")
+        raise RuntimeError(f"Failed to group phone numbers: {e}")
+
+def recipients_from_groups(groups):  # phone_number_groups rows -> (distinct numbers, {'members', 'duplicates', 'invalid'})
+    numbers = [number for number, _ in groups if number is not None]
+    stats = {'members': sum(count for _, count in groups),
+             'duplicates': sum(count - 1 for number, count in groups if number is not None),
+             'invalid': sum(count for number, count in groups if number is None)}
+    return numbers, stats
+
+def outbox_counts():  # {status: number of messages}
+    try:
+        rows = session.query(OutboxMessage.status, func.count(OutboxMessage.id)).group_by(OutboxMessage.status).all()
+        return {status.value: count for status, count in rows}
+    except Exception as e:
+        print(f"An error occurred while counting outbox messages: {e}")
+        raise RuntimeError(f"Failed to count outbox messages: {e}")
+
+def birthday_filter(days=0, today=None):  # condition on Member.birth_mmdd for birthdays from today to today + days
+    today = today or datetime.date.today()
+    if days >= 365:
+        return Member.birth_mmdd.isnot(None)
+    last_day = today + datetime.timedelta(days=days)
+    start_key, end_key = birthday_key(today), birthday_key(last_day)
+    if end_key == 228 and not calendar.isleap(last_day.year):
+        end_key = 229  # Feb 29 birthdays are celebrated on Feb 28 in other years
+    if last_day.year == today.year:
+        return Member.birth_mmdd.between(start_key, end_key)
+    return or_(Member.birth_mmdd >= start_key, Member.birth_mmdd <= end_key)  # the window wraps around New Year
+
+def get_upcoming_birthdays(days=0, today=None):  # members whose birthday falls between today and today + days
+    try:
+        result = session.query(Member).filter(birthday_filter(days, today)).order_by(Member.birth_mmdd).all()
+        count = len(result)
+        return result, count
+    except Exception as e:
+        print(f"An error occurred while querying birthdays: {e}")
+        raise RuntimeError(f"Failed to retrieve upcoming birthdays: {e}")
+
+DemographicStats = namedtuple('DemographicStats', ['members', 'married', 'with_children', 'uneducated', 'educated',
+                                                   'disabled', 'servers', 'officers'])
+
+# the enum behind each summary dimension, display text counted by older rows is folded into the enum's name
+SUMMARY_ENUMS = {'marital_status': Marital_Status, 'education_level': EducationLevel, 'attendance': AttendanceLevel,
+                 'involvement': Involvement, 'disabilities': Yes_No}
+
+def add_summary_count(summary, dimension, value, members):
+    for item in SUMMARY_ENUMS.get(dimension, ()):
+        if value == item.value:
+            value = item.name
+            break
+    counts = summary.setdefault(dimension, {})
+    counts[value] = counts.get(value, 0) + members
+
+def demographic_summary():  # {dimension: {enum name or stored value: members}} read from demographic_summary, a few dozen rows
+    try:
+        summary = {}
+        for dimension, value, members in session.query(DemographicSummary.dimension, DemographicSummary.value,
+                                                       DemographicSummary.members).filter(DemographicSummary.members != 0):
+            add_summary_count(summary, dimension, value, members)
+        return summary
+    except Exception as e:
+        print(f"An error occurred while reading the demographic summary: {e}")
+        raise RuntimeError(f"Failed to read the demographic summary: {e}")
+
+def demographic_stats():  # every count on the stats screen, read from the summary table instead of counting demographics
+    summary = demographic_summary()  # enums are keyed by name
+    education = summary.get('education_level', {})
+    return DemographicStats(
+        members=summary.get('members', {}).get('', 0),
+        married=summary.get('marital_status', {}).get(Marital_Status.Married.name, 0),
+        with_children=sum(count for bucket, count in summary.get('children', {}).items() if bucket not in ('', '0')),
+        uneducated=education.get(EducationLevel.No_Matric.name, 0),
+        educated=sum(count for level, count in education.items() if level not in ('', EducationLevel.No_Matric.name)),
+        disabled=summary.get('disabilities', {}).get(Yes_No.Yes.name, 0),
+        servers=summary.get('involvement', {}).get(Involvement.Server.name, 0),
+        officers=summary.get('involvement', {}).get(Involvement.Officer.name, 0))
 
-# Create a session
-Session = sessionmaker(bind=engine)
-session = Session()
 
 # Example: Adding a new member
 #new_member = Member(
@@ -288,5 +817,3 @@ session = Session()
 # Add and commit the new member
 #session.add(new_member)
 #session.commit()
-
-print("Database is ready.")
@@ -0,0 +1,64 @@
+import os
+import json
+from collections import namedtuple
+from database import DATABASE_URL, use_database, current_database_url
+from models import member_cache, event_cache
+
+# Multi-organization mode: each congregation gets its own database, listed in a registry file.
+#
+#   {"organizations": [
+#       {"key": "stmarks", "name": "St Mark's", "database_url": "sqlite:///orgs/stmarks.db"},
+#       {"key": "grace", "name": "Grace Chapel", "database_url": "sqlite:///orgs/grace.db"}
+#   ]}
+#
+# Without a registry file there is one organization, 'default', on DATABASE_URL (church.db), so a
+# single-congregation install works as before. ORG_KEY picks the organization a process starts with.
+
+REGISTRY_FILE = os.environ.get('ORG_REGISTRY', 'organizations.json')
+DEFAULT_ORG = os.environ.get('ORG_KEY')
+
+Organization = namedtuple('Organization', ['key', 'name', 'database_url'])
+
+
+def load_registry(path=None):  # [Organization], in the order of the file
+    path = path or REGISTRY_FILE
+    if not os.path.exists(path):
+        return [Organization('default', 'Church', DATABASE_URL)]
+    try:
+        with open(path, encoding='utf-8') as file:
+            entries = json.load(file)['organizations']
+        organizations = [Organization(entry['key'], entry.get('name') or entry['key'], entry['database_url'])
+                         for entry in entries]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise RuntimeError(f"Failed to read the organization registry '{path}': {e}")
+    keys = [organization.key for organization in organizations]
+    if not organizations or len(set(keys)) != len(keys):
+        raise RuntimeError(f"The organization registry '{path}' must list at least one organization, each with its own key")
+    return organizations
+
+
+def get_org(key=None, path=None):  # the organization with this key, by default ORG_KEY or the first one
+    organizations = load_registry(path)
+    key = key or DEFAULT_ORG
+    if key is None:
+        return organizations[0]
+    for organization in organizations:
+        if organization.key == key:
+            return organization
+    raise RuntimeError(f"Organization '{key}' is not in the registry, use one of {', '.join(o.key for o in organizations)}")
+
+
+def current_org(organizations=None):  # the organization whose database the shared session uses
+    organizations = organizations or load_registry()
+    for organization in organizations:
+        if organization.database_url == current_database_url():
+            return organization
+    return organizations[0]
+
+
+def switch_org(organization):  # makes organization's database the one the shared session uses
+    if organization.database_url == current_database_url():
+        return
+    use_database(organization.database_url)
+    member_cache.clear()  # the lookup caches are keyed by email/name, not by organization
+    event_cache.clear()
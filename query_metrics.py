@@ -0,0 +1,195 @@
+import os
+import sys
+import time
+import json
+import logging
+import threading
+from sqlalchemy import event
+
+# Per-statement instrumentation for the shared engine (see database.create_db_engine).
+# Every statement is timed between before/after_cursor_execute (for a SELECT that is the time to the first
+# row, SQLite returns the rest as they are fetched) and counted under the function that
+# sent it (e.g. 'models.married_members'), with a latency histogram per function. Statements slower
+# than SLOW_QUERY_MS are written to the slow-query log together with their EXPLAIN QUERY PLAN. A statement
+# that raises (e.g. "database is locked" after the busy timeout) is timed and counted as an error the same way.
+#
+#   ORG_SLOW_QUERY_MS=50 python screen.py     log statements slower than 50 ms
+#   python query_metrics.py                   run the checked queries and print the snapshot
+
+SLOW_QUERY_MS = float(os.environ.get('ORG_SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG = os.environ.get('ORG_SLOW_QUERY_LOG', 'slow_queries.log')
+HISTOGRAM_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)  # upper bounds of the latency buckets
+
+# modules skipped when looking for the function that sent a statement
+_INTERNAL_MODULES = ('sqlalchemy', 'contextlib', 'asyncio', __name__)
+
+slow_query_logger = logging.getLogger('church.slow_queries')
+if not slow_query_logger.handlers:
+    slow_query_logger.setLevel(logging.WARNING)
+    _slow_query_handler = logging.FileHandler(SLOW_QUERY_LOG, delay=True)  # the file is only created by the first slow query
+    _slow_query_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    slow_query_logger.addHandler(_slow_query_handler)
+    slow_query_logger.propagate = False  # keep church_management.log for errors
+
+
+def _bucket(elapsed_ms):
+    for bound in HISTOGRAM_MS:
+        if elapsed_ms <= bound:
+            return f"<={bound}ms"
+    return f">{HISTOGRAM_MS[-1]}ms"
+
+
+class QueryMetrics:  # counters and histograms per calling function, safe to update from any thread
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.callers = {}
+        self.slow = 0
+        self.errors = 0
+
+    def record(self, caller, elapsed_ms, rows, slow=False, error=False):
+        with self.lock:
+            stats = self.callers.get(caller)
+            if stats is None:
+                stats = self.callers[caller] = {'statements': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0,
+                                                'slow': 0, 'errors': 0, 'histogram': {}}
+            stats['statements'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            if rows > 0:
+                stats['rows'] += rows
+            bucket = _bucket(elapsed_ms)
+            stats['histogram'][bucket] = stats['histogram'].get(bucket, 0) + 1
+            if slow:
+                stats['slow'] += 1
+                self.slow += 1
+            if error:
+                stats['errors'] += 1
+                self.errors += 1
+
+    def snapshot(self):  # a plain dict (JSON friendly) of everything recorded since start or the last reset
+        with self.lock:
+            callers = {}
+            for caller, stats in sorted(self.callers.items(), key=lambda item: -item[1]['total_ms']):
+                callers[caller] = dict(stats, total_ms=round(stats['total_ms'], 3), max_ms=round(stats['max_ms'], 3),
+                                       mean_ms=round(stats['total_ms'] / stats['statements'], 3),
+                                       histogram=dict(stats['histogram']))
+            return {'since': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    'statements': sum(stats['statements'] for stats in self.callers.values()),
+                    'slow': self.slow, 'errors': self.errors, 'slow_query_ms': SLOW_QUERY_MS, 'callers': callers}
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.callers = {}
+            self.slow = 0
+            self.errors = 0
+
+
+metrics = QueryMetrics()
+
+
+def _caller():  # 'module.function' of the innermost frame outside SQLAlchemy, e.g. 'models.get_all_members'
+    return _outside(sys._getframe(2)) or _outside(_awaiting_frame()) or 'unknown'
+
+
+def _outside(frame):
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not module.startswith(_INTERNAL_MODULES):
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def _awaiting_frame():  # async_models.py: statements run on a greenlet, the awaiting coroutines are on its parent
+    greenlet = sys.modules.get('greenlet')
+    parent = greenlet.getcurrent().parent if greenlet else None
+    return parent.gr_frame if parent is not None else None
+
+
+def explain(dbapi_connection, statement, parameters):  # EXPLAIN QUERY PLAN rows as text, '' if it can't be explained
+    try:
+        cursor = dbapi_connection.cursor()  # a cursor works on sqlite3 and the aiosqlite adapter alike
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        plan = cursor.fetchall()
+        cursor.close()
+        return '\n'.join(f"  {row[-1]}" for row in plan)
+    except Exception as e:  # e.g. PRAGMA statements
+        return f"  (no plan: {e})"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info['query_started'].pop()) * 1000
+    # rowcount is known for writes; SQLite reports -1 for SELECTs because rows are only fetched later
+    _record(conn, _caller(), elapsed_ms, cursor.rowcount, statement, parameters, executemany)
+
+
+def _handle_error(exception_context):  # a failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    if conn is None or exception_context.statement is None or not conn.info.get('query_started'):
+        return  # failed before before_cursor_execute, e.g. while connecting
+    elapsed_ms = (time.perf_counter() - conn.info['query_started'].pop()) * 1000
+    _record(conn, _caller(), elapsed_ms, -1, exception_context.statement, exception_context.parameters,
+            exception_context.execution_context is not None and exception_context.execution_context.executemany,
+            error=exception_context.original_exception)
+
+
+def _record(conn, caller, elapsed_ms, rows, statement, parameters, executemany, error=None):
+    slow = elapsed_ms >= SLOW_QUERY_MS
+    metrics.record(caller, elapsed_ms, rows, slow, error is not None)
+    if slow:
+        plan = ''
+        if conn.dialect.name == 'sqlite' and not executemany:
+            plan = '\n' + explain(conn.connection.dbapi_connection, statement, parameters)
+        failed = f" failed: {error!r}" if error is not None else ''
+        slow_query_logger.warning(f"{elapsed_ms:.1f} ms in {caller}{failed}: {' '.join(statement.split())} "
+                                  f"{parameters!r}{plan}")
+
+
+def instrument(engine):  # adds the timing listeners once per engine
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+    return engine
+
+
+def format_snapshot(snapshot, limit=None):  # the snapshot as a text table, slowest functions (by total time) first
+    lines = [f"{snapshot['statements']} statements since {snapshot['since']}, "
+             f"{snapshot['slow']} slower than {snapshot['slow_query_ms']:g} ms, {snapshot['errors']} failed", '',
+             f"{'function':<44}{'count':>8}{'total ms':>12}{'mean ms':>10}{'max ms':>10}{'rows':>9}"]
+    for caller, stats in list(snapshot['callers'].items())[:limit]:
+        lines.append(f"{caller[:43]:<44}{stats['statements']:>8}{stats['total_ms']:>12.1f}{stats['mean_ms']:>10.2f}"
+                     f"{stats['max_ms']:>10.1f}{stats['rows']:>9}")
+        lines.append(' ' * 4 + '  '.join(f"{bucket} {count}" for bucket, count in
+                                         sorted(stats['histogram'].items(), key=lambda item: _bucket_order(item[0]))))
+    return '\n'.join(lines)
+
+
+def _bucket_order(bucket):
+    return float(bucket.strip('<=>ms')) + (0.5 if bucket.startswith('>') else 0)
+
+
+if __name__ == "__main__":
+    # runs the queries from migrations.CHECKED_QUERIES once against the database and prints what they cost
+    import models
+    import query_metrics  # the instance database.py instrumented the engine with, not this __main__ copy
+    from migrations import init_db, CHECKED_QUERIES
+
+    init_db()
+    query_metrics.metrics.reset()
+    for name, args in CHECKED_QUERIES:
+        try:
+            getattr(models, name)(*args)
+        except RuntimeError:
+            pass  # "not found" still ran the statement
+    snapshot = query_metrics.metrics.snapshot()
+    if sys.argv[1:] == ['--json']:
+        print(json.dumps(snapshot, indent=2))
+    else:
+        print(format_snapshot(snapshot))
@@ -0,0 +1,191 @@
+import os
+import json
+import logging
+import datetime
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Runs the daily jobs and the outbox drain for daily_tasks.py without polling: the scheduler works out when
+# the next job is due and sleeps until then. Jobs that are due together run at the same time on a thread
+# pool. The last run of every job is kept in STATE_FILE, so runs missed while the process was down are made
+# up for when it starts again: a daily job runs once for every missed day (at most CATCH_UP_DAYS), with that
+# day's date, so e.g. the reminders of each missed day still go out. LOCK_FILE holds a lock for as long as a
+# scheduler runs or a job is run by hand, so a second daemon refuses to start instead of sending everything
+# twice, and a manual run can't overlap the daemon.
+#
+#   python daily_tasks.py                     run the scheduler
+#   python daily_tasks.py status              last and next run of every job
+#   python daily_tasks.py run reminders       run one job now (and record it)
+
+STATE_FILE = os.environ.get('ORG_SCHEDULER_STATE', 'scheduler_state.json')
+LOCK_FILE = os.environ.get('ORG_SCHEDULER_LOCK', 'scheduler.lock')
+MAX_SLEEP_SECONDS = 300  # wake up at least this often, the sleep timer doesn't count time the machine was suspended
+CATCH_UP_DAYS = 7  # missed days a daily job is run for after a downtime, older ones are logged and skipped
+
+# at: daily at this datetime.time, run(day) does the work for that date; every: every this many seconds,
+# run() does the work (one of the two)
+ScheduledJob = namedtuple('ScheduledJob', ['name', 'run', 'at', 'every'], defaults=(None, None))
+
+
+class SchedulerLock:  # exclusive lock on a file, released by the OS if the process dies
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        self.file = open(self.path, 'a+')
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.file.seek(0)
+            owner = self.file.read().strip() or 'unknown'
+            self.file.close()
+            self.file = None
+            raise RuntimeError(f"Another scheduler is already running (pid {owner}, lock file '{self.path}')")
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(str(os.getpid()))
+        self.file.flush()
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()  # closing the file releases the lock
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Scheduler:
+    def __init__(self, jobs, state_file=None, lock_file=None):
+        self.jobs = {job.name: job for job in jobs}
+        for job in jobs:
+            if (job.at is None) == (job.every is None):
+                raise RuntimeError(f"Job '{job.name}' needs either a daily time (at) or an interval (every)")
+        self.state_file = state_file or STATE_FILE
+        self.lock = SchedulerLock(lock_file or LOCK_FILE)
+        self.state_lock = threading.Lock()
+        self.running = set()
+        self.wake = threading.Event()  # set when a job finishes or stop() is called
+        self.stopped = False
+        self.started = datetime.datetime.now()  # jobs that never ran are first due at their next time after this
+
+    """ State: {job name: {'last_run', 'ok', 'seconds', 'error'}} """
+    def load_state(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Scheduler state '{self.state_file}' could not be read, starting without it: {e}")
+            return {}
+
+    def record(self, name, started, ok, error=None):
+        with self.state_lock:
+            state = self.load_state()
+            state[name] = {'last_run': started.isoformat(), 'ok': ok,
+                           'seconds': round((datetime.datetime.now() - started).total_seconds(), 1), 'error': error}
+            partial_path = self.state_file + '.part'
+            with open(partial_path, 'w', encoding='utf-8') as file:
+                json.dump(state, file, indent=2)
+            os.replace(partial_path, self.state_file)  # a crash mid-write leaves the old state, not half a file
+
+    def last_run(self, name, state=None):
+        entry = (self.load_state() if state is None else state).get(name)
+        return datetime.datetime.fromisoformat(entry['last_run']) if entry else None
+
+    def next_due(self, name, now=None, state=None):
+        # when the job should run next; a time in the past means it is overdue and runs right away
+        job, now = self.jobs[name], now or datetime.datetime.now()
+        last = self.last_run(name, state)
+        if job.every is not None:
+            return now if last is None else last + datetime.timedelta(seconds=job.every)
+        after = last or self.started  # never run before: the next occurrence, nothing to catch up
+        due = datetime.datetime.combine(after.date(), job.at)
+        if due <= after:
+            due += datetime.timedelta(days=1)
+        return due
+
+    def due_days(self, name, now=None, state=None):
+        # the dates a daily job is due for, oldest first: one per occurrence missed since its last run
+        if self.jobs[name].every is not None:
+            return []
+        now = now or datetime.datetime.now()
+        due, days = self.next_due(name, now, state), []
+        while due <= now:
+            days.append(due.date())
+            due += datetime.timedelta(days=1)
+        if len(days) > CATCH_UP_DAYS:
+            logging.warning(f"Scheduled job '{name}' missed {len(days)} days, skipping {days[0]} to {days[-CATCH_UP_DAYS - 1]}")
+            days = days[-CATCH_UP_DAYS:]
+        return days
+
+    def status(self, now=None):  # [(name, last run, ok, next due)] for the GUI and `daily_tasks.py status`
+        now, state = now or datetime.datetime.now(), self.load_state()
+        return [(name, self.last_run(name, state), state.get(name, {}).get('ok'), max(self.next_due(name, now, state), now))
+                for name in self.jobs]
+
+    """ Running """
+    def trigger(self, name, day=None):  # runs a job now (a daily one for day, default today) and records it
+        if name not in self.jobs:
+            raise RuntimeError(f"Unknown job '{name}', use one of {', '.join(self.jobs)}")
+        with SchedulerLock(self.lock.path):  # not while the daemon runs, it may be running the same job
+            return self._execute(name, [day or datetime.date.today()])
+
+    def _execute(self, name, days):  # runs the job (a daily one once per day) and records it; returns the last result
+        job, started, failed, result = self.jobs[name], datetime.datetime.now(), [], None
+        for day in days if job.at is not None else [None]:
+            try:
+                result = job.run() if day is None else job.run(day)
+            except Exception as e:  # a failed day doesn't stop the days after it
+                logging.error(f"Scheduled job '{name}' failed{f' for {day}' if day else ''}: {e}", exc_info=True)
+                failed.append((day, e))
+        if failed:
+            error = '; '.join(f"{day}: {e}" if day else str(e) for day, e in failed)
+            self.record(name, started, False, error)
+            raise RuntimeError(f"Scheduled job '{name}' failed: {error}")
+        self.record(name, started, True)
+        return result
+
+    def _run(self, name, days):
+        try:
+            self._execute(name, days)
+        except Exception:
+            pass  # logged and recorded by _execute, the job runs again at its next time
+        finally:
+            with self.state_lock:
+                self.running.discard(name)
+            self.wake.set()
+
+    def run_forever(self, workers=None):
+        self.started = datetime.datetime.now()
+        with self.lock, ThreadPoolExecutor(max_workers=workers or len(self.jobs), thread_name_prefix='job') as pool:
+            logging.info(f"Scheduler started with {', '.join(self.jobs)}")
+            while not self.stopped:
+                self.wake.clear()  # before looking, so a job finishing from here on still cuts the sleep short
+                now, state = datetime.datetime.now(), self.load_state()
+                waiting = {name: self.next_due(name, now, state) for name in self.jobs if name not in self.running}
+                for name, due in waiting.items():
+                    if due <= now:  # a job still running from last time is not started a second time
+                        with self.state_lock:
+                            self.running.add(name)
+                        pool.submit(self._run, name, self.due_days(name, now, state))
+                upcoming = [due for due in waiting.values() if due > now]
+                sleep = min([(due - now).total_seconds() for due in upcoming] + [MAX_SLEEP_SECONDS])
+                self.wake.wait(max(sleep, 0))
+
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
@@ -1,15 +1,23 @@
 import sys
+import json
 import datetime
 import logging
 from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtWidgets import QMessageBox, QApplication, QFileDialog
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Event, get_all_events, get_event_by_name, get_event_by_date
-from models import Member, Demographics, get_all_members, get_member_by_names, get_member_by_email
-from models import married_members, children_query, uneducated_members, disabled_members, office_bearers
-from daily_tasks import send_reminders  # function for sending reminders
+from models import Event, count_events, get_event_by_name, get_event_by_date, search_events, find_event_id, EVENT_FIELDS
+from models import Member, Demographics, Marital_Status, EducationLevel, AttendanceLevel, Involvement, Yes_No, count_members, get_member_by_names, get_member_by_email, search_members, find_member_id
+from models import married_members, children_query, uneducated_members, disabled_members, office_bearers, demographic_stats, cache_stats
+from bulk_import import import_members  # streaming import of the member txt file
+from export import EXPORTS, export_query  # streaming export to CSV/JSONL/Parquet
+from bulk_operations import SETTABLE, preview_matching, bulk_update, bulk_delete
+from segments import FIELDS, OPERATORS, where, all_of
+from migrations import init_db
+from table_models import member_table_model, event_table_model
+from workers import TaskRunner
+from query_metrics import metrics, format_snapshot
+from orgs import load_registry, get_org, current_org, switch_org
 from sqlalchemy.exc import SQLAlchemyError
+from database import session  # shared engine, one session per thread
 
 
 # Configure logging
@@ -19,11 +27,20 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Database setup
-DATABASE_URL = "sqlite:///church.db"
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session = Session()
+
+class SearchBox(QtWidgets.QLineEdit):  # search-as-you-type: emits search_requested once typing pauses
+    search_requested = QtCore.pyqtSignal(str)
+
+    def __init__(self, placeholder, parent=None, delay_ms=200):
+        super().__init__(parent)
+        self.setPlaceholderText(placeholder)
+        self.setClearButtonEnabled(True)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay_ms)
+        self.timer.timeout.connect(lambda: self.search_requested.emit(self.text().strip()))
+        self.textChanged.connect(self.timer.start)  # restarts on every key press
+
 
 class MainWindow(QtWidgets.QMainWindow):
     def __init__(self):
@@ -31,7 +48,9 @@ class MainWindow(QtWidgets.QMainWindow):
         self.initUI()
 
     def initUI(self):
-        self.setWindowTitle('Church Management System')
+        self.organizations = load_registry()
+        self.organization = current_org(self.organizations)
+        self.setWindowTitle(self.window_title())
         self.setGeometry(100, 100, 1200, 800)
 
    
@@ -39,23 +58,73 @@ class MainWindow(QtWidgets.QMainWindow):
         self.stacked_widget = QtWidgets.QStackedWidget(self)
         self.setCentralWidget(self.stacked_widget)
         
-        # Initialize widgets for each screen
+        # Initialize the main screen, the others are built the first time they are opened
         self.main_widget = self.create_main_widget()
-        self.events_widget = EventsOperations(self)
-        self.member_operations_widget = MemberOperations(self)
-        self.query_operations_widget = QueryOperations(self)
+        self.screens = {}
         
         # Add widgets to the stacked widget
         self.stacked_widget.addWidget(self.main_widget)
-        self.stacked_widget.addWidget(self.events_widget)
-        self.stacked_widget.addWidget(self.member_operations_widget)
-        self.stacked_widget.addWidget(self.query_operations_widget)
+
+        # background work: queries and sending run on a thread pool, the status bar shows when it is busy
+        self.task_runner = TaskRunner(parent=self)
+        self.busy_bar = QtWidgets.QProgressBar(self)
+        self.busy_bar.setRange(0, 0)  # no known end, just keeps moving
+        self.busy_bar.setMaximumWidth(150)
+        self.cancel_button = QtWidgets.QPushButton('Cancel', self)
+        self.cancel_button.clicked.connect(self.task_runner.cancel_all)
+        self.statusBar().addPermanentWidget(self.busy_bar)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+        self.task_runner.busy_changed.connect(self.show_busy)
+        self.show_busy(False)
+
+    def get_screen(self, screen_class):  # builds the screen on first use and adds it to the stacked widget
+        if screen_class not in self.screens:
+            widget = screen_class(self)
+            self.stacked_widget.addWidget(widget)
+            self.screens[screen_class] = widget
+        return self.screens[screen_class]
+
+    @property
+    def events_widget(self):
+        return self.get_screen(EventsOperations)
+
+    @property
+    def member_operations_widget(self):
+        return self.get_screen(MemberOperations)
+
+    @property
+    def query_operations_widget(self):
+        return self.get_screen(QueryOperations)
+
+    def run_in_background(self, fn, *args, **kwargs):  # see TaskRunner.submit for the keyword arguments
+        return self.task_runner.submit(fn, *args, **kwargs)
+
+    def show_busy(self, busy):
+        self.busy_bar.setVisible(busy)
+        self.cancel_button.setVisible(busy)
+        if busy:
+            self.statusBar().showMessage('Working...')
+        else:
+            self.statusBar().clearMessage()
+
+    def window_title(self):
+        if len(self.organizations) > 1:
+            return f'Church Management System - {self.organization.name}'
+        return 'Church Management System'
 
     def create_main_widget(self):
         # Main widget with buttons for navigation
         widget = QtWidgets.QWidget()
         layout = QtWidgets.QVBoxLayout(widget)
 
+        if len(self.organizations) > 1:  # one database per congregation, see orgs.py
+            self.org_combo = QtWidgets.QComboBox(self)
+            for organization in self.organizations:
+                self.org_combo.addItem(organization.name, organization.key)
+            self.org_combo.setCurrentIndex(self.organizations.index(self.organization))
+            self.org_combo.activated.connect(self.switch_organization)
+            layout.addWidget(self.org_combo, alignment=QtCore.Qt.AlignCenter)
+
         self.events_button = QtWidgets.QPushButton('Events', self)
         self.events_button.clicked.connect(self.switch_to_events_operations)
         layout.addWidget(self.events_button, alignment=QtCore.Qt.AlignCenter)
@@ -71,9 +140,37 @@ class MainWindow(QtWidgets.QMainWindow):
         self.send_reminders_button = QtWidgets.QPushButton('Send Reminders', self)
         self.send_reminders_button.clicked.connect(self.send_reminders)
         layout.addWidget(self.send_reminders_button, alignment=QtCore.Qt.AlignCenter)
+
+        self.query_metrics_button = QtWidgets.QPushButton('Query Metrics', self)
+        self.query_metrics_button.clicked.connect(self.show_query_metrics)
+        layout.addWidget(self.query_metrics_button, alignment=QtCore.Qt.AlignCenter)
         
         return widget
 
+    def switch_organization(self, index):
+        organization = self.organizations[index]
+        if organization == self.organization:
+            return
+        if self.task_runner.is_busy():  # running tasks would finish against the other organization's screens
+            QMessageBox.warning(self, 'Busy', 'Wait for the running tasks to finish before switching organizations.')
+            self.org_combo.setCurrentIndex(self.organizations.index(self.organization))
+            return
+        try:
+            switch_org(organization)
+            init_db()  # a new organization's database is created on first use
+        except Exception as e:
+            logging.error(f"Failed to open {organization.name}: {e}", exc_info=True)
+            QMessageBox.warning(self, 'Error', f'Failed to open {organization.name}: {e}')
+            switch_org(self.organization)
+            self.org_combo.setCurrentIndex(self.organizations.index(self.organization))
+            return
+        self.organization = organization
+        for widget in self.screens.values():  # the screens show the old organization's data, they are rebuilt when opened
+            self.stacked_widget.removeWidget(widget)
+            widget.deleteLater()
+        self.screens = {}
+        self.setWindowTitle(self.window_title())
+
     def switch_to_events_operations(self):
         self.stacked_widget.setCurrentWidget(self.events_widget)
     
@@ -83,18 +180,217 @@ class MainWindow(QtWidgets.QMainWindow):
     def switch_to_queries(self):
         self.stacked_widget.setCurrentWidget(self.query_operations_widget)
 
-    def send_reminders(self):
-        try:
-            send_reminders()
-            QMessageBox.information(self, 'Success', 'Reminders have been sent.')
-        except Exception as e:
-            logging.error(f'Failed to send reminders: {e}', exc_info=True)
-            QMessageBox.warning(self, 'Error', f'Failed to send reminders: {e}')
+    def send_reminders(self):  # shows what the reminders job would send, then sends it now if confirmed
+        def preview():
+            import daily_tasks
+            next_run = {name: next_due for name, _, _, next_due in daily_tasks.get_scheduler().status()}['reminders']
+            return daily_tasks.preview_job('reminders'), next_run
+
+        def confirm(result):
+            plan, next_run = result
+            if not plan['new']:
+                self.send_reminders_button.setEnabled(True)
+                QMessageBox.information(self, 'Send Reminders', f"Nothing to send: {plan['events']} events in the reminder window, "
+                                        f"{plan['messages'] - plan['new']} reminders already queued.\n"
+                                        f"The next scheduled run is at {next_run:%Y-%m-%d %H:%M}.")
+                return
+            saved = ''
+            if plan['duplicates'] or plan['invalid']:
+                saved = (f"\n{plan['duplicates']} members share a number with another member and {plan['invalid']} numbers "
+                         f"are not valid, those are not sent to.")
+            answer = QMessageBox.question(self, 'Send Reminders', f"{plan['new']} reminders for {plan['events']} events will be sent now "
+                                          f"(the next scheduled run is at {next_run:%Y-%m-%d %H:%M}).{saved}\nSend them?")
+            if answer != QMessageBox.Yes:
+                self.send_reminders_button.setEnabled(True)
+                return
+            task = self.run_in_background(queue_and_send, on_result=done,
+                                          on_error=lambda e: QMessageBox.warning(self, 'Error', f'Failed to send reminders: {e}'))
+            task.signals.done.connect(lambda: self.send_reminders_button.setEnabled(True))
+
+        def queue_and_send():
+            import daily_tasks  # loads Twilio, so only when reminders are actually sent
+            queued = daily_tasks.send_reminders()   # queues the reminders in the outbox
+            return (queued,) + daily_tasks.drain_outbox()   # and sends whatever is due right away
+
+        def done(result):
+            queued, sent, retried, dead = result
+            message = f'{queued} reminders queued, {sent} messages sent.'
+            if retried or dead:
+                message += f'\n{retried} will be retried later, {dead} could not be delivered.'
+            QMessageBox.information(self, 'Success', message)
+
+        def failed(e):
+            self.send_reminders_button.setEnabled(True)
+            QMessageBox.warning(self, 'Error', f'Failed to preview reminders: {e}')
+
+        self.send_reminders_button.setEnabled(False)  # one broadcast at a time
+        self.run_in_background(preview, on_result=confirm, on_error=failed)
+
+    def show_query_metrics(self):  # what the database has cost this session, per function, and the cache hit rates
+        cache_lines = [f"{name} cache: {stats['hits']} hits, {stats['misses']} misses, {stats['size']} cached"
+                       for name, stats in cache_stats().items()]
+        dialog = QtWidgets.QDialog(self)
+        dialog.setWindowTitle('Query Metrics')
+        dialog.resize(900, 600)
+        layout = QtWidgets.QVBoxLayout(dialog)
+        text = QtWidgets.QPlainTextEdit(dialog)
+        text.setReadOnly(True)
+        text.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        text.setStyleSheet("font-family: monospace;")  # the table is aligned with spaces
+        text.setPlainText(format_snapshot(metrics.snapshot()) + '\n\n' + '\n'.join(cache_lines))
+        layout.addWidget(text)
+        buttons = QtWidgets.QHBoxLayout()
+        save_button = QtWidgets.QPushButton('Save as JSON', dialog)
+        save_button.clicked.connect(lambda: self.save_query_metrics(dialog))
+        reset_button = QtWidgets.QPushButton('Reset', dialog)
+        reset_button.clicked.connect(lambda: (metrics.reset(), text.setPlainText(format_snapshot(metrics.snapshot()))))
+        buttons.addWidget(save_button)
+        buttons.addWidget(reset_button)
+        layout.addLayout(buttons)
+        dialog.exec_()
+
+    def save_query_metrics(self, parent):
+        file_path, _ = QFileDialog.getSaveFileName(parent, 'Save Query Metrics', 'query_metrics.json', 'JSON Files (*.json)')
+        if file_path:
+            try:
+                with open(file_path, 'w') as file:
+                    json.dump({'queries': metrics.snapshot(), 'caches': cache_stats()}, file, indent=2)
+            except OSError as e:
+                QMessageBox.warning(parent, 'Error', f'Failed to save query metrics: {e}')
 
     def go_back(self):
         self.stacked_widget.setCurrentWidget(self.main_widget)
 
 
+class BulkOperationDialog(QtWidgets.QDialog):
+    # pick members or events by conditions, preview how many and which, then change or delete them all at once
+    # (see bulk_operations.py); Apply only works on a preview, and fails if the count has changed since
+    def __init__(self, main_window, target):
+        super().__init__(main_window)
+        self.main_window = main_window
+        self.target = target
+        self.fields = FIELDS if target == 'members' else EVENT_FIELDS
+        self.conditions = []
+        self.previewed = None  # (criteria, count) shown to the user
+        self.setWindowTitle(f'Bulk Update/Delete {target.title()}')
+        self.resize(900, 600)
+        layout = QtWidgets.QVBoxLayout(self)
+
+        layout.addWidget(QtWidgets.QLabel(f'{target.title()} matching all of these conditions:', self))
+        self.conditions_layout = QtWidgets.QVBoxLayout()
+        layout.addLayout(self.conditions_layout)
+        self.add_condition_button = QtWidgets.QPushButton('Add Condition', self)
+        self.add_condition_button.clicked.connect(self.add_condition)
+        layout.addWidget(self.add_condition_button, alignment=QtCore.Qt.AlignLeft)
+
+        action_layout = QtWidgets.QHBoxLayout()
+        self.action_combo = QtWidgets.QComboBox(self)
+        self.action_combo.addItems(['Set', 'Delete'])
+        self.set_field_combo = QtWidgets.QComboBox(self)
+        self.set_field_combo.addItems(list(SETTABLE[target]))
+        self.set_value_edit = QtWidgets.QLineEdit(self)
+        self.set_value_edit.setPlaceholderText('new value')
+        self.action_combo.currentTextChanged.connect(self.action_changed)
+        action_layout.addWidget(self.action_combo)
+        action_layout.addWidget(self.set_field_combo)
+        action_layout.addWidget(self.set_value_edit)
+        layout.addLayout(action_layout)
+
+        self.preview_text = QtWidgets.QPlainTextEdit(self)
+        self.preview_text.setReadOnly(True)
+        self.preview_text.setLineWrapMode(QtWidgets.QPlainTextEdit.NoWrap)
+        layout.addWidget(self.preview_text)
+
+        buttons = QtWidgets.QHBoxLayout()
+        self.preview_button = QtWidgets.QPushButton('Preview', self)
+        self.preview_button.clicked.connect(self.preview)
+        self.apply_button = QtWidgets.QPushButton('Apply', self)
+        self.apply_button.clicked.connect(self.apply)
+        self.apply_button.setEnabled(False)
+        close_button = QtWidgets.QPushButton('Close', self)
+        close_button.clicked.connect(self.reject)
+        buttons.addWidget(self.preview_button)
+        buttons.addWidget(self.apply_button)
+        buttons.addWidget(close_button)
+        layout.addLayout(buttons)
+        self.add_condition()
+
+    def add_condition(self):
+        row = QtWidgets.QHBoxLayout()
+        field_combo = QtWidgets.QComboBox(self)
+        field_combo.addItems(list(self.fields))
+        op_combo = QtWidgets.QComboBox(self)
+        op_combo.addItems(OPERATORS)
+        value_edit = QtWidgets.QLineEdit(self)
+        value_edit.setPlaceholderText('value (a, b, c for in / not_in)')
+        for widget in (field_combo, op_combo, value_edit):
+            row.addWidget(widget)
+        field_combo.currentTextChanged.connect(self.criteria_changed)
+        op_combo.currentTextChanged.connect(self.criteria_changed)
+        value_edit.textChanged.connect(self.criteria_changed)
+        self.conditions_layout.addLayout(row)
+        self.conditions.append((field_combo, op_combo, value_edit))
+        self.criteria_changed()
+
+    def criteria(self):
+        parts = []
+        for field_combo, op_combo, value_edit in self.conditions:
+            op, text = op_combo.currentText(), value_edit.text().strip()
+            if op in ('in', 'not_in'):
+                value = [item.strip() for item in text.split(',') if item.strip()]
+            elif op in ('is_null', 'not_null'):
+                value = None
+            else:
+                value = text
+            parts.append(where(field_combo.currentText(), op, value))
+        return all_of(*parts)
+
+    def criteria_changed(self):  # the preview no longer matches what would be changed
+        self.previewed = None
+        self.apply_button.setEnabled(False)
+
+    def action_changed(self, action):
+        self.set_field_combo.setEnabled(action == 'Set')
+        self.set_value_edit.setEnabled(action == 'Set')
+
+    def preview(self):
+        criteria = self.criteria()
+
+        def show(result):
+            rows, count = result
+            self.previewed = (criteria, count)
+            self.apply_button.setEnabled(count > 0)
+            lines = [f"{count} {self.target} match" + (f", the first {len(rows)}:" if count > len(rows) else ':'), '']
+            lines += ['\t'.join('' if value is None else str(getattr(value, 'value', value)) for value in row) for row in rows]
+            self.preview_text.setPlainText('\n'.join(lines))
+
+        self.main_window.run_in_background(preview_matching, self.target, criteria, on_result=show,
+                                           on_error=lambda e: self.preview_text.setPlainText(f"An error occurred: {e}"))
+
+    def apply(self):
+        criteria, count = self.previewed
+        if self.action_combo.currentText() == 'Delete':
+            question = f"Delete {count} {self.target}? This can't be undone."
+            fn, args = bulk_delete, (self.target, criteria)
+        else:
+            field, value = self.set_field_combo.currentText(), self.set_value_edit.text().strip() or None
+            question = f"Set {field} to '{value or ''}' for {count} {self.target}?"
+            fn, args = bulk_update, (self.target, criteria, {field: value})
+        if QMessageBox.question(self, 'Confirm', question, QMessageBox.Yes | QMessageBox.No, QMessageBox.No) != QMessageBox.Yes:
+            return
+
+        def done(changed):
+            self.criteria_changed()  # preview again before another change
+            self.preview_text.setPlainText(f"{changed} {self.target} changed.")
+
+        def failed(e):
+            logging.error(f'Bulk change of {self.target} failed: {e}')
+            QMessageBox.warning(self, 'Error', f'{e}')
+
+        self.apply_button.setEnabled(False)
+        self.main_window.run_in_background(fn, *args, expected=count, on_result=done, on_error=failed)
+
+
 class EventsOperations(QtWidgets.QWidget):
     def __init__(self, main_window):
         super().__init__()
@@ -112,12 +408,28 @@ class EventsOperations(QtWidgets.QWidget):
         self.event_count_label.setStyleSheet("font-size: 16px;")  # no need to make it stand out
         self.event_count_label.setStyleSheet("background-color: white;")  # Set background to white NOT WORKING, ADJUST .qss file
         self.layout.addWidget(self.event_count_label, alignment=QtCore.Qt.AlignCenter)
+
+        self.event_search_box = SearchBox('Search events by name, location or description...', self)
+        self.event_search_box.search_requested.connect(self.quick_search)
+        self.layout.addWidget(self.event_search_box)
         
         self.event_details_text_edit = QtWidgets.QTextEdit(self)
         self.event_details_text_edit.setReadOnly(True)
         self.event_details_text_edit.setStyleSheet("background-color: white;")  # Set background to white NOT WORKING, ADJUST .qss file
         self.event_details_text_edit.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
-        self.layout.addWidget(self.event_details_text_edit, alignment=QtCore.Qt.AlignCenter)
+
+        # table for listings, rows are loaded page by page as the user scrolls
+        self.event_table_view = QtWidgets.QTableView(self)
+        self.event_table_view.setSortingEnabled(True)  # sorting is done by the database, see table_models
+        self.event_table_view.setStyleSheet("background-color: white;")
+
+        # the text area is brought back as soon as any other search writes to it
+        self.event_results_stack = QtWidgets.QStackedWidget(self)
+        self.event_results_stack.addWidget(self.event_details_text_edit)
+        self.event_results_stack.addWidget(self.event_table_view)
+        self.event_details_text_edit.textChanged.connect(
+            lambda: self.event_results_stack.setCurrentWidget(self.event_details_text_edit))
+        self.layout.addWidget(self.event_results_stack)
 
         """ event search operations """
         # label 1
@@ -173,6 +485,11 @@ class EventsOperations(QtWidgets.QWidget):
         self.edit_e_button.clicked.connect(self.edit_event)
         button_layout2.addWidget(self.edit_e_button)
 
+        self.bulk_e_button = QtWidgets.QPushButton('Bulk Update/Delete', self)
+        self.bulk_e_button.setMinimumWidth(150)  # Ensure the button is wide enough
+        self.bulk_e_button.clicked.connect(lambda: BulkOperationDialog(self.main_window, 'events').exec_())
+        button_layout2.addWidget(self.bulk_e_button)
+
 
         self.layout.addLayout(button_layout2)          
 
@@ -186,60 +503,60 @@ class EventsOperations(QtWidgets.QWidget):
     """ functions """
 
     def show_all_events(self):
-        try:
-            events, count = get_all_events()  # the function returns two things: member list and count
+        def show(count):
             self.event_count_label.setText(f"Total number of events: {count}")
-            event_details = "Name\tDate\tDescription\n"  # member details string with headings
-            event_details += "-" * 80 + "\n"  # a separator line
-
-            for event in events:
-                event_details += (
-                f"{event.name}\t"
-                f"{event.event_date}\t"
-                f"{event.description}\n"  # adds spacing between members
-                )
-            self.event_details_text_edit.setPlainText(event_details)  # Update the text area with members' details
-        except RuntimeError as e:
-            QtWidgets.QMessageBox.critical(self, 'Error', str(e))
+            self.event_table_view.setModel(event_table_model(self))  # fetches the first page, the rest follows on scroll
+            self.event_results_stack.setCurrentWidget(self.event_table_view)
+
+        self.main_window.run_in_background(count_events, on_result=show,
+                                           on_error=lambda e: QtWidgets.QMessageBox.critical(self, 'Error', e))
+
+    def show_event(self, event):
+        if event:
+            details = (
+                f"Name: {event.name}\n"
+                f"Date: {event.event_date}\n"
+                f"Starting Time: {event.start_time}\n"
+                f"Finishing Time: {event.end_time}\n"
+                f"Location: {event.location}\n"
+                f"Description: {event.description}"
+            )
+            self.event_details_text_edit.setPlainText(details)  # display event details on the text box
+        else:
+            self.event_details_text_edit.setPlainText("Event not found")
+
+    def show_error(self, error):
+        self.event_details_text_edit.setPlainText(f"An error occurred: {error}")
+
+    def quick_search(self, search_text):
+        if search_text:
+            self.main_window.run_in_background(search_events, search_text, on_error=self.show_error,
+                                               on_result=lambda rows: self.show_search_results(search_text, rows))
+
+    def show_search_results(self, search_text, rows):
+        if search_text != self.event_search_box.text().strip():
+            return  # the user has kept typing, a newer search is on its way
+        self.event_count_label.setText(f"Matching events: {len(rows)}")
+        event_details = "Name\tDate\tLocation\tDescription\n"  # event details string with headings
+        event_details += "-" * 80 + "\n"  # a separator line
+        for event_id, name, event_date, location, description in rows:
+            event_details += f"{name}\t{event_date}\t{location}\t{description or ''}\n"
+        self.event_details_text_edit.setPlainText(event_details)
 
     def search_e_by_name(self):
-        try:
-            name, _ = QtWidgets.QInputDialog.getText(self, 'Search for Event', 'Event name:')
-            event = get_event_by_name(name)  # returns the object instance found on the db
-            if event:
-                details = (
-                    f"Name: {event.name}\n"
-                    f"Date: {event.event_date}\n"
-                    f"Starting Time: {event.start_time}\n"
-                    f"Finishing Time: {event.end_time}\n"
-                    f"Location: {event.location}\n"
-                    f"Description: {event.description}"
-                )
-                self.event_details_text_edit.setPlainText(details)  # display event details on the text box
-            else:
-                self.event_details_text_edit.setPlainText("Event not found")
-        except Exception as e:
-            self.event_details_text_edit.setPlainText(f"An error occurred: {e}")
+        name, ok = QtWidgets.QInputDialog.getText(self, 'Search for Event', 'Event name:')
+        if ok:
+            self.main_window.run_in_background(get_event_by_name, name, on_result=self.show_event, on_error=self.show_error)
 
     def search_e_by_date(self):
         try:
-            event_date_str, _ = QtWidgets.QInputDialog.getText(self, 'Event Search', 'Date of Event (YYYY-MM-DD):')
-            event_date = datetime.datetime.strptime(event_date_str, '%Y-%m-%d').date()            
-            event = get_event_by_date(event_date)  # returns the object instance found on the db
-            if event:
-                details = (
-                    f"Name: {event.name}\n"
-                    f"Date: {event.event_date}\n"
-                    f"Starting Time: {event.start_time}\n"
-                    f"Finishing Time: {event.end_time}\n"
-                    f"Location: {event.location}\n"
-                    f"Description: {event.description}"
-                )
-                self.event_details_text_edit.setPlainText(details)  # display event details on the text box
-            else:
-                self.event_details_text_edit.setPlainText("Event not found")
+            event_date_str, ok = QtWidgets.QInputDialog.getText(self, 'Event Search', 'Date of Event (YYYY-MM-DD):')
+            if not ok:
+                return
+            event_date = datetime.datetime.strptime(event_date_str, '%Y-%m-%d').date()
+            self.main_window.run_in_background(get_event_by_date, event_date, on_result=self.show_event, on_error=self.show_error)
         except Exception as e:
-            self.event_details_text_edit.setPlainText(f"An error occurred: {e}")
+            self.show_error(e)
 
     def add_event(self):
             while True:  # loop to allow retrying if needed
@@ -286,10 +603,8 @@ class EventsOperations(QtWidgets.QWidget):
             doe_str, _ = QtWidgets.QInputDialog.getText(self, 'Remove Event', 'Date of Event (YYYY-MM-DD):')
             event_date = datetime.datetime.strptime(doe_str, '%Y-%m-%d').date()
 
-            event = session.query(Event).filter_by(
-                name=name,
-                event_date=event_date
-            ).first()
+            event_id = find_event_id(name, event_date)  # cached, the row itself comes from this thread's session
+            event = session.get(Event, event_id) if event_id is not None else None
 
             if event:
                 # Show event details for confirmation
@@ -321,10 +636,8 @@ class EventsOperations(QtWidgets.QWidget):
             doe_str, _ = QtWidgets.QInputDialog.getText(self, 'Edit Event', 'Date of Event (YYYY-MM-DD):')
             event_date = datetime.datetime.strptime(doe_str, '%Y-%m-%d').date()
 
-            event = session.query(Event).filter_by(
-                name=name,
-                event_date=event_date
-            ).first()
+            event_id = find_event_id(name, event_date)  # cached, the row itself comes from this thread's session
+            event = session.get(Event, event_id) if event_id is not None else None
 
             if event:
                 # Show event details for confirmation
@@ -400,6 +713,10 @@ class MemberOperations(QtWidgets.QWidget):
         self.edit_member_button.clicked.connect(self.edit_member)
         layout.addWidget(self.edit_member_button, alignment=QtCore.Qt.AlignCenter)
 
+        self.bulk_member_button = QtWidgets.QPushButton('Bulk Update/Delete', self)
+        self.bulk_member_button.clicked.connect(lambda: BulkOperationDialog(self.main_window, 'members').exec_())
+        layout.addWidget(self.bulk_member_button, alignment=QtCore.Qt.AlignCenter)
+
         self.back_button = QtWidgets.QPushButton('Back', self)
         self.back_button.clicked.connect(self.go_back)
         layout.addWidget(self.back_button, alignment=QtCore.Qt.AlignCenter)
@@ -419,73 +736,21 @@ class MemberOperations(QtWidgets.QWidget):
                     else:
                         return None                # If the dialog is canceled, return None or handle accordingly
 
-    def add_member(self):  # adjust read_members_from_txt and add_members_to_db to fit how the Google Form is expected
+    def add_member(self):  # adjust bulk_import.COLUMNS to fit how the Google Form is expected
         while True:                                                                 # Loop to allow retrying if needed
             try:
                 kind_of_adding, _ =  QtWidgets.QInputDialog.getItem(self, 'Adding Members', 'How would you like to add members', ['Upload a txt File', 'Input Details'])
                 if kind_of_adding == 'Upload a txt File':
                     try:
-                        def read_members_from_txt(file_path):   # adjust len: depends on the txt doc
-                            members = []
-                            try:
-                                with open(file_path, 'r') as file:
-                                    lines = file.readlines()
-                                    # Skip the header
-                                    for line in lines[1:]:
-                                        parts = line.strip().split('|')   # choose the appropriate limmiter ',' or '|'
-                                        if len(parts) == 11:   # number of columns
-                                            first_name, last_name, email, phone_number, marital_status, children, family_at_home, occupation, education_level, involvement, disabilities = parts
-                                            try:
-                                                members.append((first_name, last_name, email, phone_number, marital_status, children, family_at_home, occupation, education_level, involvement, disabilities))  # Allocate specific columns to members table
-                                            except ValueError:
-                                                # Handle conversion errors (e.g., age is not an integer)
-                                                QMessageBox.information(f"Skipping invalid line: {line.strip()}")
-                            except IOError as e:
-                                QMessageBox.information(f"Error reading file: {e}")
-                            return members  # allocate specific columns to members table
-
-                        def add_members_to_db(members):  # adjust new_member and new_demographics columns: depends on members.append in read_members_from_txt  
-                            try:
-                                for first_name, last_name, email, phone_number, marital_status, children, family_at_home, occupation, education_level, involvement, disabilities in members:
-                                    with session.begin():  # Begin a transaction
-                                        new_member = Member(first_name=first_name, last_name=last_name, email=email, phone_number=phone_number)     
-                                        session.add(new_member)
-                                        # Commit here to get the new_member.id
-                                        # This ensures that new_member.id is available for the next step
-                                        session.flush()
-                                        
-                                        new_demographics = Demographics(member_id=new_member.id, marital_status=marital_status, children=children, family_at_home=family_at_home, occupation=occupation, education_level=education_level, involvement=involvement, disabilities=disabilities)
-                                        session.add(new_demographics)
-                                        
-                                        # Commit the transaction, making sure both member and demographics are saved
-                                        session.commit()
-                            except SQLAlchemyError as e:
-                                # Handle database errors
-                                session.rollback()  # Rollback in case of error
-                                print(f"Database error: {e}")
-                            except Exception as e:
-                                # Catch all other exceptions
-                                session.rollback()  # Rollback in case of error
-                                print(f"Unexpected error: {e}")
-
-                        def load_file(self):
-                            file_path, _ = QFileDialog.getOpenFileName(self, "Open File", "", "Text Files (*.txt)")
-                            if file_path:
-                                try:
-                                    members = read_members_from_txt(file_path)
-                                    if not members:
-                                        QMessageBox.information('No valid data found in the file.')
-                                        return
-                                    add_members_to_db(members)
-                                    QMessageBox.information('Members imported successfully.')
-                                except Exception as e:
-                                    QMessageBox.information(self,'An error occurred during import.')
-                                    QMessageBox.information(f"Error during import: {e}")
-                        
-                        load_file()
+                        file_path, _ = QFileDialog.getOpenFileName(self, "Open File", "", "Text Files (*.txt)")
+                        if file_path:
+                            self.import_file(file_path)
+                        return
 
                     except Exception as e:
-                        QMessageBox.information(self,'An error occurred during adding file.')
+                        logging.error(f'Failed to import members: {e}', exc_info=True)
+                        QMessageBox.warning(self, 'Error', f'An error occurred during import: {e}')
+                        return
 
                 if kind_of_adding == 'Input Details':
                     try:
@@ -528,27 +793,27 @@ class MemberOperations(QtWidgets.QWidget):
                                 return
                             continue
 
-                        marital_status, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Marital Status:', ['Married', 'Never Married', 'Divorced', 'Widowed'])
+                        marital_status, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Marital Status:', [item.value for item in Marital_Status])
                         children = self.get_valid_integer('How many children do you have:')  # calls the get_valid_integer func passing the phrase
                         family_at_home = self.get_valid_integer('Number of people at home:')
                         occupation, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Occupation:')
-                        education_level, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Education Level:', ['Before Matric', 'Passed Matric', 'College', 'Bachelors Degree', 'Post Grad'])
-                        attendance, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Attendance:', ['Bi-Weekly', 'Weekly', 'Monthly', 'Rarely'])
-                        involvement, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Involvement:', ['Congregant', 'Server', 'Officer'])
-                        disabilities, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Disabilities:', ['Yes', 'No'])
+                        education_level, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Education Level:', [item.value for item in EducationLevel])
+                        attendance, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Attendance:', [item.value for item in AttendanceLevel])
+                        involvement, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Involvement:', [item.value for item in Involvement])
+                        disabilities, _ = QtWidgets.QInputDialog.getItem(self, 'Member Details', 'Disabilities:', [item.value for item in Yes_No])
 
                         session.add(member)
                         session.commit()   # commit here so we can have member ID to link in demogs
 
                         demogs = Demographics(
-                            marital_status=marital_status,
+                            marital_status=Marital_Status(marital_status),  # the enum member, so the name is stored like everywhere else
                             children=children,
                             family_at_home=family_at_home,
                             occupation=occupation,
-                            education_level=education_level,
-                            attendance=attendance,
-                            involvement=involvement,
-                            disabilities=disabilities,
+                            education_level=EducationLevel(education_level),
+                            attendance=AttendanceLevel(attendance),
+                            involvement=Involvement(involvement),
+                            disabilities=Yes_No(disabilities),
                             member_id=member.id   # Link demographics to the newly created member
                         )
             
@@ -564,6 +829,26 @@ class MemberOperations(QtWidgets.QWidget):
             except Exception as e:
                 QMessageBox.information(self,'An error occurred during adding member(s).')
 
+    def import_file(self, file_path):  # runs in the background, cancelling keeps the chunks already committed
+        def run_import(task):
+            return import_members(file_path, progress=lambda imported, rejected: task.report((imported, rejected)))
+
+        def report(counts):
+            self.main_window.statusBar().showMessage(f'Imported {counts[0]} members ({counts[1]} rejected)...')
+
+        def done(result):
+            imported, rejects = result
+            summary = f'{imported} members imported successfully.'
+            if rejects:
+                for line_no, line, reason in rejects:
+                    logging.error(f'Skipping invalid line {line_no} ({reason}): {line}')
+                details = "\n".join(f"Line {line_no}: {reason}" for line_no, line, reason in rejects[:20])
+                summary += f'\n\n{len(rejects)} lines were skipped (see church_management.log):\n{details}'
+            QMessageBox.information(self, 'Import Complete', summary)
+
+        self.main_window.run_in_background(run_import, pass_task=True, on_result=done, on_progress=report,
+                                           on_error=lambda e: QMessageBox.warning(self, 'Error', f'An error occurred during import: {e}'))
+
     def remove_member(self):
         try:
             first_name, _ = QtWidgets.QInputDialog.getText(self, 'Remove Member', 'First Name:')
@@ -571,11 +856,8 @@ class MemberOperations(QtWidgets.QWidget):
             dob_str, _ = QtWidgets.QInputDialog.getText(self, 'Remove Member', 'Date of Birth (YYYY-MM-DD):')
             date_of_birth = datetime.datetime.strptime(dob_str, '%Y-%m-%d').date()
 
-            member = session.query(Member).filter_by(
-                first_name=first_name,
-                last_name=last_name,
-                date_of_birth=date_of_birth
-            ).first()
+            member_id = find_member_id(first_name, last_name, date_of_birth)  # cached, the row itself comes from this thread's session
+            member = session.get(Member, member_id) if member_id is not None else None
 
             if member:
                 # Show member details for confirmation
@@ -611,11 +893,8 @@ class MemberOperations(QtWidgets.QWidget):
             dob_str, _ = QtWidgets.QInputDialog.getText(self, 'Edit Member', 'Date of Birth (YYYY-MM-DD):')
             date_of_birth = datetime.datetime.strptime(dob_str, '%Y-%m-%d').date()
 
-            member = session.query(Member).filter_by(
-                first_name=first_name,
-                last_name=last_name,
-                date_of_birth=date_of_birth
-            ).first()
+            member_id = find_member_id(first_name, last_name, date_of_birth)  # cached, the row itself comes from this thread's session
+            member = session.get(Member, member_id) if member_id is not None else None
 
             if member:
                 # Show member details for confirmation
@@ -690,12 +969,28 @@ class QueryOperations(QtWidgets.QWidget):
         self.member_count_label.setStyleSheet("font-size: 16px;")  # no need to make it stand out
         self.member_count_label.setStyleSheet("background-color: white;")  # Set background to white NOT WORKING, ADJUST .qss file
         self.layout.addWidget(self.member_count_label, alignment=QtCore.Qt.AlignCenter)
+
+        self.member_search_box = SearchBox('Search members by name, email, address or phone...', self)
+        self.member_search_box.search_requested.connect(self.quick_search)
+        self.layout.addWidget(self.member_search_box)
         
         self.member_details_text_edit = QtWidgets.QTextEdit(self)
         self.member_details_text_edit.setReadOnly(True)
         self.member_details_text_edit.setStyleSheet("background-color: white;")  # Set background to white NOT WORKING, ADJUST .qss file
         self.member_details_text_edit.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
-        self.layout.addWidget(self.member_details_text_edit, alignment=QtCore.Qt.AlignCenter)
+
+        # table for listings, rows are loaded page by page as the user scrolls
+        self.member_table_view = QtWidgets.QTableView(self)
+        self.member_table_view.setSortingEnabled(True)  # sorting is done by the database, see table_models
+        self.member_table_view.setStyleSheet("background-color: white;")
+
+        # the text area is brought back as soon as any other search writes to it
+        self.member_results_stack = QtWidgets.QStackedWidget(self)
+        self.member_results_stack.addWidget(self.member_details_text_edit)
+        self.member_results_stack.addWidget(self.member_table_view)
+        self.member_details_text_edit.textChanged.connect(
+            lambda: self.member_results_stack.setCurrentWidget(self.member_details_text_edit))
+        self.layout.addWidget(self.member_results_stack)
 
         """ member search operations """
         # label 1
@@ -760,6 +1055,16 @@ class QueryOperations(QtWidgets.QWidget):
         self.search_officers_button.clicked.connect(self.officers_servers)
         button_layout2.addWidget(self.search_officers_button)
 
+        self.stats_summary_button = QtWidgets.QPushButton('Stats Summary', self)
+        self.stats_summary_button.setMinimumWidth(150)  # Ensure the button is wide enough
+        self.stats_summary_button.clicked.connect(self.stats_summary)
+        button_layout2.addWidget(self.stats_summary_button)
+
+        self.export_button = QtWidgets.QPushButton('Export', self)
+        self.export_button.setMinimumWidth(150)  # Ensure the button is wide enough
+        self.export_button.clicked.connect(self.export_results)
+        button_layout2.addWidget(self.export_button)
+
         self.layout.addLayout(button_layout2)          
 
         self.back_button = QtWidgets.QPushButton('Back', self)          
@@ -774,151 +1079,200 @@ class QueryOperations(QtWidgets.QWidget):
         self.member_details_text_edit.clear()  # Clear the text edit area
         self.main_window.go_back()
 
+    def export_results(self):  # writes a whole query result to a file in the background, see export.py
+        name, ok = QtWidgets.QInputDialog.getItem(self, 'Export', 'What to export:', list(EXPORTS), 0, False)
+        if not ok:
+            return
+        params = {}
+        if name == 'events_between':
+            try:
+                start, ok = QtWidgets.QInputDialog.getText(self, 'Export', 'From (YYYY-MM-DD):')
+                if not ok:
+                    return
+                end, ok = QtWidgets.QInputDialog.getText(self, 'Export', 'To (YYYY-MM-DD):')
+                if not ok:
+                    return
+                params = {'start': datetime.date.fromisoformat(start), 'end': datetime.date.fromisoformat(end)}
+            except ValueError:
+                QMessageBox.warning(self, 'Error', 'Dates must be in the format YYYY-MM-DD.')
+                return
+        file_path, _ = QFileDialog.getSaveFileName(self, 'Export', f'{name}.csv',
+                                                   'CSV Files (*.csv);;JSON Lines (*.jsonl);;Parquet Files (*.parquet)')
+        if not file_path:
+            return
+
+        def run_export(task):
+            return export_query(name, file_path, progress=task.report, **params)
+
+        self.main_window.run_in_background(
+            run_export, pass_task=True,
+            on_progress=lambda rows: self.main_window.statusBar().showMessage(f'Exported {rows} rows...'),
+            on_result=lambda rows: QMessageBox.information(self, 'Export Complete', f'{rows} rows written to {file_path}'),
+            on_error=lambda e: QMessageBox.warning(self, 'Error', f'Export failed: {e}'))
+
     """ searches """
+    def run_query(self, fn, show, *args):  # fn runs in the background, show(result) updates the screen
+        self.main_window.run_in_background(fn, *args, on_result=show,
+                                           on_error=lambda e: QtWidgets.QMessageBox.critical(self, 'Error', e))
+
     def show_all_members(self):
-        try:
-            members, count = get_all_members()  # the function returns two things: member list and count
+        def show(count):
             self.member_count_label.setText(f"Total number of members: {count}")
-            member_details = "Name\tPhone Number\tJoin Date\n"  # member details string with headings
-            member_details += "-" * 80 + "\n"  # a separator line
-
-            for member in members:
-                member_details += (
-                f"{member.id}\t"
-                f"{member.first_name} {member.last_name}\t"
-                f"{member.join_date}\n"  # adds spacing between members
-                )
-            self.member_details_text_edit.setPlainText(member_details)  # Update the text area with members' details
-        except RuntimeError as e:
-            QtWidgets.QMessageBox.critical(self, 'Error', str(e))
+            self.member_table_view.setModel(member_table_model(self))  # fetches the first page, the rest follows on scroll
+            self.member_results_stack.setCurrentWidget(self.member_table_view)
+
+        self.run_query(count_members, show)
+
+    def show_member(self, member):
+        if member:
+            details = (
+                f"Name: {member.first_name} {member.last_name}\n"
+                f"Email: {member.email}\n"
+                f"Phone Number: {member.phone_number}\n"
+                f"Address: {member.address}\n"
+                f"Join Date: {member.join_date}"
+            )
+            self.member_details_text_edit.setPlainText(details)  # display member details on the text box
+        else:
+            self.member_details_text_edit.setPlainText("Member not found")
+
+    def show_error(self, error):
+        self.member_details_text_edit.setPlainText(f"An error occurred: {error}")
+
+    def quick_search(self, search_text):
+        if search_text:
+            self.main_window.run_in_background(search_members, search_text, on_error=self.show_error,
+                                               on_result=lambda rows: self.show_search_results(search_text, rows))
+
+    def show_search_results(self, search_text, rows):
+        if search_text != self.member_search_box.text().strip():
+            return  # the user has kept typing, a newer search is on its way
+        self.member_count_label.setText(f"Matching members: {len(rows)}")
+        member_details = "Member ID\tName\tEmail\tPhone Number\n"  # member details string with headings
+        member_details += "-" * 80 + "\n"  # a separator line
+        for member_id, first_name, last_name, email, phone_number in rows:
+            member_details += f"{member_id}\t{first_name} {last_name}\t{email}\t{phone_number}\n"
+        self.member_details_text_edit.setPlainText(member_details)
 
     def search_by_full_name (self):
-        try:
-            fname, _ = QtWidgets.QInputDialog.getText(self, 'Search for Member', 'First Name:')
-            lname, _ = QtWidgets.QInputDialog.getText(self, 'Search for Member', 'Last Name:')
-            member = get_member_by_names(fname, lname)  # returns the object instance found on the db
-            if member:
-                details = (
-                    f"Name: {member.first_name} {member.last_name}\n"
-                    f"Email: {member.email}\n"
-                    f"Phone Number: {member.phone_number}\n"
-                    f"Address: {member.address}\n"
-                    f"Join Date: {member.join_date}"
-                )
-                self.member_details_text_edit.setPlainText(details)  # display member details on the text box
-            else:
-                self.member_details_text_edit.setPlainText("Member not found")
-        except Exception as e:
-            self.member_details_text_edit.setPlainText(f"An error occurred: {e}")
+        fname, ok = QtWidgets.QInputDialog.getText(self, 'Search for Member', 'First Name:')
+        if not ok:
+            return
+        lname, ok = QtWidgets.QInputDialog.getText(self, 'Search for Member', 'Last Name:')
+        if ok:
+            self.main_window.run_in_background(get_member_by_names, fname, lname, on_result=self.show_member, on_error=self.show_error)
 
     def search_by_email (self):
-        try:
-            email, _ = QtWidgets.QInputDialog.getText(self, 'Search for Member', 'Email:')
-            member = get_member_by_email(email)   # returns the object instance found on the db
-            if member:
-                details = (
-                    f"Name: {member.first_name} {member.last_name}\n"
-                    f"Email: {member.email}\n"
-                    f"Phone Number: {member.phone_number}\n"
-                    f"Address: {member.address}\n"
-                    f"Join Date: {member.join_date}"
-                )
-                self.member_details_text_edit.setPlainText(details)  # display member details on the text box
-            else:
-                self.member_details_text_edit.setPlainText("Member not found")
-        except Exception as e:
-            self.member_details_text_edit.setPlainText(f"An error occurred: {e}")
+        email, ok = QtWidgets.QInputDialog.getText(self, 'Search for Member', 'Email:')
+        if ok:
+            self.main_window.run_in_background(get_member_by_email, email, on_result=self.show_member, on_error=self.show_error)
 
     # queries
     def member_married(self):
-        try:
-            members, count = married_members()   # the function returns two things: member list and count
-            self.member_count_label.setText(f"Total number of members: {count}")
-            member_details = "Member ID\tName\tJoin Date\n"  # member details string with headings
-            member_details += "-" * 80 + "\n"   # a separator line
-            for member in members:
-                member_details += (
-                f"{member.id}\t"
-                f"{member.first_name} {member.last_name}\t"
-                f"{member.join_date}\n\n"   # adds spacing between members
-                )
-            self.member_details_text_edit.setPlainText(member_details)  # Update the text area with members' details
-        except RuntimeError as e:
-            QtWidgets.QMessageBox.critical(self, 'Error', str(e))
+        self.run_query(married_members, self.show_married)
+
+    def show_married(self, result):
+        members, count = result   # the function returns two things: member list and count
+        self.member_count_label.setText(f"Total number of members: {count}")
+        member_details = "Member ID\tName\tJoin Date\n"  # member details string with headings
+        member_details += "-" * 80 + "\n"   # a separator line
+        for member in members:
+            member_details += (
+            f"{member[0]}\t"  # member.id
+            f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
+            f"{member[3]}\n\n"   # member.join_date, adds spacing between members
+            )
+        self.member_details_text_edit.setPlainText(member_details)  # Update the text area with members' details
 
     def member_with_children(self):
-        try:
-            members, count = children_query()   # the function returns two things: member list and count
-            self.member_count_label.setText(f"Total number of members: {count}")
-            member_details = "Member ID\tName\tNumber of children\n"  # member details string with headings
-            member_details += "-" * 80 + "\n"  # a separator line
-            for member in members:
-                member_details += (
-                    f"{member[0]}\t"  # member.id
-                    f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
-                    f"{member[3]}\n\n"   # member.children
-            )
-            self.member_details_text_edit.setPlainText(member_details)  # Update the text area with members' details
-        except RuntimeError as e:
-            QtWidgets.QMessageBox.critical(self, 'Error', str(e))
+        self.run_query(children_query, self.show_with_children)
+
+    def show_with_children(self, result):
+        members, count = result   # the function returns two things: member list and count
+        self.member_count_label.setText(f"Total number of members: {count}")
+        member_details = "Member ID\tName\tNumber of children\n"  # member details string with headings
+        member_details += "-" * 80 + "\n"  # a separator line
+        for member in members:
+            member_details += (
+                f"{member[0]}\t"  # member.id
+                f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
+                f"{member[3]}\n\n"   # member.children
+        )
+        self.member_details_text_edit.setPlainText(member_details)  # Update the text area with members' details
 
     def uneduc_members(self):
-        try:
-            members, count = uneducated_members()  # the function returns two things: member list and count
-            self.member_count_label.setText(f"Number of uneducated members: {count}")
-            member_details = "Member ID\tName\tPhone Number\n"  # member details string with headings
-            member_details += "-" * 80 + "\n"  # a separator line
-            for member in members:
-                member_details += (
-                    f"{member[0]}\t"  # member.id
-                    f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
-                    f"{member[3]}\n\n"  # member.children
-            )
-            self.member_details_text_edit.setPlainText(member_details)  # Update the text area with members' details
-        except RuntimeError as e:
-            QtWidgets.QMessageBox.critical(self, 'Error', str(e))
+        self.run_query(uneducated_members, self.show_uneducated)
+
+    def show_uneducated(self, result):
+        members, count = result  # the function returns two things: member list and count
+        self.member_count_label.setText(f"Number of uneducated members: {count}")
+        member_details = "Member ID\tName\tPhone Number\n"  # member details string with headings
+        member_details += "-" * 80 + "\n"  # a separator line
+        for member in members:
+            member_details += (
+                f"{member[0]}\t"  # member.id
+                f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
+                f"{member[3]}\n\n"  # member.phone number
+        )
+        self.member_details_text_edit.setPlainText(member_details)  # Update the text area with members' details
 
     def members_disabled(self):
-        try:
-            members, count = disabled_members()  # the function returns two things: member list and count
-            self.member_count_label.setText(f"Number of disabled members: {count}")
-            member_details = "Member ID\tName\tPhone Number\n"  # member details string with headings
-            member_details += "-" * 80 + "\n"  # a separator line
-            for member in members:
-                member_details += (
-                    f"{member[0]}\t"   # member.id
-                    f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
-                    f"{member[3]}\n\n"  # member.phone number
-            )
-            self.member_details_text_edit.setPlainText(member_details)  # Update the text area with members' details
-        except RuntimeError as e:
-            QtWidgets.QMessageBox.critical(self, 'Error', str(e))
+        self.run_query(disabled_members, self.show_disabled)
+
+    def show_disabled(self, result):
+        members, count = result  # the function returns two things: member list and count
+        self.member_count_label.setText(f"Number of disabled members: {count}")
+        member_details = "Member ID\tName\tPhone Number\n"  # member details string with headings
+        member_details += "-" * 80 + "\n"  # a separator line
+        for member in members:
+            member_details += (
+                f"{member[0]}\t"   # member.id
+                f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
+                f"{member[3]}\n\n"  # member.phone number
+        )
+        self.member_details_text_edit.setPlainText(member_details)  # Update the text area with members' details
 
     def officers_servers(self):
-        try:
-            servers, officers, count, count2 = office_bearers()  # the function returns four things: 2x member list and 2x count
-            self.member_count_label.setText(f"Number of Servers: {count}\nNumber of Annointed Members: {count2}")
-            server_details = "Member ID\tName\tPhone Number\tRole\n"  # member details string with headings
-            officer_details = ""  # member details with no headings
-            server_details += "-" * 80 + "\n"  # a separator line
-            officer_details += "-" * 80 + "\n"  # a separator line
-            for member in servers:
-                server_details += (
-                    f"{member[0]}\t"  # member.id
-                    f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
-                    f"{member[3]}\t"  # member.phone number
-                    f"{member[4]}\n\n"  # demo.involvement
-            )
-            for member in officers:
-                officer_details += (
-                    f"{member[0]}\t"  # member.id
-                    f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
-                    f"{member[3]}\t"  # member.phone number
-                    f"{member[4]}\n\n"  # demo.involvement
-            )
-            self.member_details_text_edit.setPlainText(f"{server_details}\n\n{officer_details}")  # Update the text area with members' details
-        except RuntimeError as e:
-            QtWidgets.QMessageBox.critical(self, 'Error', str(e))
+        self.run_query(office_bearers, self.show_office_bearers)
+
+    def show_office_bearers(self, result):
+        servers, officers, count, count2 = result  # the function returns four things: 2x member list and 2x count
+        self.member_count_label.setText(f"Number of Servers: {count}\nNumber of Annointed Members: {count2}")
+        server_details = "Member ID\tName\tPhone Number\tRole\n"  # member details string with headings
+        officer_details = ""  # member details with no headings
+        server_details += "-" * 80 + "\n"  # a separator line
+        officer_details += "-" * 80 + "\n"  # a separator line
+        for member in servers:
+            server_details += (
+                f"{member[0]}\t"  # member.id
+                f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
+                f"{member[3]}\t"  # member.phone number
+                f"{member[4]}\n\n"  # demo.involvement
+        )
+        for member in officers:
+            officer_details += (
+                f"{member[0]}\t"  # member.id
+                f"{member[1]} {member[2]}\t"  # member.first_name and member.last_name
+                f"{member[3]}\t"  # member.phone number
+                f"{member[4]}\n\n"  # demo.involvement
+        )
+        self.member_details_text_edit.setPlainText(f"{server_details}\n\n{officer_details}")  # Update the text area with members' details
+
+    def stats_summary(self):
+        self.run_query(demographic_stats, self.show_stats)  # all the counts in one query
+
+    def show_stats(self, stats):
+        self.member_count_label.setText(f"Total number of members: {stats.members}")
+        summary = (
+            f"Married Members:\t{stats.married}\n"
+            f"Members With Children:\t{stats.with_children}\n"
+            f"Uneducated Members:\t{stats.uneducated}\n"
+            f"Educated Members:\t{stats.educated}\n"
+            f"Disabled Members:\t{stats.disabled}\n"
+            f"Servers:\t{stats.servers}\n"
+            f"Annointed Members:\t{stats.officers}"
+        )
+        self.member_details_text_edit.setPlainText(summary)
 
    # def query_members(self):
    #     try:
@@ -936,6 +1290,8 @@ def apply_stylesheet(app):
         app.setStyleSheet(qss)
 
 if __name__ == "__main__":
+    switch_org(get_org())  # ORG_KEY or the first organization in the registry
+    init_db()  # create missing tables and bring an older database up to the current schema
     app = QtWidgets.QApplication(sys.argv)
     apply_stylesheet(app)  # Apply the stylesheet
     window = MainWindow()
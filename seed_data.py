@@ -0,0 +1,190 @@
+import random
+import datetime
+from sqlalchemy import func, select
+from database import get_engine
+from models import Member, Demographics, Event, VolunteerOpportunity, MemberVolunteering, birthday_key, normalize_phone
+from models import Gender, MembershipStatus, Marital_Status, EducationLevel, AttendanceLevel, Involvement, Yes_No
+from models import member_cache, event_cache
+from bulk_import import COLUMNS, DELIMITER
+
+# Reproducible synthetic data for benchmarks and load tests: the same seed always gives the same
+# members, demographics, events and volunteering rows. Writes go through Core executemany in chunks
+# (like bulk_import.py), so a million members take minutes rather than hours.
+
+SEED = 2024
+CHUNK_SIZE = 10000  # rows per transaction
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+TODAY = datetime.date(2024, 6, 1)  # fixed so dates don't drift between runs
+
+FIRST_NAMES = ['Thandi', 'Sipho', 'Lerato', 'Bongani', 'Naledi', 'Themba', 'Zanele', 'Mandla', 'Ayanda', 'Kagiso',
+               'Nomsa', 'Tebogo', 'Palesa', 'Lwazi', 'Refilwe', 'Sibusiso', 'Lindiwe', 'Thabo', 'Busisiwe', 'Jabu',
+               'Anele', 'Karabo', 'Nandi', 'Vusi', 'Precious', 'Johan', 'Maria', 'David', 'Grace', 'Peter']
+LAST_NAMES = ['Dlamini', 'Nkosi', 'Ndlovu', 'Khumalo', 'Mokoena', 'Mahlangu', 'Zulu', 'Mthembu', 'Sithole', 'Naidoo',
+              'Botha', 'Van der Merwe', 'Molefe', 'Ngcobo', 'Mabuza', 'Cele', 'Shabalala', 'Radebe', 'Pillay', 'Smith']
+STREETS = ['Church St', 'Main Rd', 'Vilakazi St', 'Long St', 'Mandela Dr', 'Station Rd', 'Park Ave', 'Hill St']
+OCCUPATIONS = ['Teacher', 'Nurse', 'Clerk', 'Driver', 'Engineer', 'Student', 'Retired', 'Self-employed',
+               'Accountant', 'Cashier', 'Electrician', 'Farmer']
+EVENT_NAMES = ['Sunday Service', 'Bible Study', 'Youth Meeting', 'Choir Practice', 'Prayer Meeting', 'Men\'s Fellowship',
+               'Women\'s Guild', 'Outreach', 'Fundraiser', 'Baptism', 'Wedding', 'Funeral', 'Leaders Meeting']
+LOCATIONS = ['Main Hall', 'Chapel', 'Church Grounds', 'Community Centre', 'Room 2', 'Youth Hall']
+OPPORTUNITIES = ['Ushering', 'Sound Desk', 'Sunday School', 'Soup Kitchen', 'Cleaning', 'Parking', 'Choir',
+                 'Hospital Visits', 'Transport', 'Catering', 'Prayer Team', 'Media']
+
+# (values, weights) for the columns that the stats queries filter on
+MARITAL_WEIGHTS = ([Marital_Status.Married, Marital_Status.Never_Married, Marital_Status.Divorced, Marital_Status.Widowed, None],
+                   [45, 38, 7, 8, 2])
+EDUCATION_WEIGHTS = ([EducationLevel.No_Matric, EducationLevel.High_School, EducationLevel.College,
+                      EducationLevel.Bachelors, EducationLevel.Post_Grad, None], [30, 35, 15, 12, 6, 2])
+ATTENDANCE_WEIGHTS = (list(AttendanceLevel), [50, 20, 15, 15])
+INVOLVEMENT_WEIGHTS = ([Involvement.Congregant, Involvement.Server, Involvement.Officer], [80, 15, 5])
+CHILDREN_WEIGHTS = ([0, 1, 2, 3, 4, 5], [35, 20, 22, 13, 6, 4])
+
+
+def _phone_number(rng, previous):  # as people write them: shared family phones, national format, the odd typo
+    if rng.random() < 0.05:
+        return None
+    if previous and rng.random() < 0.10:
+        return previous
+    number = str(rng.randint(600000000, 849999999))
+    if rng.random() < 0.01:
+        return number[:5]  # too short to be a number
+    if rng.random() < 0.2:
+        return f"0{number[:2]} {number[2:5]} {number[5:]}"
+    return f"+27{number}"
+
+
+def _member_rows(rng, first_id, count):  # (member rows, demographics rows) with ids handed out up front
+    members, demographics = [], []
+    phone_number = None
+    for member_id in range(first_id, first_id + count):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        date_of_birth = TODAY - datetime.timedelta(days=rng.randint(365 * 5, 365 * 90))
+        date_of_birth = date_of_birth.isoformat()
+        phone_number = _phone_number(rng, phone_number)
+        members.append({
+            'id': member_id,
+            'first_name': first_name,
+            'last_name': last_name,
+            'date_of_birth': date_of_birth,
+            'birth_mmdd': birthday_key(date_of_birth),  # Core inserts skip set_birth_mmdd
+            'gender': rng.choices([Gender.Female, Gender.Male, Gender.Other], [52, 46, 2])[0],
+            'phone_number': phone_number,
+            'phone_e164': normalize_phone(phone_number),  # nor set_phone_e164
+            'email': f"{first_name}.{last_name}.{member_id}@example.org".lower().replace(' ', '') if rng.random() < 0.8 else None,
+            'address': f"{rng.randint(1, 999)} {rng.choice(STREETS)}",
+            'join_date': (TODAY - datetime.timedelta(days=rng.randint(0, 365 * 30))).isoformat(),
+            'membership_status': rng.choices([MembershipStatus.Active, MembershipStatus.Inactive], [85, 15])[0],
+        })
+        demographics.append({
+            'member_id': member_id,
+            'marital_status': rng.choices(*MARITAL_WEIGHTS)[0],
+            'children': rng.choices(*CHILDREN_WEIGHTS)[0],
+            'family_at_home': rng.randint(1, 8),
+            'occupation': rng.choice(OCCUPATIONS) if rng.random() < 0.7 else None,
+            'education_level': rng.choices(*EDUCATION_WEIGHTS)[0],
+            'attendance': rng.choices(*ATTENDANCE_WEIGHTS)[0],
+            'involvement': rng.choices(*INVOLVEMENT_WEIGHTS)[0],
+            'disabilities': Yes_No.Yes if rng.random() < 0.07 else Yes_No.No,
+        })
+    return members, demographics
+
+
+def _event_rows(rng, count):  # spread over two years either side of TODAY
+    rows = []
+    for _ in range(count):
+        event_date = TODAY + datetime.timedelta(days=rng.randint(-730, 730))
+        start_hour = rng.randint(7, 19)
+        rows.append({
+            'name': rng.choice(EVENT_NAMES),
+            'event_date': event_date,
+            'start_time': f"{start_hour:02d}:00",
+            'end_time': f"{start_hour + rng.randint(1, 3):02d}:00",
+            'location': rng.choice(LOCATIONS),
+            'description': f"{rng.choice(EVENT_NAMES)} for the {rng.choice(['whole church', 'youth', 'elders', 'families', 'choir'])}",
+        })
+    return rows
+
+
+def generate(members=SIZES['1k'], seed=SEED, chunk_size=CHUNK_SIZE, progress=None):
+    # adds `members` members (with demographics) plus events, volunteer opportunities and volunteering
+    # in proportion; progress(members written) is called after every chunk. Returns the row counts.
+    rng = random.Random(seed)
+    engine = get_engine()
+    events = max(members // 50, 20)
+    opportunities = len(OPPORTUNITIES)
+    volunteering = 0
+
+    with engine.begin() as conn:
+        first_id = (conn.execute(select(func.max(Member.id))).scalar() or 0) + 1
+        opportunity_rows = [{'name': name, 'description': f"Help with {name.lower()}", 'location': rng.choice(LOCATIONS),
+                             'date_posted': (TODAY - datetime.timedelta(days=rng.randint(0, 365))).isoformat()}
+                            for name in OPPORTUNITIES]
+        result = conn.execute(VolunteerOpportunity.__table__.insert().returning(VolunteerOpportunity.id), opportunity_rows)
+        opportunity_ids = result.scalars().all()
+        for start in range(0, events, chunk_size):
+            conn.execute(Event.__table__.insert(), _event_rows(rng, min(chunk_size, events - start)))
+
+    written = 0
+    while written < members:
+        count = min(chunk_size, members - written)
+        member_rows, demographic_rows = _member_rows(rng, first_id + written, count)
+        volunteering_rows = []
+        for member in member_rows:
+            if rng.random() < 0.2:  # about one member in five volunteers, for one to three opportunities
+                for opportunity_id in rng.sample(opportunity_ids, rng.randint(1, 3)):
+                    volunteering_rows.append({'member_id': member['id'], 'opportunity_id': opportunity_id,
+                                              'date_volunteered': (TODAY - datetime.timedelta(days=rng.randint(0, 730))).isoformat()})
+        with engine.begin() as conn:  # one transaction per chunk
+            conn.execute(Member.__table__.insert(), member_rows)
+            conn.execute(Demographics.__table__.insert(), demographic_rows)
+            if volunteering_rows:
+                conn.execute(MemberVolunteering.__table__.insert(), volunteering_rows)
+        written += count
+        volunteering += len(volunteering_rows)
+        if progress:
+            progress(written)
+
+    member_cache.clear()  # Core inserts skip the flush listener
+    event_cache.clear()
+    return {'members': members, 'demographics': members, 'events': events,
+            'volunteer_opportunities': opportunities, 'member_volunteering': volunteering}
+
+
+def write_import_file(file_path, rows, seed=SEED, tag='import'):
+    # a pipe-delimited file in the bulk_import.py format; tag keeps the emails unique between files
+    rng = random.Random(seed)
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write(DELIMITER.join(COLUMNS) + '\n')
+        for number in range(rows):
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            values = {
+                'first_name': first_name,
+                'last_name': last_name,
+                'email': f"{tag}.{number}@example.org",
+                'phone_number': f"+27{rng.randint(600000000, 849999999)}",
+                'marital_status': (rng.choices(*MARITAL_WEIGHTS)[0] or Marital_Status.Married).value,
+                'children': str(rng.choices(*CHILDREN_WEIGHTS)[0]),
+                'family_at_home': str(rng.randint(1, 8)),
+                'occupation': rng.choice(OCCUPATIONS),
+                'education_level': (rng.choices(*EDUCATION_WEIGHTS)[0] or EducationLevel.High_School).value,
+                'involvement': rng.choices(*INVOLVEMENT_WEIGHTS)[0].value,
+                'disabilities': 'Yes' if rng.random() < 0.07 else 'No',
+            }
+            file.write(DELIMITER.join(values[column] for column in COLUMNS) + '\n')
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from migrations import init_db
+
+    parser = argparse.ArgumentParser(description='Fill the database (ORG_DATABASE_URL) with synthetic members and events.')
+    parser.add_argument('size', help=f"one of {', '.join(SIZES)} or a number of members")
+    parser.add_argument('--seed', type=int, default=SEED)
+    args = parser.parse_args()
+
+    init_db()
+    started = time.perf_counter()
+    counts = generate(SIZES.get(args.size.lower()) or int(args.size), args.seed,
+                      progress=lambda done: print(f"{done} members written"))
+    print(f"Generated {counts} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,265 @@
+import enum
+import json
+import datetime
+from sqlalchemy import and_, or_, not_, select, func, delete, insert, literal
+from sqlalchemy import Enum as EnumType, Integer, Date
+from database import session  # shared engine, one session per thread
+from models import Member, Demographics, Segment, SegmentMember, MemberChange
+
+# Saved audiences for broadcasts, e.g. "all officers with children":
+#
+#   save_segment('officers with children', all_of(where('involvement', 'eq', 'Officer'), where('children', 'gte', 1)))
+#   numbers = segment_phone_numbers('officers with children')
+#
+# A definition is plain JSON: {'field', 'op', 'value'} conditions combined with {'all': [...]}, {'any': [...]}
+# and {'not': ...}, and {'segment': name} to reuse another saved segment. It compiles to one WHERE clause
+# over members LEFT JOIN demographics. The recipients are cached in segment_members and refreshed from
+# member_changes (filled by triggers, see migration 5), so only members written since the last refresh
+# are looked at again.
+
+# fields a segment can filter on
+FIELDS = {
+    'gender': Member.gender,
+    'membership_status': Member.membership_status,
+    'join_date': Member.join_date,
+    'marital_status': Demographics.marital_status,
+    'children': Demographics.children,
+    'family_at_home': Demographics.family_at_home,
+    'occupation': Demographics.occupation,
+    'education_level': Demographics.education_level,
+    'attendance': Demographics.attendance,
+    'involvement': Demographics.involvement,
+    'disabilities': Demographics.disabilities,
+}
+OPERATORS = ('eq', 'ne', 'in', 'not_in', 'gt', 'gte', 'lt', 'lte', 'is_null', 'not_null')
+
+
+""" Building definitions """
+def where(field, op, value=None):
+    if isinstance(value, enum.Enum):
+        value = value.name
+    elif isinstance(value, (list, tuple, set)):
+        value = [item.name if isinstance(item, enum.Enum) else item for item in value]
+    return {'field': field, 'op': op, 'value': value}
+
+def all_of(*parts):
+    return {'all': list(parts)}
+
+def any_of(*parts):
+    return {'any': list(parts)}
+
+def none_of(*parts):
+    return {'not': any_of(*parts)}
+
+def in_segment(name):
+    return {'segment': name}
+
+
+""" Compiling to SQL """
+def _coerce(column, value):  # text from JSON or a dialog to what the column compares with
+    if isinstance(value, str) and isinstance(column.type, Integer):
+        return int(value)
+    if isinstance(value, str) and isinstance(column.type, Date):
+        return datetime.date.fromisoformat(value)
+    return value
+
+def _stored_values(column, value):  # enums are matched on the name and the display value, both end up in the table
+    enum_class = getattr(column.type, 'enum_class', None) if isinstance(column.type, EnumType) else None
+    if enum_class is None:
+        return [_coerce(column, value)]
+    for item in enum_class:
+        if value in (item, item.name, item.value):
+            return list(dict.fromkeys([item.name, item.value]))
+    raise RuntimeError(f"'{value}' is not a valid {enum_class.__name__}, use one of {', '.join(item.name for item in enum_class)}")
+
+def _field_condition(field, op, value, fields=FIELDS):
+    if field not in fields:
+        raise RuntimeError(f"Unknown field '{field}', use one of {', '.join(fields)}")
+    column = fields[field]
+    if op == 'is_null':
+        return column.is_(None)
+    if op == 'not_null':
+        return column.isnot(None)
+    if op in ('in', 'not_in'):
+        if not isinstance(value, (list, tuple)):
+            raise RuntimeError(f"'{op}' on '{field}' needs a list of values")
+        values = [stored for item in value for stored in _stored_values(column, item)]
+        return column.in_(values) if op == 'in' else column.notin_(values)
+    if op in ('eq', 'ne'):
+        values = _stored_values(column, value)
+        return column.in_(values) if op == 'eq' else column.notin_(values)
+    if op == 'gt':
+        return column > _coerce(column, value)
+    if op == 'gte':
+        return column >= _coerce(column, value)
+    if op == 'lt':
+        return column < _coerce(column, value)
+    if op == 'lte':
+        return column <= _coerce(column, value)
+    raise RuntimeError(f"Unknown segment operator '{op}', use one of {', '.join(OPERATORS)}")
+
+def compile_definition(definition, seen=(), fields=FIELDS):
+    # the WHERE clause for a definition, saved segments are inlined; other fields (e.g. models.EVENT_FIELDS)
+    # use the same definitions for other tables
+    if not isinstance(definition, dict):
+        raise RuntimeError(f"Invalid segment definition: {definition!r}")
+    if 'all' in definition:
+        return and_(*[compile_definition(part, seen, fields) for part in definition['all']])
+    if 'any' in definition:
+        return or_(*[compile_definition(part, seen, fields) for part in definition['any']])
+    if 'not' in definition:
+        return not_(compile_definition(definition['not'], seen, fields))
+    if 'segment' in definition:
+        if fields is not FIELDS:
+            raise RuntimeError("Saved segments select members, they can't be used here")
+        name = definition['segment']
+        if name in seen:
+            raise RuntimeError(f"Segment '{name}' refers back to itself")
+        saved = session.query(Segment.definition).filter_by(name=name).scalar()
+        if saved is None:
+            raise RuntimeError(f"Segment '{name}' not found")
+        return compile_definition(json.loads(saved), seen + (name,))
+    if 'field' in definition:
+        return _field_condition(definition['field'], definition.get('op', 'eq'), definition.get('value'), fields)
+    raise RuntimeError(f"Invalid segment definition: {definition!r}")
+
+def _references(definition):  # names of the saved segments a definition uses directly
+    if 'segment' in definition:
+        return {definition['segment']}
+    parts = definition.get('all') or definition.get('any') or ([definition['not']] if 'not' in definition else [])
+    return set().union(*[_references(part) for part in parts]) if parts else set()
+
+def _matching_ids(condition):  # select of the member ids a condition matches
+    return select(Member.id).select_from(Member).\
+        outerjoin(Demographics, Demographics.member_id == Member.id).where(condition)
+
+
+""" Saved segments """
+def save_segment(name, definition):  # adds or replaces a segment, returns its id
+    try:
+        compile_definition(definition, (name,))  # fails early on unknown fields, values or loops
+        text = json.dumps(definition, sort_keys=True)
+        segment = session.query(Segment).filter_by(name=name).first()
+        now = datetime.datetime.now()
+        if segment is None:
+            segment = Segment(name=name, definition=text, updated_at=now)
+            session.add(segment)
+        elif segment.definition != text:
+            segment.definition, segment.updated_at = text, now
+        else:
+            return segment.id
+        segment.refreshed_change = None  # recipients are rebuilt on next use
+        session.flush()
+        # segments built on this one (directly or through others) are out of date as well
+        others = [(other, _references(json.loads(other.definition))) for other in session.query(Segment).filter(Segment.id != segment.id)]
+        changed = {name}
+        while True:
+            stale = [other for other, references in others if references & changed and other.name not in changed]
+            if not stale:
+                break
+            for other in stale:
+                other.refreshed_change = None
+                changed.add(other.name)
+        session.commit()
+        return segment.id
+    except Exception as e:
+        session.rollback()
+        print(f"An error occurred while saving segment '{name}': {e}")
+        raise RuntimeError(f"Failed to save segment '{name}': {e}")
+
+def delete_segment(name):
+    try:
+        segment = session.query(Segment).filter_by(name=name).first()
+        if segment is None:
+            raise RuntimeError(f"segment '{name}' not found")
+        users = [other.name for other in session.query(Segment) if name in _references(json.loads(other.definition))]
+        if users:
+            raise RuntimeError(f"segment '{name}' is used by {', '.join(users)}")
+        session.execute(delete(SegmentMember).where(SegmentMember.segment_id == segment.id))
+        session.delete(segment)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"An error occurred while deleting segment '{name}': {e}")
+        raise RuntimeError(f"Failed to delete segment '{name}': {e}")
+
+def list_segments():  # [(name, definition, cached recipients)]
+    try:
+        rows = session.query(Segment.name, Segment.definition, func.count(SegmentMember.member_id)).\
+            outerjoin(SegmentMember, SegmentMember.segment_id == Segment.id).group_by(Segment.id).order_by(Segment.name).all()
+        return [(name, json.loads(definition), count) for name, definition, count in rows]
+    except Exception as e:
+        print(f"An error occurred while listing segments: {e}")
+        raise RuntimeError(f"Failed to list segments: {e}")
+
+def preview_segment(definition):  # number of members a definition matches, nothing is saved
+    try:
+        return session.execute(select(func.count()).select_from(_matching_ids(compile_definition(definition)).distinct().subquery())).scalar()
+    except Exception as e:
+        print(f"An error occurred while previewing a segment: {e}")
+        raise RuntimeError(f"Failed to preview segment: {e}")
+
+
+""" Cached recipients """
+def _refresh(segment, latest_change):
+    if segment.refreshed_change is not None and segment.refreshed_change >= latest_change:
+        return  # nothing written since the last refresh
+    matching = _matching_ids(compile_definition(json.loads(segment.definition), (segment.name,)))
+    cached = SegmentMember.segment_id == segment.id
+    if segment.refreshed_change is None:  # new or edited definition: rebuild
+        session.execute(delete(SegmentMember).where(cached))
+    else:  # only the members written since the last refresh
+        changed = select(MemberChange.member_id).where(MemberChange.id > segment.refreshed_change,
+                                                       MemberChange.id <= latest_change)
+        session.execute(delete(SegmentMember).where(cached, SegmentMember.member_id.in_(changed)))
+        matching = matching.where(Member.id.in_(changed))
+    session.execute(insert(SegmentMember).prefix_with('OR IGNORE').from_select(
+        ['segment_id', 'member_id'], matching.with_only_columns(literal(segment.id), Member.id)))
+    segment.refreshed_change = latest_change
+
+def refresh_segments(names=None):  # brings the cached recipients up to date, all segments by default
+    try:
+        latest_change = session.query(func.max(MemberChange.id)).scalar() or 0
+        query = session.query(Segment)
+        if names is not None:
+            query = query.filter(Segment.name.in_(names))
+        segments = query.all()
+        if names is not None and len(segments) != len(set(names)):
+            missing = set(names) - {segment.name for segment in segments}
+            raise RuntimeError(f"segment '{', '.join(sorted(missing))}' not found")
+        for segment in segments:
+            _refresh(segment, latest_change)
+        session.flush()
+        # the change log is only needed back to the segment that is furthest behind
+        oldest = session.query(func.min(Segment.refreshed_change)).scalar()
+        session.execute(delete(MemberChange).where(MemberChange.id <= (oldest if oldest is not None else latest_change)))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"An error occurred while refreshing segments: {e}")
+        raise RuntimeError(f"Failed to refresh segments: {e}")
+
+def segment_recipients(name):  # rows of (id, first_name, last_name, phone_number), refreshed first
+    refresh_segments([name])
+    try:
+        result = session.query(Member.id, Member.first_name, Member.last_name, Member.phone_number).\
+            join(SegmentMember, SegmentMember.member_id == Member.id).join(Segment, Segment.id == SegmentMember.segment_id).\
+            filter(Segment.name == name).order_by(Member.id).all()
+        return result, len(result)
+    except Exception as e:
+        print(f"An error occurred while reading segment '{name}': {e}")
+        raise RuntimeError(f"Failed to retrieve recipients of segment '{name}': {e}")
+
+def segment_member_ids(name):  # select of the member ids in a segment, refreshed first; e.g. for Member.id.in_()
+    refresh_segments([name])
+    return select(SegmentMember.member_id).join(Segment, Segment.id == SegmentMember.segment_id).where(Segment.name == name)
+
+def segment_phone_numbers(name):  # the distinct normalized phone numbers of a segment, what the dispatcher sends to
+    member_ids = segment_member_ids(name)
+    try:
+        rows = session.query(Member.phone_e164).distinct().\
+            filter(Member.id.in_(member_ids), Member.phone_e164.isnot(None)).all()
+        return [number for number, in rows]
+    except Exception as e:
+        print(f"An error occurred while reading segment '{name}': {e}")
+        raise RuntimeError(f"Failed to retrieve phone numbers of segment '{name}': {e}")
@@ -0,0 +1,107 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+# Cold-start benchmark: launches the GUI in a fresh interpreter several times and measures the time
+# from process launch to the first paint of the main window (imports, database setup and window
+# construction included). Results are appended to a JSON file so runs can be compared between commits.
+
+RESULTS_FILE = 'startup_benchmark.json'
+
+# runs inside the child interpreter, mirrors screen.py's __main__ block
+CHILD = r'''
+import sys, time
+started = time.time()
+from PyQt5 import QtWidgets, QtCore
+import screen
+imported = time.time()
+screen.init_db()
+app = QtWidgets.QApplication(sys.argv)
+screen.apply_stylesheet(app)
+window = screen.MainWindow()
+
+class FirstPaint(QtCore.QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Paint:
+            print(f"PAINTED {time.time()} {imported - started}", flush=True)
+            QtCore.QTimer.singleShot(0, app.quit)
+            window.removeEventFilter(self)
+        return False
+
+first_paint = FirstPaint()
+window.installEventFilter(first_paint)
+window.show()
+app.exec_()
+'''
+
+
+def measure_once(env):  # returns (seconds to first paint, seconds spent importing)
+    launched = time.time()
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env=env, capture_output=True, text=True, timeout=120)
+    for line in output.stdout.splitlines():
+        if line.startswith('PAINTED'):
+            _, painted, import_seconds = line.split()
+            return float(painted) - launched, float(import_seconds)
+    raise RuntimeError(f"The window was never painted:\n{output.stderr[-2000:]}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(runs=5, offscreen=False):
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, ORG_DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}")
+        if offscreen:
+            env['QT_QPA_PLATFORM'] = 'offscreen'
+        measure_once(env)  # first run creates the database, not part of the numbers
+        samples = [measure_once(env) for _ in range(runs)]
+    first_paint = [paint for paint, _ in samples]
+    imports = [imported for _, imported in samples]
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'runs': runs,
+        'first_paint_median_s': round(statistics.median(first_paint), 4),
+        'first_paint_min_s': round(min(first_paint), 4),
+        'first_paint_max_s': round(max(first_paint), 4),
+        'import_median_s': round(statistics.median(imports), 4),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure cold-start time to the first window paint.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--offscreen', action='store_true', help='use the offscreen Qt platform (no display needed)')
+    parser.add_argument('--output', default=RESULTS_FILE, help='JSON file the result is appended to')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='fail if the median is this many percent slower than the previous result')
+    args = parser.parse_args()
+
+    result = run(args.runs, args.offscreen)
+    print(json.dumps(result, indent=2))
+
+    history = []
+    if os.path.exists(args.output):
+        with open(args.output) as file:
+            history = json.load(file)
+    previous = history[-1] if history else None
+    history.append(result)
+    with open(args.output, 'w') as file:
+        json.dump(history, file, indent=2)
+
+    if previous:
+        change = (result['first_paint_median_s'] / previous['first_paint_median_s'] - 1) * 100
+        print(f"First paint {change:+.1f}% compared to {previous.get('commit') or previous['timestamp']}")
+        if args.max_regression is not None and change > args.max_regression:
+            sys.exit(1)
@@ -0,0 +1,79 @@
+from PyQt5 import QtCore
+from models import get_members_page, get_events_page
+
+# Table models for the result views. Rows are fetched a page at a time as the view scrolls
+# (canFetchMore/fetchMore) and sorting is done by the database, so only the visible part of
+# a large table is ever held in memory.
+
+
+class KeysetTableModel(QtCore.QAbstractTableModel):
+    # fetch_page(after, limit, sort, descending) -> (rows, after), see models._keyset_page
+    # columns: list of (heading, sort key understood by fetch_page or None if the column can't be sorted)
+    def __init__(self, fetch_page, columns, default_sort, page_size=200, parent=None):
+        super().__init__(parent)
+        self.fetch_page = fetch_page
+        self.columns = columns
+        self.page_size = page_size
+        self.sort_key = default_sort
+        self.descending = False
+        self.rows = []
+        self.after = None
+        self.exhausted = False
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        value = self.rows[index.row()][index.column()]
+        return '' if value is None else str(value)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self.columns[section][0]
+        return section + 1
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        rows, self.after = self.fetch_page(after=self.after, limit=self.page_size,
+                                           sort=self.sort_key, descending=self.descending)
+        self.exhausted = self.after is None
+        if rows:
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):  # re-query from the first page in the new order
+        sort_key = self.columns[column][1]
+        if sort_key is None:
+            return
+        self.beginResetModel()
+        self.sort_key = sort_key
+        self.descending = order == QtCore.Qt.DescendingOrder
+        self.rows = []
+        self.after = None
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore()
+
+
+def member_table_model(parent=None):
+    columns = [('Member ID', 'id'), ('First Name', 'first_name'), ('Last Name', 'last_name'),
+               ('Phone Number', 'phone_number'), ('Join Date', 'join_date')]
+    return KeysetTableModel(get_members_page, columns, 'id', parent=parent)
+
+
+def event_table_model(parent=None):
+    columns = [('Event ID', 'id'), ('Name', 'name'), ('Date', 'event_date'), ('Starting Time', None),
+               ('Location', 'location'), ('Description', None)]
+    return KeysetTableModel(get_events_page, columns, 'event_date', parent=parent)
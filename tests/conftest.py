@@ -0,0 +1,28 @@
+import os
+import sys
+import pytest
+
+# Every test gets its own SQLite file with the full schema (tables, triggers, migrations), through the same
+# engine, session and listeners the app uses.
+#
+#   python -m pytest -q
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the modules live in the repo root
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):  # the database URL, with the shared session pointed at it
+    monkeypatch.chdir(tmp_path)  # log files (church_management.log, slow_queries.log) stay out of the repo
+    import database
+    from migrations import init_db
+    from models import member_cache, event_cache
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    previous = database.current_database_url()
+    database.use_database(url)
+    init_db()
+    member_cache.clear()
+    event_cache.clear()
+    yield url
+    database.session.remove()
+    database.get_engine(url).dispose()
+    database.use_database(previous)
@@ -0,0 +1,50 @@
+import datetime
+import pytest
+
+from database import session
+from models import Member, get_upcoming_birthdays
+
+BIRTHDAYS = ['1990-12-29', '1985-12-30', '1970-12-31', '2000-01-01', '1999-01-02', '1960-01-03',
+             '1975-02-27', '1980-02-28', '1988-02-29', '1992-03-01']
+
+
+@pytest.fixture
+def members(db):
+    session.add_all([Member(first_name='Member', last_name=str(i), date_of_birth=date_of_birth)
+                     for i, date_of_birth in enumerate(BIRTHDAYS)])
+    session.add(Member(first_name='No', last_name='Birthday'))
+    session.commit()
+
+
+def birthdays(days, today):
+    result, count = get_upcoming_birthdays(days, today)
+    assert count == len(result)
+    return sorted(member.date_of_birth[5:] for member in result)
+
+
+@pytest.mark.parametrize('today, days, expected', [
+    (datetime.date(2025, 2, 27), 0, ['02-27']),
+    (datetime.date(2025, 2, 28), 0, ['02-28', '02-29']),  # no Feb 29 this year, celebrated on the 28th
+    (datetime.date(2025, 2, 27), 1, ['02-27', '02-28', '02-29']),
+    (datetime.date(2025, 2, 28), 1, ['02-28', '02-29', '03-01']),
+    (datetime.date(2024, 2, 28), 0, ['02-28']),  # leap year, Feb 29 has its own day
+    (datetime.date(2024, 2, 29), 0, ['02-29']),
+    (datetime.date(2024, 2, 28), 2, ['02-28', '02-29', '03-01']),
+])
+def test_february_29(members, today, days, expected):
+    assert birthdays(days, today) == expected
+
+
+@pytest.mark.parametrize('today, days, expected', [
+    (datetime.date(2025, 12, 30), 0, ['12-30']),
+    (datetime.date(2025, 12, 30), 1, ['12-30', '12-31']),
+    (datetime.date(2025, 12, 30), 3, ['01-01', '01-02', '12-30', '12-31']),
+    (datetime.date(2025, 12, 31), 1, ['01-01', '12-31']),
+    (datetime.date(2026, 1, 1), 1, ['01-01', '01-02']),
+])
+def test_window_wraps_around_new_year(members, today, days, expected):
+    assert birthdays(days, today) == expected
+
+
+def test_a_whole_year_is_everyone_with_a_birthday(members):
+    assert len(birthdays(365, datetime.date(2025, 6, 1))) == len(BIRTHDAYS)
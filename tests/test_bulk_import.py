@@ -0,0 +1,67 @@
+import sqlite3
+import pytest
+
+import bulk_import
+import models
+from bulk_import import import_members
+from database import session, get_engine
+from migrations import check_summary, BULK_INSERT_STEPS
+from segments import save_segment, where
+
+HEADER = '|'.join(bulk_import.COLUMNS)
+
+
+def write_file(path, rows):
+    lines = [f"Import|{i}|import{i}@example.com|07812057{i:02d}|Never Married|{i % 3}|2|Clerk|Before Matric|Server|No"
+             for i in range(rows)]
+    path.write_text('\n'.join([HEADER] + lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+def triggers():
+    with get_engine().connect() as conn:
+        return {name for name, in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+
+
+def test_import_does_what_the_insert_triggers_did(db, tmp_path):
+    save_segment('servers', where('involvement', 'eq', 'Server'))
+    before = triggers()
+    assert set(BULK_INSERT_STEPS) <= before
+    assert import_members(write_file(tmp_path / 'members.txt', 7), chunk_size=3) == (7, [])
+    assert triggers() == before
+    assert check_summary() == []
+    stats = models.demographic_stats()
+    assert (stats.members, stats.uneducated, stats.servers) == (7, 7, 7)
+    assert [row.email for row in models.search_members('import5')] == ['import5@example.com']
+    with get_engine().connect() as conn:
+        changed = {member_id for member_id, in conn.exec_driver_sql("SELECT member_id FROM member_changes")}
+    assert changed == set(range(1, 8))
+
+
+def test_chunk_holds_the_write_lock_while_it_hands_out_ids(db, tmp_path, monkeypatch):
+    path = db[len('sqlite:///'):]
+    read_max = []
+    drop = bulk_import._drop_insert_triggers
+
+    def drop_and_try_writing(conn):  # another writer, after the chunk read max(id) and before it inserted
+        other = sqlite3.connect(path, timeout=0)
+        try:
+            with pytest.raises(sqlite3.OperationalError, match='locked'):
+                other.execute("INSERT INTO members (first_name, last_name) VALUES ('Other', 'Writer')")
+        finally:
+            other.close()
+        read_max.append(True)
+        return drop(conn)
+    monkeypatch.setattr(bulk_import, '_drop_insert_triggers', drop_and_try_writing)
+
+    assert import_members(write_file(tmp_path / 'members.txt', 2))[0] == 2
+    assert read_max == [True]
+    assert session.query(models.Member).count() == 2
+
+
+def test_failed_chunk_keeps_the_triggers(db, tmp_path, monkeypatch):
+    monkeypatch.setitem(BULK_INSERT_STEPS, 'members_fts_ai', "SELECT no_such_column FROM members")
+    with pytest.raises(RuntimeError, match='Import stopped after 0 members'):
+        import_members(write_file(tmp_path / 'members.txt', 2))
+    assert set(BULK_INSERT_STEPS) <= triggers()
+    assert session.query(models.Member).count() == 0
@@ -0,0 +1,34 @@
+from cache import LookupCache, cached_lookup
+
+
+def test_lookup_is_cached_until_invalidated():
+    cache, reads = LookupCache('test'), []
+
+    @cached_lookup(cache, lambda name: ('name', name), row_id_fn=lambda value: value[0])
+    def lookup(name):
+        reads.append(name)
+        return (1, name)
+
+    assert lookup('a') == lookup('a') == (1, 'a')
+    assert reads == ['a']
+    cache.invalidate(row_ids=[1])
+    lookup('a')
+    assert reads == ['a', 'a']
+
+
+def test_value_read_before_an_invalidation_is_not_stored():
+    cache, rows = LookupCache('test'), {'a': 'old'}
+
+    @cached_lookup(cache, lambda name: ('name', name), row_id_fn=lambda value: None)
+    def lookup(name):
+        value = rows[name]
+        if value == 'old':  # another session commits a change (and invalidates) while this read is in flight
+            rows[name] = 'new'
+            cache.invalidate(keys=[('name', name)])
+        return value
+
+    assert lookup('a') == 'old'
+    assert lookup('a') == 'new'  # the stale read was dropped, not served for the whole ttl
+    assert lookup('a') == 'new' and cache.stats()['hits'] == 1
+    assert cache.stats()['stale_puts'] == 1
+
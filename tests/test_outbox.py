@@ -0,0 +1,132 @@
+import datetime
+import pytest
+from sqlalchemy import update
+
+import daily_tasks
+from database import session, get_engine
+from models import OutboxMessage, OutboxStatus, enqueue_messages, outbox_counts
+from transports import FakeTransport
+
+
+@pytest.fixture
+def transport(db, monkeypatch):  # every send goes to a FakeTransport, without the account's rate limit
+    fake = FakeTransport()
+    monkeypatch.setattr(daily_tasks, '_transport', fake)
+    monkeypatch.setattr(daily_tasks, 'MESSAGES_PER_SECOND', 0)
+    return fake
+
+
+def messages(count, prefix='test'):
+    return [(f"{prefix}:{i}", f"+2778120{i:04d}", f"message {i}") for i in range(count)]
+
+
+def make_due():  # as if the backoff or the lease had run out
+    session.execute(update(OutboxMessage).values(next_attempt_at=datetime.datetime.now() - datetime.timedelta(seconds=1)))
+    session.commit()
+
+
+def test_enqueue_skips_keys_already_queued(db):
+    assert enqueue_messages(messages(3)) == 3
+    assert enqueue_messages(messages(3)) == 0
+    assert enqueue_messages(messages(4)) == 1
+    assert session.query(OutboxMessage).count() == 4
+
+
+def test_enqueue_keeps_the_first_body_for_a_key(db):
+    enqueue_messages([('same', '+27781205705', 'first')])
+    enqueue_messages([('same', '+27781205705', 'second')])
+    assert [row.body for row in session.query(OutboxMessage)] == ['first']
+
+
+def test_drain_sends_every_due_message(transport):
+    enqueue_messages(messages(5))
+    assert daily_tasks.drain_outbox(batch_size=2) == (5, 0, 0)
+    assert outbox_counts() == {'Sent': 5}
+    rows = session.query(OutboxMessage).all()
+    assert all(row.attempts == 1 and row.provider_sid and row.claim_token is None for row in rows)
+    assert sorted(to_number for _, to_number, _ in transport.sent) == sorted(row.to_number for row in rows)
+    assert daily_tasks.drain_outbox() == (0, 0, 0)  # nothing is sent twice
+
+
+def test_failed_send_is_retried_after_a_backoff(transport):
+    enqueue_messages(messages(1))
+    transport.error_rate = 1.0
+    before = datetime.datetime.now()
+    assert daily_tasks.drain_outbox() == (0, 1, 0)
+    row = session.query(OutboxMessage).one()
+    assert row.status == OutboxStatus.Pending and row.attempts == 1 and row.last_error
+    assert row.next_attempt_at >= before + datetime.timedelta(seconds=daily_tasks.OUTBOX_BACKOFF_SECONDS)
+    assert daily_tasks.drain_outbox() == (0, 0, 0)  # not due yet
+
+    transport.error_rate = 0.0
+    make_due()
+    assert daily_tasks.drain_outbox() == (1, 0, 0)
+    session.expire_all()
+    row = session.query(OutboxMessage).one()
+    assert row.status == OutboxStatus.Sent and row.attempts == 2 and row.last_error is None
+
+
+def test_message_is_dead_after_max_attempts(transport):
+    enqueue_messages(messages(1))
+    transport.error_rate = 1.0
+    assert daily_tasks.drain_outbox(max_attempts=3) == (0, 1, 0)
+    make_due()
+    assert daily_tasks.drain_outbox(max_attempts=3) == (0, 1, 0)
+    make_due()
+    assert daily_tasks.drain_outbox(max_attempts=3) == (0, 0, 1)
+    make_due()
+    assert daily_tasks.drain_outbox(max_attempts=3) == (0, 0, 0)  # dead messages are never claimed again
+    session.expire_all()
+    row = session.query(OutboxMessage).one()
+    assert row.status == OutboxStatus.Dead and row.attempts == 3
+
+
+def test_claimed_message_waits_for_its_lease(transport):
+    enqueue_messages(messages(2))
+    now = datetime.datetime.now()
+    # another worker claimed the first message and is still sending it; the second one's worker died
+    session.execute(update(OutboxMessage).where(OutboxMessage.idempotency_key == 'test:0').values(
+        status=OutboxStatus.Sending, claim_token='alive', next_attempt_at=now + datetime.timedelta(minutes=5)))
+    session.execute(update(OutboxMessage).where(OutboxMessage.idempotency_key == 'test:1').values(
+        status=OutboxStatus.Sending, claim_token='died', next_attempt_at=now - datetime.timedelta(seconds=1)))
+    session.commit()
+
+    assert daily_tasks.drain_outbox() == (1, 0, 0)
+    assert [to_number for _, to_number, _ in transport.sent] == ['+27781200001']
+    session.expire_all()
+    claimed = session.query(OutboxMessage).filter(OutboxMessage.idempotency_key == 'test:0').one()
+    assert claimed.status == OutboxStatus.Sending and claimed.claim_token == 'alive'
+
+
+@pytest.mark.parametrize('error_rate', [0.0, 1.0], ids=['sent', 'failed'])
+def test_worker_that_lost_its_lease_leaves_the_row_alone(transport, monkeypatch, error_rate):
+    enqueue_messages(messages(1))
+    transport.error_rate = error_rate
+    send = transport.send
+
+    def slow_send(to_number, body):  # the lease runs out mid-send and another worker claims the row again
+        with get_engine().begin() as conn:
+            conn.execute(update(OutboxMessage.__table__).values(
+                claim_token='other', next_attempt_at=datetime.datetime.now() + datetime.timedelta(minutes=10)))
+        return send(to_number, body)
+    monkeypatch.setattr(transport, 'send', slow_send)
+
+    assert daily_tasks.drain_outbox() == (0, 0, 0)
+    session.expire_all()
+    row = session.query(OutboxMessage).one()
+    assert row.status == OutboxStatus.Sending and row.claim_token == 'other' and row.attempts == 0
+
+
+def test_batches_reuse_the_send_threads(transport, monkeypatch):  # and with them the transport's per-thread clients
+    import threading
+    threads, send = set(), transport.send
+
+    def send_and_note(to_number, body):
+        threads.add(threading.current_thread())
+        return send(to_number, body)
+    monkeypatch.setattr(transport, 'send', send_and_note)
+
+    for batch in range(3):
+        sent, failed = daily_tasks.dispatch_messages(messages(20, f"batch{batch}"), workers=4)
+        assert len(sent) == 20 and not failed
+    assert len(threads) <= 4
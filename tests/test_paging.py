@@ -0,0 +1,104 @@
+import datetime
+import pytest
+
+import models
+from database import session
+from models import Member, Event, VolunteerOpportunity, MemberVolunteering
+from segments import where
+
+# every listing walked page by page, for every sort key in both directions, must return each row once and in
+# the same order as sorting all of them; the data has ties on every sort key and NULLs in the nullable ones
+
+NAMES = [('Anna', 'Zulu'), ('Anna', 'Zulu'), ('Ben', 'Adams'), ('Anna', 'Adams'), ('Cleo', 'Moyo'),
+         ('Ben', 'Zulu'), ('Dumi', 'Moyo'), ('Anna', 'Moyo'), ('Cleo', 'Adams'), ('Ben', 'Adams'), ('Eve', 'Nel')]
+PHONES = ['0781205705', None, '0825551234', '0781205705', None, '0611111111', '0825551234', None, '0611111111',
+          '0720000000', None]
+JOIN_DATES = ['2020-01-01', '2019-05-05', None, '2020-01-01', '2021-03-03', None, '2019-05-05', '2020-01-01',
+              '2022-02-02', None, '2019-05-05']
+
+
+@pytest.fixture
+def listings(db):
+    session.add_all([Member(first_name=first, last_name=last, phone_number=phone, join_date=joined)
+                     for (first, last), phone, joined in zip(NAMES, PHONES, JOIN_DATES)])
+    for i in range(10):
+        session.add(Event(name=['Choir', 'Bazaar', 'Choir', 'Youth'][i % 4], event_date=datetime.date(2030, 1, 1 + i % 3),
+                          start_time='10:00', end_time='11:00', location=['Hall', 'Church', 'Hall'][i % 3]))
+    session.add_all([VolunteerOpportunity(name=['Ushers', 'Kitchen', 'Ushers'][i % 3], date_posted=f"2030-0{1 + i % 2}-01",
+                                          location='Hall') for i in range(7)])
+    session.flush()
+    session.add_all([MemberVolunteering(member_id=member_id, opportunity_id=opportunity_id,
+                                        date_volunteered=f"2030-02-0{1 + (member_id + opportunity_id) % 3}")
+                     for member_id in range(1, 12) for opportunity_id in range(1, 8) if (member_id * opportunity_id) % 3 == 0])
+    session.commit()
+
+
+def walk(fetch, limit, **kwargs):  # every row, fetched limit at a time
+    rows, after = [], None
+    for _ in range(100):
+        page, after = fetch(after=after, limit=limit, **kwargs)
+        assert len(page) <= limit
+        rows.extend(page)
+        if after is None:
+            return rows
+    pytest.fail("paging never reached the last page")
+
+
+# listing -> (page function, {sort key: the row's place in that order, ending with the tie-breaker})
+LISTINGS = {
+    'members': (models.get_members_page, {
+        'id': lambda row: (row[0],),
+        'first_name': lambda row: (row[1], row[2], row[0]),
+        'last_name': lambda row: (row[2], row[1], row[0]),
+        'phone_number': lambda row: (row[3] or '', row[0]),
+        'join_date': lambda row: (row[4] or '', row[0]),
+    }),
+    'events': (models.get_events_page, {
+        'id': lambda row: (row[0],),
+        'name': lambda row: (row[1], row[2], row[0]),
+        'event_date': lambda row: (row[2], row[0]),
+        'location': lambda row: (row[4], row[0]),
+    }),
+    'opportunities': (models.get_opportunities_page, {
+        'id': lambda row: (row[0],),
+        'name': lambda row: (row[1], row[0]),
+        'date_posted': lambda row: (row[2], row[0]),
+    }),
+    'volunteering': (models.get_volunteering_page, {
+        'member': lambda row: (row[0], row[3]),
+        'opportunity': lambda row: (row[3], row[0]),
+        'date_volunteered': lambda row: (row[5], row[0], row[3]),
+    }),
+}
+CASES = [(listing, sort) for listing, (_, orders) in LISTINGS.items() for sort in orders]
+
+
+@pytest.mark.parametrize('descending', [False, True], ids=['ascending', 'descending'])
+@pytest.mark.parametrize('listing, sort', CASES, ids=[f"{listing}-{sort}" for listing, sort in CASES])
+def test_walk_returns_every_row_once_in_order(listings, listing, sort, descending):
+    fetch, orders = LISTINGS[listing]
+    everything, after = fetch(limit=None, sort=sort)
+    assert after is None
+    expected = sorted(everything, key=orders[sort], reverse=descending)
+    for limit in (1, 3, 4, len(everything)):
+        assert walk(fetch, limit, sort=sort, descending=descending) == expected
+
+
+def test_last_full_page_is_followed_by_an_empty_one(listings):
+    rows, after = models.get_opportunities_page(limit=7)
+    assert len(rows) == 7 and after is not None
+    assert models.get_opportunities_page(after=after, limit=7) == ([], None)
+
+
+@pytest.mark.parametrize('listing, criteria, count', [
+    ('members', where('join_date', 'eq', '2020-01-01'), models.count_members),
+    ('events', where('location', 'eq', 'Hall'), models.count_events),
+    ('opportunities', where('name', 'eq', 'Ushers'), models.count_opportunities),
+    ('volunteering', where('opportunity_id', 'eq', 3), models.count_volunteering),
+])
+def test_filtered_walk_matches_its_count(listings, listing, criteria, count):
+    fetch, orders = LISTINGS[listing]
+    sort = list(orders)[1]
+    rows = walk(fetch, 2, sort=sort, criteria=criteria)
+    assert 0 < len(rows) == count(criteria) < len(fetch(limit=None, sort=sort)[0])
+    assert rows == sorted(rows, key=orders[sort])
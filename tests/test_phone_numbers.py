@@ -0,0 +1,65 @@
+import pytest
+
+import models
+from database import session
+from models import Member, normalize_phone
+
+
+@pytest.mark.parametrize('number, expected', [
+    ('+27781205705', '+27781205705'),
+    ('+27 78 120 5705', '+27781205705'),
+    ('078 120 5705', '+27781205705'),
+    ('078-120-5705', '+27781205705'),
+    ('(078) 120.5705', '+27781205705'),
+    ('0027781205705', '+27781205705'),
+    ('27781205705', '+27781205705'),
+    ('+1 415 555 2671', '+14155552671'),
+    ('0044 20 7946 0958', '+442079460958'),
+    (27781205705, '+27781205705'),  # read from a spreadsheet as a number
+])
+def test_normalized(number, expected):
+    assert normalize_phone(number) == expected
+
+
+@pytest.mark.parametrize('number', [None, '', '   ', '12345', 'not a number', '+0781205705', '+1234567890123456',
+                                    '078 120 5705 ext 2'])
+def test_unusable_numbers_are_none(number):
+    assert normalize_phone(number) is None
+
+
+def test_national_numbers_use_the_configured_country_code(monkeypatch):
+    monkeypatch.setattr(models, 'PHONE_COUNTRY_CODE', '44')
+    assert normalize_phone('020 7946 0958') == '+442079460958'
+
+
+def test_phone_e164_is_kept_current(db):
+    member = Member(first_name='Phone', last_name='Number', phone_number='078 120 5705')
+    session.add(member)
+    session.commit()
+    assert member.phone_e164 == '+27781205705'
+    member.phone_number = '082-555-1234'
+    session.commit()
+    assert member.phone_e164 == '+27825551234'
+    member.phone_number = 'unknown'
+    session.commit()
+    assert member.phone_e164 is None
+
+
+def test_migration_moves_queued_messages_to_the_normalized_number(db):
+    from database import get_engine
+    from migrations import _normalize_outbox_numbers
+    insert = ("INSERT INTO outbox (idempotency_key, to_number, body, status, attempts, next_attempt_at, created_at) "
+              "VALUES (?, ?, 'hi', ?, 0, '2030-01-01', '2030-01-01')")
+    with get_engine().begin() as conn:
+        for key, number, status in [('reminder:1:078 120 5705', '078 120 5705', 'Sent'),
+                                    ('reminder:1:+27781205705', '+27781205705', 'Pending'),  # same phone, not sent yet
+                                    ('broadcast:news:082-555-1234', '082-555-1234', 'Pending'),
+                                    ('birthday:2030-01-01:7', '0821234567', 'Pending'),  # keyed by member, left alone
+                                    ('reminder:1:unknown', 'unknown', 'Pending')]:
+            conn.exec_driver_sql(insert, (key, number, status))
+        _normalize_outbox_numbers(conn)
+        rows = conn.exec_driver_sql("SELECT idempotency_key, to_number, status FROM outbox ORDER BY id").fetchall()
+    assert rows == [('reminder:1:+27781205705', '+27781205705', 'Sent'),
+                    ('broadcast:news:+27825551234', '+27825551234', 'Pending'),
+                    ('birthday:2030-01-01:7', '0821234567', 'Pending'),
+                    ('reminder:1:unknown', 'unknown', 'Pending')]
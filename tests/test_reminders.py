@@ -0,0 +1,75 @@
+import datetime
+import pytest
+
+import daily_tasks
+from database import session
+from models import Member, Event, OutboxMessage
+
+TODAY = datetime.date(2030, 3, 1)
+
+
+@pytest.fixture
+def members(db):
+    session.add_all([Member(first_name='Member', last_name=str(i), phone_number=f"078120570{i}") for i in range(3)])
+    session.commit()
+
+
+def add_event(name):
+    day = daily_tasks.reminder_window(TODAY)[0]
+    event = Event(name=name, event_date=day, start_time='10:00', end_time='11:00', location='Hall')
+    session.add(event)
+    session.commit()
+    return event.id
+
+
+def queued(event_id):  # {number: body} of the reminders keyed by event_id
+    return {row.to_number: row.body for row in
+            session.query(OutboxMessage).filter(OutboxMessage.idempotency_key.like(f"reminder:{event_id}:%"))}
+
+
+def test_rerun_queues_nothing(members):
+    event_id = add_event('Choir practice')
+    assert daily_tasks.send_reminders(TODAY) == 3
+    assert daily_tasks.send_reminders(TODAY) == 0
+    assert len(queued(event_id)) == 3
+
+
+def test_event_added_later_is_reminded_on_its_own(members):
+    first = add_event('Choir practice')
+    assert daily_tasks.send_reminders(TODAY) == 3
+    second = add_event('Bazaar')
+    assert daily_tasks.send_reminders(TODAY) == 3
+    assert set(queued(second).values()) == {f"Reminder: The event 'Bazaar' is scheduled for "
+                                            f"{daily_tasks.reminder_window(TODAY)[0]} at 10:00."}
+    assert all('Bazaar' not in body for body in queued(first).values())
+
+
+def test_new_member_gets_every_event_in_one_message(members):
+    add_event('Choir practice')
+    daily_tasks.send_reminders(TODAY)
+    second = add_event('Bazaar')
+    session.add(Member(first_name='New', last_name='Member', phone_number='0825551234'))
+    session.commit()
+    assert daily_tasks.send_reminders(TODAY) == 4
+    rows = session.query(OutboxMessage).filter(OutboxMessage.to_number == '+27825551234').all()
+    assert len(rows) == 1 and 'Choir practice' in rows[0].body and 'Bazaar' in rows[0].body
+    assert len(queued(second)) == 3  # the others only hear about the new event
+
+
+def test_bulk_delete_of_events_drops_their_deliveries(members):
+    from bulk_operations import bulk_delete
+    from models import ReminderDelivery
+    from segments import where
+    kept, removed = add_event('Choir practice'), add_event('Bazaar')
+    daily_tasks.send_reminders(TODAY)
+    assert bulk_delete('events', where('name', 'eq', 'Bazaar'), expected=1) == 1
+    assert {event_id for event_id, in session.query(ReminderDelivery.event_id).distinct()} == {kept}
+
+
+def test_deleting_an_event_drops_its_deliveries(members):
+    from models import ReminderDelivery
+    event_id = add_event('Choir practice')
+    daily_tasks.send_reminders(TODAY)
+    session.delete(session.get(Event, event_id))
+    session.commit()
+    assert session.query(ReminderDelivery).count() == 0
@@ -0,0 +1,72 @@
+import datetime
+import pytest
+
+import scheduler
+from scheduler import Scheduler, ScheduledJob, SchedulerLock
+
+AT = datetime.time(7, 0)
+
+
+@pytest.fixture
+def runs():
+    return []
+
+
+@pytest.fixture
+def daily(tmp_path, runs):  # a scheduler with one daily job that notes the days it ran for
+    jobs = [ScheduledJob('reminders', runs.append, at=AT), ScheduledJob('drain', lambda: runs.append('drain'), every=30)]
+    return Scheduler(jobs, state_file=str(tmp_path / 'state.json'), lock_file=str(tmp_path / 'scheduler.lock'))
+
+
+def ran_on(sched, name, when):
+    sched.record(name, when, True)
+
+
+def test_due_days_are_every_missed_day(daily):
+    ran_on(daily, 'reminders', datetime.datetime(2030, 1, 5, 7, 0))
+    assert daily.due_days('reminders', datetime.datetime(2030, 1, 8, 6, 0)) == \
+        [datetime.date(2030, 1, 6), datetime.date(2030, 1, 7)]
+    assert daily.due_days('reminders', datetime.datetime(2030, 1, 8, 7, 30)) == \
+        [datetime.date(2030, 1, 6), datetime.date(2030, 1, 7), datetime.date(2030, 1, 8)]
+    assert daily.due_days('reminders', datetime.datetime(2030, 1, 5, 9, 0)) == []
+    assert daily.due_days('drain', datetime.datetime(2030, 1, 8)) == []
+
+
+def test_catch_up_is_capped(daily):
+    ran_on(daily, 'reminders', datetime.datetime(2030, 1, 1, 7, 0))
+    days = daily.due_days('reminders', datetime.datetime(2030, 1, 31, 8, 0))
+    assert len(days) == scheduler.CATCH_UP_DAYS and days[-1] == datetime.date(2030, 1, 31)
+
+
+def test_catch_up_runs_the_job_for_each_missed_day(daily, runs):
+    days = [datetime.date(2030, 1, 6), datetime.date(2030, 1, 7)]
+    daily._run('reminders', days)
+    assert runs == days
+    assert daily.load_state()['reminders']['ok'] is True
+
+
+def test_failed_day_does_not_stop_the_others(tmp_path, runs):
+    def run(day):
+        if day.day == 6:
+            raise ValueError('no database')
+        runs.append(day)
+    sched = Scheduler([ScheduledJob('reminders', run, at=AT)], state_file=str(tmp_path / 'state.json'),
+                      lock_file=str(tmp_path / 'scheduler.lock'))
+    sched._run('reminders', [datetime.date(2030, 1, 6), datetime.date(2030, 1, 7)])
+    assert runs == [datetime.date(2030, 1, 7)]
+    state = sched.load_state()['reminders']
+    assert state['ok'] is False and '2030-01-06' in state['error']
+
+
+def test_trigger_runs_for_today_and_records_it(daily, runs):
+    daily.trigger('reminders')
+    daily.trigger('drain')
+    assert runs == [datetime.date.today(), 'drain']
+    assert set(daily.load_state()) == {'reminders', 'drain'}
+
+
+def test_trigger_refuses_while_the_daemon_holds_the_lock(daily, runs):
+    with SchedulerLock(daily.lock.path):  # the daemon
+        with pytest.raises(RuntimeError, match='already running'):
+            daily.trigger('reminders')
+    assert runs == [] and daily.load_state() == {}
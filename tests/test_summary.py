@@ -0,0 +1,69 @@
+import pytest
+
+from database import session, get_engine
+from migrations import check_summary, rebuild_summary
+from models import (Member, Demographics, Marital_Status, EducationLevel, Involvement, Yes_No, AttendanceLevel,
+                    demographic_stats)
+from bulk_operations import bulk_delete
+from segments import where
+
+
+def member(i, marital_status=Marital_Status.Married, children=0, education_level=EducationLevel.College,
+           involvement=Involvement.Congregant, disabilities=Yes_No.No):
+    person = Member(first_name='Member', last_name=str(i), email=f"member{i}@example.com")
+    person.demographics.append(Demographics(marital_status=marital_status, children=children, family_at_home=1,
+                                            education_level=education_level, attendance=AttendanceLevel.Weekly,
+                                            involvement=involvement, disabilities=disabilities))
+    return person
+
+
+@pytest.fixture
+def members(db):
+    session.add_all([member(0), member(1, Marital_Status.Never_Married, children=2),
+                     member(2, children=4, education_level=EducationLevel.No_Matric, involvement=Involvement.Server),
+                     member(3, education_level=None, disabilities=Yes_No.Yes)])
+    session.commit()
+    assert check_summary() == []
+
+
+def test_counts_follow_orm_writes(members):
+    stats = demographic_stats()
+    assert (stats.members, stats.married, stats.with_children, stats.uneducated, stats.educated) == (4, 3, 2, 1, 2)
+
+    row = session.query(Demographics).join(Member).filter(Member.last_name == '0').one()
+    row.marital_status, row.children, row.involvement = Marital_Status.Widowed, 1, Involvement.Officer
+    session.commit()
+    assert check_summary() == []
+    stats = demographic_stats()
+    assert (stats.married, stats.with_children, stats.officers) == (2, 3, 1)
+
+    session.delete(row)
+    session.commit()
+    assert check_summary() == []
+    assert demographic_stats().members == 3
+
+
+def test_counts_follow_core_inserts(members):  # the bulk import writes with Core, past the ORM
+    with get_engine().begin() as conn:
+        conn.execute(Member.__table__.insert(), [{'id': 100 + i, 'first_name': 'Bulk', 'last_name': str(i)} for i in range(5)])
+        conn.execute(Demographics.__table__.insert(), [{'member_id': 100 + i, 'children': i, 'family_at_home': 0,
+                                                        'marital_status': Marital_Status.Divorced} for i in range(5)])
+    assert check_summary() == []
+    assert demographic_stats().members == 9
+
+
+def test_counts_follow_bulk_delete(members):
+    assert bulk_delete('members', where('marital_status', 'eq', 'Married')) == 3
+    assert check_summary() == []
+    stats = demographic_stats()
+    assert (stats.members, stats.married, stats.uneducated) == (1, 0, 0)
+
+
+def test_differences_are_reported_until_rebuilt(members):
+    with get_engine().begin() as conn:
+        conn.exec_driver_sql("UPDATE demographic_summary SET members = members + 2 "
+                             "WHERE dimension = 'marital_status' AND value = 'Married'")
+    assert check_summary() == [('marital_status', 'Married', 5, 3)]
+    with get_engine().begin() as conn:
+        rebuild_summary(conn)
+    assert check_summary() == []
@@ -0,0 +1,99 @@
+import time
+import random
+import itertools
+import threading
+from collections import deque
+
+# How daily_tasks.py hands a message to the outside world. A transport has one method,
+# send(to_number, body) -> message sid, which raises SendError when the message wasn't accepted.
+#
+#   TwilioTransport  the real thing; with base_url it talks to twilio_stub.py (or any other fake endpoint)
+#   FakeTransport    in-process, no network: for tests and load tests of everything up to the HTTP call
+#
+# ORG_MESSAGE_TRANSPORT=fake picks the fake for the whole process, see daily_tasks.get_transport;
+# load_test.py drives the jobs through either of them.
+
+
+SEND_TIMEOUT_SECONDS = 30  # a request to Twilio that takes longer is given up and counted as failed
+
+
+class SendError(Exception):  # throttled: the provider asked us to slow down (HTTP 429), the send can be tried again
+    def __init__(self, message, throttled=False, retry_after=None):
+        super().__init__(message)
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+
+class TwilioTransport:  # WhatsApp through the Twilio Messages API, one Client (and HTTP session) per sending thread
+    def __init__(self, account_sid, auth_token, from_number, base_url=None, timeout=SEND_TIMEOUT_SECONDS):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.base_url = base_url
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def client(self):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            from twilio.rest import Client  # only loaded once something is actually sent
+            from twilio.http.http_client import TwilioHttpClient
+            http_client = TwilioHttpClient(timeout=self.timeout, request_hooks={'response': [self._keep_retry_after]})
+            client = Client(self.account_sid, self.auth_token, http_client=http_client)
+            if self.base_url:
+                client.api.base_url = self.base_url
+            self.local.client = client
+        return client
+
+    def _keep_retry_after(self, response, *args, **kwargs):  # requests hook; TwilioRestException has no headers
+        self.local.retry_after = response.headers.get('Retry-After')
+
+    def send(self, to_number, body):
+        from requests.exceptions import RequestException
+        from twilio.base.exceptions import TwilioRestException
+        self.local.retry_after = None
+        try:
+            return self.client().messages.create(body=body, from_=self.from_number, to=f'whatsapp:{to_number}').sid
+        except TwilioRestException as e:
+            raise SendError(f"Twilio error {e.code or e.status}: {e.msg}", throttled=e.status == 429,
+                            retry_after=_seconds(self.local.retry_after) if e.status == 429 else None)
+        except RequestException as e:  # no answer at all: connection refused or reset, timeout, ...
+            raise SendError(f"Twilio request failed: {e}")
+
+
+def _seconds(retry_after):  # Retry-After in seconds, None if missing or an HTTP date
+    try:
+        return max(float(retry_after), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class FakeTransport:
+    # accepts every message after latency seconds, except for a share that fails (error_rate) or is
+    # throttled (throttle_rate); keeps the last `keep` messages in self.sent for inspection
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0, seed=None, keep=1000):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sids = itertools.count(1)
+        self.sent = deque(maxlen=keep)  # (sid, to_number, body)
+        self.counts = {'sent': 0, 'failed': 0, 'throttled': 0}
+
+    def send(self, to_number, body):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            roll = self.random.random()
+            if roll < self.throttle_rate:
+                self.counts['throttled'] += 1
+                raise SendError("Too Many Requests", throttled=True)
+            if roll < self.throttle_rate + self.error_rate:
+                self.counts['failed'] += 1
+                raise SendError(f"The 'To' number {to_number} is not a valid phone number")
+            self.counts['sent'] += 1
+            sid = f"SMfake{next(self.sids):026d}"
+            self.sent.append((sid, to_number, body))
+            return sid
+
@@ -0,0 +1,119 @@
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A local stand-in for the Twilio Messages API, so the send path can be exercised and measured offline.
+# It answers POST /2010-04-01/Accounts/<sid>/Messages.json like Twilio does (201 with a message resource,
+# or an error body with a Twilio error code) after a configurable delay, and fails or throttles (429) a
+# configurable share of the requests. GET /stats returns what it has seen so far.
+#
+#   python twilio_stub.py --port 8080 --latency-ms 80 --jitter-ms 40 --error-rate 0.01 --throttle-rate 0.02
+#   TWILIO_API_BASE_URL=http://127.0.0.1:8080 python daily_tasks.py run drain
+
+
+class StubSettings:
+    def __init__(self, latency_ms=50.0, jitter_ms=0.0, error_rate=0.0, throttle_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sids = itertools.count(1)
+        self.counts = {'accepted': 0, 'failed': 0, 'throttled': 0}
+
+    def outcome(self):  # ('accepted', sid), ('failed', None) or ('throttled', None), and the delay in seconds
+        with self.lock:
+            delay = max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            roll = self.random.random()
+            if roll < self.throttle_rate:
+                result = ('throttled', None)
+            elif roll < self.throttle_rate + self.error_rate:
+                result = ('failed', None)
+            else:
+                result = ('accepted', f"SM{next(self.sids):032x}")
+            self.counts[result[0]] += 1
+            return result, delay
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, the Twilio client reuses its connections
+
+    def reply(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with self.server.settings.lock:
+                self.reply(200, dict(self.server.settings.counts))
+        else:
+            self.reply(404, {'code': 20404, 'message': 'The requested resource was not found', 'status': 404})
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+        parts = self.path.strip('/').split('/')  # 2010-04-01/Accounts/<sid>/Messages.json
+        if len(parts) != 4 or parts[1] != 'Accounts' or parts[3] != 'Messages.json':
+            self.reply(404, {'code': 20404, 'message': 'The requested resource was not found', 'status': 404})
+            return
+        (result, sid), delay = self.server.settings.outcome()
+        time.sleep(delay)
+        to_number, body = form.get('To', [''])[0], form.get('Body', [''])[0]
+        if result == 'throttled':
+            self.reply(429, {'code': 20429, 'message': 'Too Many Requests', 'status': 429}, [('Retry-After', '1')])
+        elif result == 'failed':
+            self.reply(400, {'code': 21211, 'message': f"The 'To' number {to_number} is not a valid phone number.", 'status': 400})
+        else:
+            now = time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime())
+            self.reply(201, {'sid': sid, 'account_sid': parts[2], 'to': to_number, 'from': form.get('From', [''])[0],
+                             'body': body, 'status': 'queued', 'num_segments': '1', 'direction': 'outbound-api',
+                             'date_created': now, 'date_updated': now, 'api_version': '2010-04-01',
+                             'uri': f"/2010-04-01/Accounts/{parts[2]}/Messages/{sid}.json"})
+
+    def log_message(self, format, *args):  # one line per request would swamp a load test
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # room for every sending thread to connect at once
+
+    def __init__(self, address, settings):
+        super().__init__(address, StubHandler)
+        self.settings = settings
+
+
+def start_stub(port=0, **settings):  # runs a stub on a background thread, returns (server, base url); server.shutdown() stops it
+    server = StubServer(('127.0.0.1', port), StubSettings(**settings))
+    threading.Thread(target=server.serve_forever, name='twilio-stub', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-in for the Twilio Messages API.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='mean time before answering')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='the delay varies this much either way')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with error 21211')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = StubServer(('127.0.0.1', args.port), StubSettings(args.latency_ms, args.jitter_ms, args.error_rate,
+                                                               args.throttle_rate, args.seed))
+    print(f"Twilio stub listening on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,102 @@
+import logging
+from PyQt5 import QtCore
+from database import session
+
+# Runs database work and message sending on a QThreadPool so the window never freezes.
+# Each worker thread gets its own session (database.session is a scoped_session registry), which is
+# closed when the task ends. Results come back to the UI thread through Qt signals.
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskSignals(QtCore.QObject):  # QRunnable can't emit signals itself
+    result = QtCore.pyqtSignal(object)
+    error = QtCore.pyqtSignal(str)
+    progress = QtCore.pyqtSignal(object)
+    done = QtCore.pyqtSignal()  # always emitted last, after result/error (or nothing when cancelled)
+
+
+class Task(QtCore.QRunnable):
+    # fn(*args, **kwargs) runs on a pool thread; with pass_task=True the task itself is passed as the
+    # keyword argument 'task' so long jobs can report progress and stop early when cancelled
+    def __init__(self, fn, args=(), kwargs=None, pass_task=False):
+        super().__init__()
+        self.setAutoDelete(False)  # the runner keeps the reference until 'done'
+        self.fn = fn
+        self.args = args
+        self.kwargs = dict(kwargs or {})
+        if pass_task:
+            self.kwargs['task'] = self
+        self.signals = TaskSignals()
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check_cancelled(self):  # for long jobs: call between steps to stop early
+        if self.cancelled:
+            raise TaskCancelled('Cancelled')
+
+    def report(self, value):  # for long jobs: sends value to the progress handler
+        self.check_cancelled()
+        self.signals.progress.emit(value)
+
+    def run(self):
+        try:
+            if self.cancelled:
+                return
+            result = self.fn(*self.args, **self.kwargs)
+            if not self.cancelled:
+                self.signals.result.emit(result)
+        except TaskCancelled:
+            pass
+        except Exception as e:
+            logging.error(f'Background task {getattr(self.fn, "__name__", self.fn)} failed: {e}', exc_info=True)
+            if not self.cancelled:
+                self.signals.error.emit(str(e))
+        finally:
+            # give the connection back to the pool, any ORM objects in the result stay readable (detached)
+            session.remove()
+            self.signals.done.emit()
+
+
+class TaskRunner(QtCore.QObject):
+    busy_changed = QtCore.pyqtSignal(bool)
+
+    def __init__(self, max_threads=4, parent=None):
+        super().__init__(parent)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.tasks = set()
+
+    def submit(self, fn, *args, on_result=None, on_error=None, on_progress=None, pass_task=False, **kwargs):
+        task = Task(fn, args, kwargs, pass_task)
+        if on_result:
+            task.signals.result.connect(on_result)
+        if on_error:
+            task.signals.error.connect(on_error)
+        if on_progress:
+            task.signals.progress.connect(on_progress)
+        task.signals.done.connect(lambda: self._finished(task))
+        self.tasks.add(task)
+        if len(self.tasks) == 1:
+            self.busy_changed.emit(True)
+        self.pool.start(task)
+        return task
+
+    def cancel_all(self):
+        for task in list(self.tasks):
+            task.cancel()
+            if self.pool.tryTake(task):  # never started, so it won't emit 'done'
+                self._finished(task)
+
+    def is_busy(self):
+        return bool(self.tasks)
+
+    def _finished(self, task):
+        if task in self.tasks:
+            self.tasks.discard(task)
+            if not self.tasks:
+                self.busy_changed.emit(False)